@@ -4,11 +4,16 @@ Author: David Jorge
 This is the app script for launching the dashboard for the LTE-M Edge Sensor Project.
 """
 
+import datetime
+import os
+import urllib.error
+import urllib.request
 import dash
-import dash_core_components as dcc
-import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash import dcc, html, no_update, Patch
+from dash.dependencies import Input, Output, State
+from flask import Response, request
 import pullS3
+from ingester import StoreReader
 
 # Get external stylesheet
 external_stylesheets = [
@@ -23,9 +28,51 @@ external_stylesheets = [
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 app.title = "LTE-M Edge Sensor Dashboard"
 
-# Initialize AWS API library
-aws = pullS3.pullS3()
-aws.pull()
+# Seconds between data pulls while no S3 event notifications are received
+UPDATE_INTERVAL = 60
+
+# Seconds between dashboard refreshes when the event stream is down, updates are otherwise pushed through /events
+FALLBACK_INTERVAL = 300
+
+# Seconds between event stream keep-alive comments, lets the server notice disconnected clients
+KEEPALIVE_INTERVAL = 15
+
+# Shared secret S3 event notifications must carry (?token=...), checked if set
+EVENT_TOKEN = os.environ.get("S3_EVENT_TOKEN")
+
+# Store written by a separate ingester process (ingester.py), the dashboard then only reads from it and forwards S3
+# event notifications to the ingester. Unset, the dashboard pulls from S3 itself
+INGEST_STORE = os.environ.get("INGEST_STORE")
+INGESTER_URL = os.environ.get("INGESTER_URL", "http://127.0.0.1:8051")
+
+# Time range selector options for the deliveries chart, None shows everything since the first detection
+WINDOWS = {
+    "day": datetime.timedelta(days=1),
+    "week": datetime.timedelta(weeks=1),
+    "month": datetime.timedelta(days=30),
+    "year": datetime.timedelta(days=365),
+    "all": None,
+}
+DEFAULT_WINDOW = "all"
+TITLES = {"hour": "Hourly Deliveries", "day": "Daily Deliveries", "week": "Weekly Deliveries"}
+
+if __name__ == "__mp_main__":
+    # Image decoder workers (see pullS3.decoderPool) import this script again, they neither pull nor read the store
+    aws = ingester = None
+elif INGEST_STORE:
+    # Read what the ingester process writes, refreshed in the background
+    aws = StoreReader(INGEST_STORE)
+    aws.start()
+    ingester = None
+else:
+    # Initialize AWS API library
+    aws = pullS3.pullS3()
+    aws.metrics.interval = UPDATE_INTERVAL
+    aws.pull()
+
+    # Pull in the background from now on, callbacks only read
+    ingester = pullS3.Ingester(aws, interval=UPDATE_INTERVAL)
+    ingester.start()
 
 
 def getCounts():
@@ -37,134 +84,13 @@ def getCounts():
     return [aws.count["Parcel"], aws.count["Damaged Parcel"]]
 
 
-# Define the dashboard HTML layout
-app.layout = html.Div(
-    children=[
-        html.Div(
-            children=[
-                html.P(children="📦", className="header-emoji"),
-                html.P(children="📡", className="header-emoji"),
-                html.H1(
-                    children="LTE-M Sensor Analytics", className="header-title"
-                ),
-                html.P(
-                    children="Analyze the output of the LTE-M sensor"
-                             " stored in AWS",
-                    className="header-description",
-                ),
-            ],
-            className="header",
-        ),
-        html.Div(
-            [
-                html.Div(
-                    [
-                        html.H1(
-                            id="live-update-header", children="Latest Parcel", className="header-description2"
-                        ),
-                        html.Img(
-                            id="live-update-img",
-                            src=app.get_asset_url("{}.png".format(aws.mostRecent[0])),
-                            className="image",
-                        ),
-                        html.Div(
-                            [
-                                html.Span(
-                                    children="Condition: ",
-                                ),
-                                html.Span(
-                                    id="cond",
-                                    children="Good" if aws.mostRecent[1] == "Parcel" else "Bad",
-                                    className="label-good" if aws.mostRecent[1] == "Parcel" else "label-bad",
-                                ),
-                            ],
-                            id="parcel-label",
-                            className="label",
-                        ),
-                        html.H1(
-                            id="live-update-metadata", children="Parcel Info", className="header-description3"
-                        ),
-                        html.Img(
-                            id="live-update-barcode",
-                            src=app.get_asset_url("{}-b.png".format(aws.mostRecent[0])),
-                            className="image barcode",
-                        ),
-                        html.H1(
-                            id="live-update-metadata2", children="Parcel Info", className="header-description4"
-                        ),
-                        dcc.Interval(
-                            id='interval-component',
-                            interval=60 * 1000,  # in milliseconds
-                            n_intervals=0
-                        ),
-                    ],
-                    className="card",
-                    id="test"
-                ),
-                html.Div(
-                    [
-                        dcc.Graph(
-                            id="count-chart",
-                            figure={
-                                "data": [
-                                    {"x": ["Parcel", "Damaged Parcel"], "y": getCounts(), "type": "bar"},
-                                ],
-                                "layout": {
-                                    "title": {
-                                        "text": "Condition",
-                                    },
-                                    "xaxis": {"tickmode": "linear", "tick0": 0, "dtick": 1},
-                                    "colorway": ["#17B897"],
-                                },
-                            }
-                        )
-                    ],
-                    className="card"
-                ),
-                html.Div(
-                    [
-                        dcc.Graph(
-                            id="hourly-chart",
-                            figure={
-                                "data": [
-                                    {"x": aws.df["Date"], "y": aws.df["Count"], "type": "bar", },
-                                ],
-                                "layout": {
-                                    "title": {
-                                        "text": "Hourly Deliveries",
-                                    },
-                                    "xaxis": {"fixedrange": True},
-                                    "yaxis": {
-                                        "fixedrange": True,
-                                    },
-                                    "colorway": ["#E12D39"],
-                                },
-                            }
-                        )
-                    ],
-                    className="card"
-                ),
-            ],
-            className="wrapper",
-        ),
-    ]
-)
-
-
-# Define callback function to implement live update of data on the dashboard.
-@app.callback(Output(component_id='live-update-img', component_property='src'),
-              Output(component_id='live-update-barcode', component_property='src'),
-              Output(component_id="count-chart", component_property="figure"),
-              Output(component_id="hourly-chart", component_property="figure"),
-              Output(component_id="cond", component_property="children"),
-              Output(component_id="cond", component_property="className"),
-              Input(component_id='interval-component', component_property='n_intervals'))
-def update_metrics(n_intervals):
-    # Get up to date data
-    aws.pull()
+def getCountFigure():
+    """
+    Helper function for building the parcel condition total count bar graph.
 
-    # Update parcel condition total count bar graph
-    updatedFigBar = {
+    :return: Figure dictionary.
+    """
+    return {
         "data": [
             {"x": ["Good Condition", "Bad Condition"], "y": getCounts(), "type": "bar"},
         ],
@@ -177,14 +103,100 @@ def update_metrics(n_intervals):
         },
     }
 
-    # Update hourly delivery count bar graph
-    updatedFigHourly = {
+
+def getLabelCounts():
+    """
+    Helper function for comparing device labels with the cloud labels of the latest re-classification model (see
+    reclassify.py).
+
+    :return: Model version (None if nothing was re-classified), Dictionary - (device label, cloud label) to count.
+    """
+    records = [record for record in aws.cloudLabels.values() if "label" in record]
+    if not records:
+        return None, {}
+    model = max(records, key=lambda record: record["cloud"]["classified"])["cloud"]["model"]
+    counts = {}
+    for record in records:
+        if record["cloud"]["model"] == model:
+            key = (record["label"], record["cloud"]["label"])
+            counts[key] = counts.get(key, 0) + 1
+    return model, counts
+
+
+def getLabelFigure():
+    """
+    Helper function for building the device versus cloud label bar graph: for each device label, how the cloud model
+    labelled the same images.
+
+    :return: Figure dictionary.
+    """
+    model, counts = getLabelCounts()
+    device = ["Parcel", "Damaged Parcel"]
+    cloud = device + sorted({label for _, label in counts if label not in device})
+    total = sum(counts.values())
+    agreed = sum(counts.get((label, label), 0) for label in device)
+    title = "Device vs Cloud Labels"
+    if total:
+        title += " ({}, {:.0%} agree)".format(model, agreed / total)
+    return {
         "data": [
-            {"x": aws.df["Date"], "y": aws.df["Count"], "type": "bar", },
+            {"x": ["Good Condition", "Bad Condition"], "y": [counts.get((d, c), 0) for d in device], "type": "bar",
+             "name": "Cloud: " + c}
+            for c in cloud
         ],
         "layout": {
             "title": {
-                "text": "Hourly Deliveries",
+                "text": title,
+            },
+            "barmode": "group",
+            "xaxis": {"title": "Device label", "fixedrange": True},
+            "yaxis": {"fixedrange": True},
+            "colorway": ["#17B897", "#E12D39", "#2D3142"],
+        },
+    }
+
+
+def getWindow(window):
+    """
+    Helper function for getting the time range of a deliveries chart window.
+
+    :param window: WINDOWS key.
+    :return: Start (None for everything), End - datetime objects.
+    """
+    end = datetime.datetime.now(datetime.timezone.utc)
+    return (end - WINDOWS[window] if WINDOWS[window] else None), end
+
+
+def getAxisRange(keys, resolution):
+    """
+    Helper function for getting the x axis range showing a run of bars, half a bar of margin on either side.
+
+    :param keys: First and last bucket start times.
+    :param resolution: Rollup resolution name.
+    :return: List - Range start, Range end.
+    """
+    half = dict(pullS3.Rollups.RESOLUTIONS)[resolution] / 2
+    return [(keys[0] - half).isoformat(), (keys[-1] + half).isoformat()]
+
+
+def getHourlyFigure(window=DEFAULT_WINDOW):
+    """
+    Helper function for building the delivery count bar graph over a window, from the rollup resolution that keeps it
+    at a readable number of bars.
+
+    :param window: WINDOWS key.
+    :return: Figure dictionary, Dictionary - what the figure shows, for incremental updates (see getHourlyUpdate).
+    """
+    start, end = getWindow(window)
+    resolution, keys, counts = aws.rollups.query(start, end)
+    shown = {"window": window, "resolution": resolution, "first": None, "n": len(keys), "start": None}
+    figure = {
+        "data": [
+            {"x": [key.isoformat() for key in keys], "y": counts, "type": "bar", },
+        ],
+        "layout": {
+            "title": {
+                "text": TITLES[resolution],
             },
             "xaxis": {"fixedrange": True},
             "yaxis": {
@@ -193,13 +205,357 @@ def update_metrics(n_intervals):
             "colorway": ["#E12D39"],
         },
     }
+    if keys:
+        shown["first"] = shown["start"] = keys[0].isoformat()
+        figure["layout"]["xaxis"]["range"] = getAxisRange(keys, resolution)
+    return figure, shown
+
+
+def getHourlyUpdate(window, version, shown):
+    """
+    Helper function for updating a client's delivery count bar graph. The client's bars are a run of consecutive
+    buckets: counts changed since its version are set in place, buckets that started since are appended and the axis
+    range slides over them. The whole figure is sent when the window or resolution changes, when a detection lands
+    before the first bar, or once the run of bars is twice as long as the window needs.
+
+    :param window: WINDOWS key.
+    :param version: Data version the client last saw.
+    :param shown: What the client's figure shows, from getHourlyFigure or a previous update.
+    :return: Figure dictionary, Patch or no_update, Dictionary - what the figure shows after the update.
+    """
+    start, end = getWindow(window)
+    if shown["window"] != window or not shown["first"]:
+        return getHourlyFigure(window)
+    resolution, keys, counts = aws.rollups.query(start, end)
+    first = datetime.datetime.fromisoformat(shown["first"])
+    if resolution != shown["resolution"] or not keys or keys[0] < first:
+        return getHourlyFigure(window)
+    step = dict(pullS3.Rollups.RESOLUTIONS)[resolution]
+    new = [i for i, key in enumerate(keys) if (key - first) // step >= shown["n"]]
+    if shown["n"] + len(new) > 2 * pullS3.Rollups.MAX_POINTS:
+        return getHourlyFigure(window)
+
+    patched = Patch()
+    changed = False
+    for key, count in aws.rollups.changed(resolution, version, first, end):
+        i = (key - first) // step
+        if i < shown["n"]:
+            patched["data"][0]["y"][i] = count
+            changed = True
+    if new:
+        patched["data"][0]["x"].extend([keys[i].isoformat() for i in new])
+        patched["data"][0]["y"].extend([counts[i] for i in new])
+    if new or keys[0].isoformat() != shown["start"]:
+        patched["layout"]["xaxis"]["range"] = getAxisRange(keys, resolution)
+    elif not changed:
+        return no_update, shown
+    return patched, dict(shown, n=shown["n"] + len(new), start=keys[0].isoformat())
+
+
+def getClientState(hourly):
+    """
+    Helper function describing what a client's page holds, stored client side so that later updates only carry what
+    changed since.
+
+    :param hourly: What the deliveries chart shows (see getHourlyFigure).
+    :return: Dictionary - data version, deliveries chart, ops chart pulls and device stats entries.
+    """
+    return {"version": aws.version, "hourly": hourly, "pulls": aws.metrics.totals["pulls"],
+            "stats": len(aws.statsHistory)}
+
+
+def getOpsSeries(history, statsHistory):
+    """
+    Helper function for getting the operational panel series from pull records and device stats entries.
+
+    :param history: Pull records (see pullS3.PullMetrics).
+    :param statsHistory: (upload time, device stage stats) entries.
+    :return: List of (x, y) per trace: one per pull stage, fragments per second, device publish p95.
+    """
+    times = [record["time"] for record in history]
+    series = [(times, [record[stage] for record in history]) for stage in pullS3.PullMetrics.STAGES]
+    series.append((times, [record["fragmentsPerSecond"] for record in history]))
+    publish = [(t, stats["publish"]["p95"] / 1000) for t, stats in statsHistory if "publish" in stats]
+    series.append(([p[0] for p in publish], [p[1] for p in publish]))
+    return series
+
+
+def getOpsFigure():
+    """
+    Helper function for building the operational panel figure: time spent in each stage of recent pulls, fragments
+    processed per second, and device side publish times reported in image headers.
+
+    :return: Figure dictionary.
+    """
+    data = [{"x": x, "y": y, "type": "scatter"} for x, y in getOpsSeries(list(aws.metrics.history), aws.statsHistory)]
+    for trace, stage in zip(data, pullS3.PullMetrics.STAGES):
+        trace.update(stackgroup="pull", name="Pull: " + stage)
+    data[-2].update(name="Fragments/s", yaxis="y2")
+    data[-1].update(name="Device publish p95")
+    return {
+        "data": data,
+        "layout": {
+            "title": {
+                "text": "Ingest Performance",
+            },
+            "yaxis": {"title": "Seconds", "fixedrange": True},
+            "yaxis2": {"title": "Fragments/s", "overlaying": "y", "side": "right", "fixedrange": True},
+            "shapes": [{"type": "line", "xref": "paper", "x0": 0, "x1": 1, "y0": UPDATE_INTERVAL,
+                        "y1": UPDATE_INTERVAL, "line": {"dash": "dot", "color": "#E12D39"}}],
+            "colorway": ["#17B897", "#079A82", "#0B6E4F", "#5C8001", "#E12D39", "#2D3142"],
+        },
+    }
+
+
+def serveLayout():
+    """
+    Builds the dashboard HTML layout. Called on every page load, so that the figures and the client state stored with
+    them describe the same data.
+
+    :return: Layout.
+    """
+    with aws.lock:
+        return buildLayout()
+
+
+def buildLayout():
+    """
+    :return: Layout, see serveLayout.
+    """
+    hourlyFigure, hourly = getHourlyFigure()
+    return html.Div(
+        children=[
+            html.Div(
+                children=[
+                    html.P(children="📦", className="header-emoji"),
+                    html.P(children="📡", className="header-emoji"),
+                    html.H1(
+                        children="LTE-M Sensor Analytics", className="header-title"
+                    ),
+                    html.P(
+                        children="Analyze the output of the LTE-M sensor"
+                                 " stored in AWS",
+                        className="header-description",
+                    ),
+                ],
+                className="header",
+            ),
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            html.H1(
+                                id="live-update-header", children="Latest Parcel", className="header-description2"
+                            ),
+                            html.Img(
+                                id="live-update-img",
+                                src=app.get_asset_url("{}.png".format(aws.mostRecent[0])),
+                                className="image",
+                            ),
+                            html.Div(
+                                [
+                                    html.Span(
+                                        children="Condition: ",
+                                    ),
+                                    html.Span(
+                                        id="cond",
+                                        children="Good" if aws.mostRecent[1] == "Parcel" else "Bad",
+                                        className="label-good" if aws.mostRecent[1] == "Parcel" else "label-bad",
+                                    ),
+                                ],
+                                id="parcel-label",
+                                className="label",
+                            ),
+                            html.H1(
+                                id="live-update-metadata", children="Parcel Info", className="header-description3"
+                            ),
+                            html.Img(
+                                id="live-update-barcode",
+                                src=app.get_asset_url("{}-b.png".format(aws.mostRecent[0])),
+                                className="image barcode",
+                            ),
+                            html.H1(
+                                id="live-update-metadata2", children="Parcel Info", className="header-description4"
+                            ),
+                            dcc.Interval(
+                                id='interval-component',
+                                interval=FALLBACK_INTERVAL * 1000,  # in milliseconds
+                                n_intervals=0
+                            ),
+                            # Clicked by assets/live.js when the event stream reports new data
+                            html.Button(id="live-update", n_clicks=0, style={"display": "none"}),
+                            dcc.Store(id="client-state", data=getClientState(hourly)),
+                        ],
+                        className="card",
+                        id="test"
+                    ),
+                    html.Div(
+                        [
+                            dcc.Graph(
+                                id="count-chart",
+                                figure=getCountFigure(),
+                            )
+                        ],
+                        className="card"
+                    ),
+                    html.Div(
+                        [
+                            dcc.RadioItems(
+                                id="hourly-window",
+                                options=[{"label": window.capitalize(), "value": window} for window in WINDOWS],
+                                value=DEFAULT_WINDOW,
+                                inline=True,
+                                className="label",
+                            ),
+                            dcc.Graph(
+                                id="hourly-chart",
+                                figure=hourlyFigure,
+                            )
+                        ],
+                        className="card"
+                    ),
+                    html.Div(
+                        [
+                            dcc.Graph(
+                                id="label-chart",
+                                figure=getLabelFigure(),
+                            )
+                        ],
+                        className="card"
+                    ),
+                    html.Div(
+                        [
+                            dcc.Graph(
+                                id="ops-chart",
+                                figure=getOpsFigure(),
+                            )
+                        ],
+                        className="card"
+                    ),
+                ],
+                className="wrapper",
+            ),
+        ]
+    )
+
+
+app.layout = serveLayout
+
+
+# Define callback function to implement live update of data on the dashboard, run when the event stream reports new
+# data. Only what changed since the client's last update is sent: unchanged outputs are skipped and figures are patched
+# in place, so bytes per update stay constant.
+@app.callback(Output(component_id='live-update-img', component_property='src'),
+              Output(component_id='live-update-barcode', component_property='src'),
+              Output(component_id="count-chart", component_property="figure"),
+              Output(component_id="hourly-chart", component_property="figure"),
+              Output(component_id="cond", component_property="children"),
+              Output(component_id="cond", component_property="className"),
+              Output(component_id="ops-chart", component_property="figure"),
+              Output(component_id="label-chart", component_property="figure"),
+              Output(component_id="client-state", component_property="data"),
+              Input(component_id='interval-component', component_property='n_intervals'),
+              Input(component_id="live-update", component_property="n_clicks"),
+              Input(component_id="hourly-window", component_property="value"),
+              State(component_id="client-state", component_property="data"))
+def update_metrics(n_intervals, n_clicks, window, client):
+    # Data is pulled by the ingester, read a consistent state of it
+    with aws.lock:
+        return getUpdate(window, client)
+
+
+def getUpdate(window, client):
+    """
+    Helper function for getting the live update callback outputs.
+
+    :param window: Deliveries chart window.
+    :param client: Client state (see getClientState).
+    :return: Callback outputs.
+    """
+    updatedFigHourly, hourly = getHourlyUpdate(window, client["version"], client["hourly"])
+    state = getClientState(hourly)
+
+    # Append pull records (and device stats) the client has not seen to the ops chart
+    new_pulls = min(state["pulls"] - client["pulls"], len(aws.metrics.history))
+    history = list(aws.metrics.history)[len(aws.metrics.history) - new_pulls:]
+    updatedFigOps = Patch()
+    for i, (x, y) in enumerate(getOpsSeries(history, aws.statsHistory[client["stats"]:])):
+        updatedFigOps["data"][i]["x"].extend(x)
+        updatedFigOps["data"][i]["y"].extend(y)
+
+    if state["version"] == client["version"]:
+        return no_update, no_update, no_update, updatedFigHourly, no_update, no_update, updatedFigOps, no_update, \
+            state
+
+    # Update parcel condition total count bar graph
+    updatedFigBar = Patch()
+    updatedFigBar["data"][0]["y"] = getCounts()
 
     # Update condition text and style
     condition = "Good" if aws.mostRecent[1] == "Parcel" else "Bad"
     newClassName = "label-good" if aws.mostRecent[1] == "Parcel" else "label-bad"
 
     return app.get_asset_url("{}.png".format(aws.mostRecent[0])), app.get_asset_url(
-        "{}-b.png".format(aws.mostRecent[0])), updatedFigBar, updatedFigHourly, condition, newClassName
+        "{}-b.png".format(aws.mostRecent[0])), updatedFigBar, updatedFigHourly, condition, newClassName, \
+        updatedFigOps, getLabelFigure(), state
+
+
+# Server-sent event stream notifying dashboards of new data. Each connected client holds a server thread, waiting on the
+# ingester's notifier; browsers reconnect on their own and resume from the last version they saw (Last-Event-ID).
+@app.server.route("/events")
+def events():
+    try:
+        version = int(request.headers.get("Last-Event-ID", aws.notifier.version))
+    except ValueError:
+        version = aws.notifier.version
+
+    def stream(version):
+        yield "retry: 5000\n\n"
+        while True:
+            latest = aws.notifier.wait(version, timeout=KEEPALIVE_INTERVAL)
+            if latest == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = latest
+            yield "id: {0}\nevent: update\ndata: {0}\n\n".format(version)
+
+    return Response(stream(version), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# S3 event notification hook (through SNS HTTP subscription, or forwarded by a Lambda function), triggers a pull as
+# soon as the camera uploads instead of waiting for the next poll
+@app.server.route("/s3-events", methods=["POST"])
+def s3Events():
+    if ingester is None:
+        # Pulled by the ingester process, which checks the token itself
+        forward = urllib.request.Request(INGESTER_URL + "/s3-events?" + request.query_string.decode(),
+                                         data=request.get_data(), method="POST")
+        try:
+            with urllib.request.urlopen(forward, timeout=10) as response:
+                return "", response.status
+        except urllib.error.HTTPError as e:
+            return "", e.code
+        except urllib.error.URLError:
+            return "", 503
+    if EVENT_TOKEN and request.args.get("token") != EVENT_TOKEN:
+        return "", 403
+    event = request.get_json(force=True, silent=True) or {}
+    if event.get("Type") == "SubscriptionConfirmation":
+        # SNS asks for the subscription to be confirmed by fetching this URL once
+        url = pullS3.subscriptionUrl(event)
+        if not url:
+            return "", 400
+        urllib.request.urlopen(url).close()
+        return "", 204
+    ingester.handleEvent(event)
+    return "", 204
+
+
+# Prometheus style endpoint exposing the same ingest and device metrics, e.g. for alerting on pull overruns
+@app.server.route("/metrics")
+def metrics():
+    return Response(aws.prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,17 @@
+/*
+ * Live updates for the dashboard: listens to the server-sent event stream and clicks the hidden live-update button
+ * whenever new data has been ingested, which runs the update callback. The browser reconnects on its own if the
+ * stream drops; the slow dcc.Interval keeps the page fresh in the meantime.
+ */
+(function () {
+    if (!window.EventSource) {
+        return;
+    }
+    var source = new EventSource("/events");
+    source.addEventListener("update", function () {
+        var button = document.getElementById("live-update");
+        if (button) {
+            button.click();
+        }
+    });
+})();
@@ -0,0 +1,358 @@
+"""
+Dashboard load test. Starts the dashboard in a separate process against a fixed synthetic dataset (LocalS3 filled by
+synthbucket), then drives the live update callback endpoint with N simulated clients, each sending a tick every
+period seconds like a browser with dcc.Interval would. Reports p50/p99 callback latency, server CPU time and payload
+bytes per tick. Then measures push latency, from a parcel's upload to the update event reaching a dashboard through
+/events, and the server CPU used while dashboards sit idle on the event stream.
+
+Clients are built from /_dash-dependencies and /_dash-layout, and keep their own copy of every property the server
+sends back, so callbacks using State (e.g. per-client versions) are exercised like real browsers would.
+
+Results are appended to results/dash.jsonl.
+
+Usage: python bench_dash.py [--clients 50] [--period 1] [--duration 20] [--parcels 500] [--uploads 10] [--idle 10]
+"""
+
+import argparse
+import binascii
+import datetime
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+from bench_ingest import gitRevision, previousResult
+
+RESULTS = os.path.join(HERE, "results", "dash.jsonl")
+
+
+def serve(port, parcels):
+    """
+    Runs the dashboard on a synthetic dataset, in the server process. boto3.resource is pointed at the LocalS3 stand-in
+    before app.py is imported, as the app connects and pulls at import time. The stand-in's event notifications are
+    fed to the ingester like S3 bucket notifications would be, and /bench/upload uploads a new parcel.
+
+    :param port: Port to listen on.
+    :param parcels: Number of detections in the synthetic bucket.
+    """
+    import logging
+    import boto3
+    import locals3
+    import synthbucket
+
+    s3 = locals3.LocalS3()
+    synthbucket.populate(s3, parcels=parcels)
+    boto3.resource = lambda **kwargs: s3
+
+    # pullS3 writes rendered images to ./assets, keep them out of the source tree
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("assets")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    import app
+    s3.subscribe(app.ingester.handleEvent)
+    bucket = s3.Bucket(app.aws.bucketname)
+    jpeg = synthbucket.makeJpeg()
+    uploads = []
+
+    @app.app.server.route("/bench/upload", methods=["POST"])
+    def upload():
+        # Image times have a one second resolution, callers space uploads out
+        now = datetime.datetime.now(datetime.timezone.utc)
+        messages = ["{Image Start,EAN13,5012345678900,Parcel}", binascii.hexlify(jpeg), "{Image End}"]
+        for message in messages:
+            bucket.put_object(Key="live/{:010d}".format(len(uploads)), Body=message, LastModified=now)
+            uploads.append(now)
+        return str(time.time())
+
+    app.app.run_server(port=port, debug=False, threaded=True)
+
+
+def freePort():
+    """
+    :return: A free TCP port on localhost.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def cpuSeconds(pid):
+    """
+    :param pid: Process id.
+    :return: User + system CPU seconds used by the process so far, None where /proc is not available.
+    """
+    try:
+        with open("/proc/{}/stat".format(pid)) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def getJson(url):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def layoutProps(node, props):
+    """
+    Collects the properties of every component with an id in a Dash layout.
+
+    :param node: Layout node (from /_dash-layout).
+    :param props: Dictionary filled with (id, property): value.
+    """
+    if isinstance(node, list):
+        for child in node:
+            layoutProps(child, props)
+    elif isinstance(node, dict) and "props" in node:
+        component = node["props"]
+        if "id" in component:
+            for prop, value in component.items():
+                props[(component["id"], prop)] = value
+        layoutProps(component.get("children"), props)
+
+
+def parseOutputs(output):
+    """
+    Parses a Dash callback output string (id.prop, or ..id.prop...id.prop.. for multiple outputs).
+
+    :param output: Output string.
+    :return: Output spec list (or dictionary for a single output), as sent by the Dash renderer.
+    """
+    if output.startswith(".."):
+        return [dict(zip(("id", "property"), o.rsplit(".", 1))) for o in output[2:-2].split("...")]
+    return dict(zip(("id", "property"), output.rsplit(".", 1)))
+
+
+class Client(threading.Thread):
+    """
+    Simulated dashboard browser tab, sending interval ticks to one callback.
+    """
+
+    def __init__(self, base, callback, props, trigger, period, until, offset):
+        """
+        :param base: Server URL.
+        :param callback: Callback description from /_dash-dependencies.
+        :param props: Initial property values from the layout.
+        :param trigger: (id, property) of the interval input.
+        :param period: Seconds between ticks.
+        :param until: perf_counter time to stop at.
+        :param offset: Seconds to wait before the first tick, spreads clients out.
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.base = base
+        self.callback = callback
+        self.props = dict(props)
+        self.trigger = trigger
+        self.period = period
+        self.until = until
+        self.offset = offset
+        self.latencies = []
+        self.sizes = []
+        self.errors = 0
+
+    def payload(self):
+        spec = lambda deps: [{"id": d["id"], "property": d["property"],
+                              "value": self.props.get((d["id"], d["property"]))} for d in deps]
+        return {
+            "output": self.callback["output"],
+            "outputs": parseOutputs(self.callback["output"]),
+            "inputs": spec(self.callback["inputs"]),
+            "state": spec(self.callback["state"]),
+            "changedPropIds": ["{}.{}".format(*self.trigger)],
+        }
+
+    def tick(self):
+        self.props[self.trigger] = (self.props.get(self.trigger) or 0) + 1
+        request = urllib.request.Request(self.base + "/_dash-update-component",
+                                         data=json.dumps(self.payload()).encode(),
+                                         headers={"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                body = response.read()
+        except urllib.error.URLError:
+            self.errors += 1
+            return
+        self.latencies.append(time.perf_counter() - start)
+        self.sizes.append(len(body))
+        if body:
+            for component, values in json.loads(body).get("response", {}).items():
+                for prop, value in values.items():
+                    self.props[(component, prop)] = value
+
+    def run(self):
+        time.sleep(self.offset)
+        next_tick = time.perf_counter()
+        while next_tick < self.until:
+            self.tick()
+            next_tick += self.period
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+
+
+def pushLatency(base, uploads, spacing=2.0):
+    """
+    Uploads parcels one at a time and times how long each takes to be announced on the event stream.
+
+    :param base: Server URL.
+    :param uploads: Number of parcels to upload.
+    :param spacing: Seconds between uploads.
+    :return: List of latencies in seconds, None for uploads never announced.
+    """
+    latencies = []
+    with urllib.request.urlopen(base + "/events", timeout=spacing * 4) as stream:
+        for _ in range(uploads):
+            start = time.perf_counter()
+            urllib.request.urlopen(urllib.request.Request(base + "/bench/upload", data=b"")).close()
+            latency = None
+            try:
+                while latency is None:
+                    line = stream.readline()
+                    if not line:
+                        break
+                    if line.startswith(b"event: update"):
+                        latency = time.perf_counter() - start
+            except socket.timeout:
+                pass
+            latencies.append(latency)
+            time.sleep(max(0.0, spacing - (time.perf_counter() - start)))
+    return latencies
+
+
+def idleCpu(base, pid, clients, duration):
+    """
+    Measures the server CPU used while dashboards are connected to the event stream with nothing new to show.
+
+    :param base: Server URL.
+    :param pid: Server process id.
+    :param clients: Number of connected dashboards.
+    :param duration: Seconds to measure for.
+    :return: Server CPU percentage, None where /proc is not available.
+    """
+    streams = [urllib.request.urlopen(base + "/events") for _ in range(clients)]
+    try:
+        start = cpuSeconds(pid)
+        time.sleep(duration)
+        end = cpuSeconds(pid)
+    finally:
+        for stream in streams:
+            stream.close()
+    return None if start is None or end is None else (end - start) / duration * 100
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def loadTest(clients, period, duration, parcels, uploads=10, idle=10.0, trigger_id="interval-component"):
+    """
+    Starts the dashboard server and runs the simulated clients against it.
+
+    :param clients: Number of simulated clients.
+    :param period: Seconds between ticks of one client.
+    :param duration: Seconds to run for.
+    :param parcels: Number of detections in the synthetic bucket.
+    :param uploads: Number of parcels to upload when measuring push latency.
+    :param idle: Seconds to measure idle server CPU for.
+    :param trigger_id: Id of the interval component driving the callback.
+    :return: Result dictionary.
+    """
+    port = freePort()
+    base = "http://127.0.0.1:{}".format(port)
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(port), "--parcels",
+                               str(parcels)])
+    try:
+        while True:
+            try:
+                layout = getJson(base + "/_dash-layout")
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if server.poll() is not None:
+                    raise RuntimeError("dashboard server exited")
+                time.sleep(0.5)
+        dependencies = getJson(base + "/_dash-dependencies")
+        callback = next(c for c in dependencies if any(i["id"] == trigger_id for i in c["inputs"]))
+        trigger = next((i["id"], i["property"]) for i in callback["inputs"] if i["id"] == trigger_id)
+        props = {}
+        layoutProps(layout, props)
+
+        cpu_start = cpuSeconds(server.pid)
+        start = time.perf_counter()
+        threads = [Client(base, callback, props, trigger, period, start + duration, period * i / clients)
+                   for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        cpu_end = cpuSeconds(server.pid)
+
+        pushed = pushLatency(base, uploads)
+        idle_cpu = idleCpu(base, server.pid, clients, idle)
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = [l for thread in threads for l in thread.latencies]
+    sizes = [s for thread in threads for s in thread.sizes]
+    announced = [l for l in pushed if l is not None]
+    return {
+        "ticks": len(latencies),
+        "errors": sum(thread.errors for thread in threads),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "server_cpu_s": None if cpu_start is None or cpu_end is None else cpu_end - cpu_start,
+        "server_cpu_pct": None if cpu_start is None or cpu_end is None else (cpu_end - cpu_start) / elapsed * 100,
+        "bytes_per_tick": sum(sizes) / len(sizes) if sizes else 0,
+        "bytes_first_tick": sum(thread.sizes[0] for thread in threads if thread.sizes) / max(1, clients),
+        "bytes_last_tick": sum(thread.sizes[-1] for thread in threads if thread.sizes) / max(1, clients),
+        "push_p50_ms": percentile(announced, 50) * 1000,
+        "push_max_ms": max(announced) * 1000 if announced else 0.0,
+        "push_missed": len(pushed) - len(announced),
+        "idle_cpu_pct": idle_cpu,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the dashboard live update callback.")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--period", type=float, default=1.0, help="seconds between ticks of one client")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--parcels", type=int, default=500, help="detections in the synthetic dataset")
+    parser.add_argument("--uploads", type=int, default=10, help="parcels uploaded to measure push latency")
+    parser.add_argument("--idle", type=float, default=10.0, help="seconds to measure idle server CPU for")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.parcels)
+        sys.exit()
+
+    params = {"clients": args.clients, "period": args.period, "duration": args.duration, "parcels": args.parcels,
+              "uploads": args.uploads, "idle": args.idle}
+    name = "{clients}x{period}s".format(**params)
+    result = loadTest(**params)
+    record = {"scenario": name, "params": params, "commit": gitRevision(),
+              "time": datetime.datetime.now().isoformat(timespec="seconds")}
+    record.update(result)
+    previous = previousResult(name, RESULTS)
+    os.makedirs(os.path.dirname(RESULTS), exist_ok=True)
+    with open(RESULTS, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+    for key in ("ticks", "errors", "p50_ms", "p99_ms", "server_cpu_s", "server_cpu_pct", "bytes_per_tick",
+                "bytes_first_tick", "bytes_last_tick", "push_p50_ms", "push_max_ms", "push_missed", "idle_cpu_pct"):
+        was = " (was {})".format(previous[key]) if previous and previous.get(key) is not None else ""
+        print("{:<18} {}{}".format(key, record[key], was))
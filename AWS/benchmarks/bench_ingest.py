@@ -0,0 +1,189 @@
+"""
+End-to-end ingest benchmark. Generates synthetic buckets in a LocalS3 stand-in and runs pullS3.pull() against them,
+reporting wall time, S3 requests issued, peak RSS and images per second. Each scenario runs in a fresh process so peak
+RSS is not inherited from earlier scenarios.
+
+Results are appended to results/ingest.jsonl and compared with the previous run of the same scenario, so regressions
+show up as a change in the delta column. Rendered and quarantined images are checked against the counts synthbucket
+expects, a scenario that does not match is reported in the error column and the benchmark exits with status 1.
+
+With --workers 1 2 4 8 each scenario is run once per worker count, against a LocalS3 adding --latency seconds to every
+request, to show how ingest scales when sharded by device.
+
+Usage: python bench_ingest.py [--scenario small medium ...] or with --parcels/--chunks/... for a custom scenario.
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+RESULTS = os.path.join(HERE, "results", "ingest.jsonl")
+
+SCENARIOS = {
+    "small": {"parcels": 50, "chunks": 8, "devices": 1},
+    "medium": {"parcels": 250, "chunks": 8, "devices": 4},
+    "large-chunks": {"parcels": 100, "chunks": 64, "devices": 1},
+    "damaged": {"parcels": 200, "chunks": 8, "devices": 2, "corrupt": 0.05, "truncated": 0.05, "unterminated": 0.05},
+    "fleet": {"parcels": 20, "chunks": 8, "devices": 32},
+}
+
+
+def runScenario(params, queue, workers=8, latency=0.0):
+    """
+    Runs one scenario, in a child process. Pulls twice: the first (cold) pull renders every image, the second (warm)
+    pull shows the steady state cost of checking the bucket for new uploads.
+
+    :param params: populate() keyword arguments.
+    :param queue: Queue to put the result dictionary on.
+    :param workers: Devices ingested in parallel.
+    :param latency: Seconds every S3 request takes.
+    """
+    import locals3
+    import pullS3
+    import synthbucket
+
+    s3 = locals3.LocalS3()
+    generated = synthbucket.populate(s3, **params)
+    s3.latency = latency
+    result = {"objects": generated["objects"], "bytes": generated["bytes"], "expected": generated["images"],
+              "expected_quarantined": generated["quarantined"]}
+    with tempfile.TemporaryDirectory() as assets:
+        aws = pullS3.pullS3(s3=s3, assets=assets, workers=workers, quarantine=os.path.join(assets, "quarantine"))
+        for run in ("cold", "warm"):
+            before = dict(s3.requests)
+            start = time.perf_counter()
+            try:
+                aws.pull()
+            except Exception as e:
+                result["error"] = "{}: {}".format(type(e).__name__, e)
+            result["wall_" + run] = time.perf_counter() - start
+            result["gets_" + run] = s3.requests["gets"] - before["gets"]
+            result["lists_" + run] = s3.requests["lists"] - before["lists"]
+        result["images"] = len(aws.files)
+        result["quarantined"] = aws.metrics.totals["quarantined"]
+        aws.resetDecoders(wait=True)
+    if "error" not in result and (result["images"], result["quarantined"]) != (result["expected"],
+                                                                             result["expected_quarantined"]):
+        result["error"] = "rendered {} and quarantined {} images, expected {} and {}".format(
+            result["images"], result["quarantined"], result["expected"], result["expected_quarantined"])
+    result["images_per_s"] = result["images"] / result["wall_cold"] if result["wall_cold"] else 0.0
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_mb"] = rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+    queue.put(result)
+
+
+def gitRevision():
+    """
+    :return: Current git commit hash, None outside a git checkout.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previousResult(name, path=RESULTS):
+    """
+    :param name: Scenario name.
+    :param path: Results file.
+    :return: Last stored result of the scenario, None if it never ran.
+    """
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["scenario"] == name:
+                previous = record
+    return previous
+
+
+def run(name, params, workers=8, latency=0.0):
+    """
+    Runs a scenario in a fresh process and stores its result.
+
+    :param name: Scenario name.
+    :param params: populate() keyword arguments.
+    :param workers: Devices ingested in parallel.
+    :param latency: Seconds every S3 request takes.
+    :return: Result record, Previous result record of the same scenario (or None).
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=runScenario, args=(params, queue, workers, latency))
+    proc.start()
+    result = queue.get()
+    proc.join()
+
+    record = {"scenario": name, "params": params, "workers": workers, "latency": latency, "commit": gitRevision(),
+              "time": datetime.datetime.now().isoformat(timespec="seconds")}
+    record.update(result)
+    previous = previousResult(name)
+    os.makedirs(os.path.dirname(RESULTS), exist_ok=True)
+    with open(RESULTS, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    return record, previous
+
+
+def printRecord(record, previous):
+    """
+    Prints a scenario result, with the change in cold wall time since the previous run.
+
+    :param record: Result record.
+    :param previous: Previous result record, or None.
+    """
+    delta = ""
+    if previous and previous.get("wall_cold"):
+        delta = "{:+.0%}".format(record["wall_cold"] / previous["wall_cold"] - 1)
+    print("{:<14} {:>8} {:>9.2f} {:>9.2f} {:>7} {:>7} {:>6} {:>6} {:>9.1f} {:>8.1f} {:>7} {}".format(
+        record["scenario"], record["objects"], record["wall_cold"], record["wall_warm"], record["gets_cold"],
+        record["gets_warm"], "{}/{}".format(record["images"], record["expected"]), record.get("quarantined", 0),
+        record["images_per_s"], record["peak_rss_mb"], delta, record.get("error", "")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pullS3.pull() against synthetic buckets.")
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=["small", "medium"])
+    parser.add_argument("--name", help="name for a custom scenario built from the options below")
+    parser.add_argument("--parcels", type=int, default=100)
+    parser.add_argument("--chunks", type=int, default=8)
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--corrupt", type=float, default=0.0)
+    parser.add_argument("--truncated", type=float, default=0.0)
+    parser.add_argument("--unterminated", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[8], help="devices ingested in parallel")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every S3 request takes")
+    args = parser.parse_args()
+
+    if args.name:
+        scenarios = {args.name: {"parcels": args.parcels, "chunks": args.chunks, "devices": args.devices,
+                                 "corrupt": args.corrupt, "truncated": args.truncated,
+                                 "unterminated": args.unterminated}}
+    else:
+        scenarios = {name: SCENARIOS[name] for name in args.scenario}
+
+    print("{:<14} {:>8} {:>9} {:>9} {:>7} {:>7} {:>6} {:>6} {:>9} {:>8} {:>7} {}".format(
+        "scenario", "objects", "cold (s)", "warm (s)", "GETs", "GETs w", "images", "quar.", "images/s", "RSS (MB)",
+        "delta", "error"))
+    failed = False
+    for name, params in scenarios.items():
+        for workers in args.workers:
+            label = name if len(args.workers) == 1 else "{}/{}w".format(name, workers)
+            record, previous = run(label, params, workers, args.latency)
+            printRecord(record, previous)
+            failed = failed or "error" in record
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,120 @@
+"""
+Image metadata benchmark. Compares the comma separated {Image Start,...} text header with the binary metadata record
+(OpenMV/metarecord.py) on synthetic uploads: bytes per header, time to send it over the 9600 baud modem UART, and
+the cost of encoding it on the camera side and parsing it in pullS3.
+
+Results are appended to results/metadata.jsonl.
+
+Usage: python bench_metadata.py [--records 1000] [--stats] [--baud 9600]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "OpenMV"))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "OpenMV", "host", "openmv"))
+sys.path.insert(0, HERE)
+
+from bench_ingest import gitRevision
+
+RESULTS = os.path.join(HERE, "results", "metadata.jsonl")
+
+STAGES = ("wake", "modem", "scan", "switch", "classify", "compress", "publish")
+
+
+def synthRecords(count, stats=False, seed=0):
+    """
+    :param count: Number of uploads.
+    :param stats: Flags whether to add the profiler stage stats field to each upload.
+    :param seed: Random seed.
+    :return: List of (type, payload, label, device, confidence, time, fields) tuples.
+    """
+    import metarecord
+
+    rng = random.Random(seed)
+    records = []
+    for _ in range(count):
+        fields = ()
+        if stats:
+            fields = ("S=" + ";".join("%s:%d/%d/%d/%d" % (stage, rng.randint(1, 50), rng.randint(50, 500),
+                                                           rng.randint(500, 5000), rng.randint(5000, 20000))
+                                      for stage in STAGES),)
+        records.append((rng.choice(("EAN13", "CODE128", "UPCA")), "%013d" % rng.randrange(10 ** 13),
+                        rng.choice(metarecord.LABELS[1:]), "cam-%02d" % rng.randrange(16), rng.random(),
+                        1700000000 + rng.randrange(10 ** 7), fields))
+    return records
+
+
+def textHeader(kind, payload, label, device, fields):
+    """
+    :return: {Image Start,...} header as sent by main.mqttsendimg.
+    """
+    return ("{Image Start," + ",".join((kind, payload, label) + tuple(fields) + ("D=" + device,)) + "}").encode()
+
+
+def timed(function, items):
+    """
+    :param function: Function of one item.
+    :param items: Items.
+    :return: Mean microseconds per call, results.
+    """
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    return (time.perf_counter() - start) / len(items) * 1e6, results
+
+
+def run(count, stats=False, baud=9600):
+    """
+    Encodes and parses every synthetic upload both ways.
+
+    :param count: Number of uploads.
+    :param stats: Flags whether uploads carry the stage stats field.
+    :param baud: Modem UART baud rate, 10 bits per byte.
+    :return: Result record.
+    """
+    import metarecord
+    import pullS3
+
+    records = synthRecords(count, stats)
+    encodeText, texts = timed(lambda r: textHeader(r[0], r[1], r[2], r[3], r[6]), records)
+    encodeRecord, binaries = timed(lambda r: metarecord.encode(r[0], r[1], r[2], r[3], confidence=r[4],
+                                                               timestamp=r[5], fields=r[6]), records)
+    parseText, _ = timed(pullS3.parseHeader, texts)
+    parseRecord, parsed = timed(pullS3.parseHeader, binaries)
+    for record, fields in zip(records, parsed):
+        assert fields[:3] == list(record[:3]), "record round trip changed {} into {}".format(record, fields)
+
+    textBytes = sum(len(t) for t in texts) / count
+    recordBytes = sum(len(b) for b in binaries) / count
+    return {"records": count, "stats": stats, "baud": baud, "text_bytes": textBytes, "record_bytes": recordBytes,
+            "ratio": recordBytes / textBytes, "text_uart_ms": textBytes * 10 / baud * 1000,
+            "record_uart_ms": recordBytes * 10 / baud * 1000, "text_encode_us": encodeText,
+            "record_encode_us": encodeRecord, "text_parse_us": parseText, "record_parse_us": parseRecord,
+            "commit": gitRevision(), "time": datetime.datetime.now().isoformat(timespec="seconds")}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark text headers against binary metadata records.")
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--stats", action="store_true", help="add the stage stats field to every upload")
+    parser.add_argument("--baud", type=int, default=9600)
+    args = parser.parse_args()
+
+    result = run(args.records, args.stats, args.baud)
+    os.makedirs(os.path.dirname(RESULTS), exist_ok=True)
+    with open(RESULTS, "a") as f:
+        f.write(json.dumps(result) + "\n")
+
+    print("{:<8} {:>8} {:>9} {:>11} {:>10}".format("format", "bytes", "UART ms", "encode us", "parse us"))
+    for name in ("text", "record"):
+        print("{:<8} {:>8.1f} {:>9.1f} {:>11.1f} {:>10.1f}".format(
+            name, result[name + "_bytes"], result[name + "_uart_ms"], result[name + "_encode_us"],
+            result[name + "_parse_us"]))
+    print("record/text bytes: {:.0%}".format(result["ratio"]))
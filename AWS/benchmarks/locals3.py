@@ -0,0 +1,192 @@
+"""
+In-memory stand-in for the subset of the boto3 S3 resource interface used by pullS3, so pulls can be benchmarked
+without the real bucket and its credentials. Requests are counted the way they would be billed by S3: one GET per
+object fetched and one LIST per page of up to 1000 keys. A fixed latency can be added to every request, to see how
+ingest overlaps them. Listeners can subscribe to S3 style event notifications of new
+objects, standing in for bucket notifications.
+"""
+
+import datetime
+import io
+import threading
+import time
+import types
+
+LIST_PAGE_SIZE = 1000
+
+
+class LocalObject:
+    """
+    Stand-in for a boto3 ObjectSummary.
+    """
+
+    def __init__(self, bucket, key, body, last_modified):
+        self.bucket = bucket
+        self.bucket_name = bucket.name
+        self.key = key
+        self.body = body
+        self.last_modified = last_modified
+        self.size = len(body)
+
+    def get(self):
+        """
+        :return: Response dictionary with Body stream and LastModified.
+        """
+        self.bucket.s3.count("gets")
+        return {'Body': io.BytesIO(self.body), 'LastModified': self.last_modified, 'ContentLength': self.size}
+
+
+class LocalObjects:
+    """
+    Stand-in for a boto3 bucket objects collection.
+    """
+
+    def __init__(self, bucket, prefix="", marker=""):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.marker = marker
+
+    def all(self):
+        return LocalObjects(self.bucket)
+
+    def filter(self, Prefix="", Marker=""):
+        return LocalObjects(self.bucket, Prefix, Marker)
+
+    def __iter__(self):
+        with self.bucket.lock:
+            keys = sorted(key for key in self.bucket.store if key.startswith(self.prefix) and key > self.marker)
+            objects = [self.bucket.store[key] for key in keys]
+        self.bucket.s3.count("lists", max(1, -(-len(objects) // LIST_PAGE_SIZE)))
+        return iter(objects)
+
+    def delete(self):
+        with self.bucket.lock:
+            for key in [key for key in self.bucket.store if key.startswith(self.prefix)]:
+                del self.bucket.store[key]
+
+
+class LocalBucket:
+    """
+    Stand-in for a boto3 Bucket.
+    """
+
+    def __init__(self, s3, name):
+        self.s3 = s3
+        self.name = name
+        self.store = {}
+        self.lock = threading.Lock()
+        self.objects = LocalObjects(self)
+
+    def Object(self, key):
+        """
+        :param key: Object key.
+        :return: Stored object.
+        """
+        with self.lock:
+            return self.store[key]
+
+    def put_object(self, Key, Body, LastModified=None):
+        """
+        Stores an object.
+
+        :param Key: Object key.
+        :param Body: Object contents (bytes or str).
+        :param LastModified: Upload time, now if None.
+        :return: Stored object.
+        """
+        if isinstance(Body, str):
+            Body = Body.encode()
+        obj = LocalObject(self, Key, Body, LastModified or datetime.datetime.now(datetime.timezone.utc))
+        with self.lock:
+            self.store[Key] = obj
+        self.s3.count("puts")
+        self.s3.notify(self, obj)
+        return obj
+
+
+class LocalClient:
+    """
+    Stand-in for the boto3 S3 client, available as LocalS3.meta.client.
+    """
+
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter="", StartAfter="", ContinuationToken=None,
+                        MaxKeys=LIST_PAGE_SIZE):
+        """
+        Lists one page of objects, keys sharing a prefix up to the delimiter are rolled up into CommonPrefixes.
+
+        :return: Response dictionary with Contents, CommonPrefixes, IsTruncated and NextContinuationToken.
+        """
+        bucket = self.s3.Bucket(Bucket)
+        self.s3.count("lists")
+        start = ContinuationToken or StartAfter
+        with bucket.lock:
+            keys = sorted(key for key in bucket.store if key.startswith(Prefix) and key > start)
+        contents = []
+        prefixes = []
+        last = None
+        for key in keys:
+            if len(contents) + len(prefixes) == MaxKeys:
+                return {"Contents": contents, "CommonPrefixes": prefixes, "IsTruncated": True,
+                        "NextContinuationToken": last}
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                prefix = Prefix + rest[:rest.index(Delimiter) + len(Delimiter)]
+                if not prefixes or prefixes[-1]["Prefix"] != prefix:
+                    prefixes.append({"Prefix": prefix})
+            else:
+                obj = bucket.store[key]
+                contents.append({"Key": key, "LastModified": obj.last_modified, "Size": obj.size})
+            last = key
+        return {"Contents": contents, "CommonPrefixes": prefixes, "IsTruncated": False}
+
+
+class LocalS3:
+    """
+    Stand-in for a boto3 S3 resource.
+
+    requests: Dictionary - gets, lists and puts issued so far.
+    listeners: List - functions called with an event notification dictionary for every object put.
+    latency: Float - seconds every GET and LIST page takes.
+    """
+
+    def __init__(self, latency=0.0):
+        self.buckets_by_name = {}
+        self.requests = {"gets": 0, "lists": 0, "puts": 0}
+        self.listeners = []
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.meta = types.SimpleNamespace(client=LocalClient(self))
+
+    def subscribe(self, listener):
+        """
+        Subscribes to object created notifications, in the S3 event notification format.
+
+        :param listener: Function called with the event dictionary, from the thread putting the object.
+        """
+        self.listeners.append(listener)
+
+    def notify(self, bucket, obj):
+        event = {"Records": [{
+            "eventVersion": "2.1",
+            "eventSource": "aws:s3",
+            "eventTime": obj.last_modified.isoformat(),
+            "eventName": "ObjectCreated:Put",
+            "s3": {"bucket": {"name": bucket.name}, "object": {"key": obj.key, "size": obj.size}},
+        }]}
+        for listener in self.listeners:
+            listener(event)
+
+    def count(self, request, n=1):
+        with self.lock:
+            self.requests[request] += n
+        if request != "puts" and self.latency:
+            time.sleep(self.latency * n)
+
+    def Bucket(self, name):
+        with self.lock:
+            if name not in self.buckets_by_name:
+                self.buckets_by_name[name] = LocalBucket(self, name)
+            return self.buckets_by_name[name]
@@ -0,0 +1,114 @@
+"""
+Synthetic bucket generator. Fills an S3 bucket (or a LocalS3 stand-in) with detections in the exact format the camera
+uploads: a {Image Start,...} header, hex encoded JPEG fragments and a {Image End} marker per parcel, followed by a
+{Telemetry,...} message. Damaged sequences can be mixed in to exercise error handling.
+
+Garbled fragments keep valid hex and the JPEG markers, only entropy coded data is zeroed. That decodes into a visibly
+damaged image, and with no checksum in the upload pullS3 cannot tell it from a good one, so these images are expected
+to be rendered. Truncated and unterminated images are expected to be quarantined.
+"""
+
+import binascii
+import datetime
+import random
+from io import BytesIO
+
+from PIL import Image
+
+import pullS3
+
+
+def makeJpeg(seed=0, size=240, quality=10):
+    """
+    Creates a JPEG of similar size and entropy to the ones the camera sends (240x240 at quality 10).
+
+    :param seed: Random seed for the image noise.
+    :param size: Image side in pixels.
+    :param quality: JPEG quality.
+    :return: JPEG bytes.
+    """
+    rng = random.Random(seed)
+    im = Image.new("RGB", (size, size))
+    im.putdata([(x % 256, rng.randrange(256), (x // size) % 256) for x in range(size * size)])
+    buf = BytesIO()
+    im.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def deviceName(index):
+    """
+    :param index: Device number.
+    :return: Device id used in object keys.
+    """
+    return "cam{:03d}".format(index)
+
+
+def populate(s3, bucketname="intern-cam", parcels=100, chunks=8, devices=1, corrupt=0.0, truncated=0.0,
+             unterminated=0.0, start=None, spacing=600, seed=0):
+    """
+    Fills a bucket with synthetic detections. Keys are {device}/{sequence}, so each device's uploads are listed in
+    order. Upload times are unique across devices, as pullS3 names images after them.
+
+    :param s3: S3 resource or LocalS3 stand-in.
+    :param bucketname: Bucket to fill.
+    :param parcels: Number of detections per device.
+    :param chunks: Number of hex fragments each image is split into.
+    :param devices: Number of cameras uploading.
+    :param corrupt: Fraction of images with a garbled fragment (valid hex, zeroed JPEG data), still rendered.
+    :param truncated: Fraction of images missing their last fragments but properly terminated.
+    :param unterminated: Fraction of images whose {Image End} never arrives.
+    :param start: Time of the first upload, a fixed date if None.
+    :param spacing: Seconds between detections of one device.
+    :param seed: Random seed.
+    :return: Dictionary with objects and bytes written, images expected to be rendered and to be quarantined.
+    """
+    rng = random.Random(seed)
+    bucket = s3.Bucket(bucketname)
+    start = start or datetime.datetime(2021, 8, 2, 9, 0, tzinfo=datetime.timezone.utc)
+    jpegs = [makeJpeg(seed + i) for i in range(4)]
+    summary = {"objects": 0, "bytes": 0, "images": 0, "quarantined": 0}
+
+    # One second per object, devices offset so that no two of them share an upload time
+    spacing = max(spacing, devices * (chunks + 4))
+    for device in range(devices):
+        seq = 0
+        for parcel in range(parcels):
+            t = start + datetime.timedelta(seconds=parcel * spacing + device * (chunks + 4))
+            jpeg = jpegs[parcel % len(jpegs)]
+            size = -(-len(jpeg) // chunks)
+            fragments = [binascii.hexlify(jpeg[i:i + size]) for i in range(0, len(jpeg), size)]
+            label = rng.choice(pullS3.LABELS[1:])
+            payload = "{:013d}".format(rng.randrange(10 ** 13))
+            messages = ["{Image Start,EAN13," + payload + "," + label +
+                        ",S=scan:40/52/90/130;publish:900/1100/1400/2100}"]
+
+            broken = rng.random()
+            if broken < corrupt:
+                # Only fragments holding entropy coded data alone, between the start of scan header and the end of
+                # image marker, are garbled
+                sos = jpeg.index(b"\xff\xda")
+                scan = sos + 2 + int.from_bytes(jpeg[sos + 2:sos + 4], "big")
+                garbled = [i for i in range(len(fragments)) if i * size >= scan and (i + 1) * size <= len(jpeg) - 2]
+                if garbled:
+                    i = rng.choice(garbled)
+                    keep = len(fragments[i]) // 4 * 2  # whole bytes only, the fragment stays valid hex
+                    fragments[i] = fragments[i][:keep] + b"00" * ((len(fragments[i]) - keep) // 2)
+            elif broken < corrupt + truncated:
+                fragments = fragments[:max(1, len(fragments) // 2)]
+            messages.extend(fragments)
+            if not (corrupt + truncated <= broken < corrupt + truncated + unterminated):
+                messages.append("{Image End}")
+            if broken < corrupt or broken >= corrupt + truncated + unterminated:
+                summary["images"] += 1
+            else:
+                summary["quarantined"] += 1
+            messages.append("{Telemetry,A=+SMPUB:12/0/0/0.0.0.2.8.2.0.0;+SMPUB.ack:10/0/0/0.0.1.6.3.0.0.0,"
+                            "Q=csq:18;rsrq:-11;rsrp:-98;rssi:-70;snr:6}")
+
+            for i, message in enumerate(messages):
+                obj = bucket.put_object(Key="{}/{:010d}".format(deviceName(device), seq), Body=message,
+                                        LastModified=t + datetime.timedelta(seconds=i))
+                summary["objects"] += 1
+                summary["bytes"] += obj.size
+                seq += 1
+    return summary
@@ -0,0 +1,447 @@
+"""
+Standalone ingester. Pulls the camera uploads from S3, reassembles and decodes them (see pullS3), and writes detections
+and ingest metrics into a local SQLite store that dashboards read from (app.py with INGEST_STORE set). Ingesting and
+serving run in separate processes, so a slow S3 listing never competes with dashboard requests, and either side can be
+restarted on its own.
+
+The ingester is an asyncio service: pulls run on a worker thread while the event loop serves S3 event notifications
+(POST /s3-events, forwarded by the dashboard) and Prometheus metrics (GET /metrics). S3 is read with the synchronous
+boto3 pull of pullS3 rather than an async client (aiobotocore): pullS3 already overlaps S3 requests across devices on
+its own threads, boto3 releases the GIL while waiting on the network, and the dashboard runs the same pull in process
+without an ingester, so there is one S3 code path. The event loop never waits on S3 either way.
+
+Usage: python ingester.py [--store ingest.db] [--assets ./assets] [--interval 60] [--port 8051]
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import http
+import json
+import os
+import signal
+import sqlite3
+import threading
+import traceback
+import urllib.parse
+import urllib.request
+
+import pullS3
+
+# Largest request body taken by the HTTP endpoint, S3 event notifications are a few kilobytes
+MAX_BODY = 256 * 1024
+
+
+def encode(value):
+    """
+    JSON encoder default for the values kept by pullS3, datetimes are stored in ISO format.
+
+    :param value: Value json cannot encode.
+    :return: Encodable value.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+
+class Store:
+    """
+    Writing side of the store, owned by the ingester. Each pull is written in one transaction, and the database is in
+    WAL mode, so dashboards read consistent pulls without ever waiting for one to be written.
+
+    Tables: detections (one row per counted image), cloud (detection records relabelled by reclassify.py), pulls (pull
+    metrics records), stats (device stage stats from image headers) and meta (data version, revision, most recent
+    image, metric totals, the Prometheus metrics text and the device ingest cursors).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS detections (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, device TEXT,
+                                               uploaded TEXT, type TEXT, payload TEXT, label TEXT, version INTEGER,
+                                               captured TEXT);
+        CREATE TABLE IF NOT EXISTS cloud (filename TEXT PRIMARY KEY, record TEXT, revision INTEGER);
+        CREATE TABLE IF NOT EXISTS pulls (id INTEGER PRIMARY KEY, record TEXT);
+        CREATE TABLE IF NOT EXISTS stats (id INTEGER PRIMARY KEY, uploaded TEXT, stats TEXT, UNIQUE (uploaded, stats));
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, path):
+        """
+        :param path: SQLite database file, created if missing.
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+        # Stores created before detections carried their capture time
+        if "captured" not in [row[1] for row in self.conn.execute("PRAGMA table_info(detections)")]:
+            self.conn.execute("ALTER TABLE detections ADD COLUMN captured TEXT")
+        self.written = {"detections": 0, "stats": 0, "pulls": 0}
+        self.cloud = {}
+
+    def meta(self, key, default=None):
+        """
+        :param key: Meta key.
+        :return: Stored value, default if missing.
+        """
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def write(self, aws):
+        """
+        Writes what a pullS3 instance added since the last write.
+
+        :param aws: pullS3 instance, after a pull.
+        """
+        with aws.lock:
+            detections = aws.detections[self.written["detections"]:]
+            stats = aws.statsHistory[self.written["stats"]:]
+            history = list(aws.metrics.history)
+            pulls = history[len(history) - min(aws.metrics.totals["pulls"] - self.written["pulls"], len(history)):]
+            cloud = {filename: record for filename, record in aws.cloudLabels.items()
+                     if self.cloud.get(filename) != record.get("cloud")}
+            meta = {"version": aws.version, "mostRecent": aws.mostRecent, "totals": aws.metrics.totals,
+                    "prometheus": aws.prometheus(),
+                    "cursors": {device: {"cursor": state.cursor, "counted": state.counted}
+                                for device, state in aws.devices.items()}}
+            written = {"detections": len(aws.detections), "stats": len(aws.statsHistory),
+                       "pulls": aws.metrics.totals["pulls"]}
+        revision = self.meta("revision", 0) + 1
+        meta["revision"] = revision
+        meta["written"] = datetime.datetime.now(datetime.timezone.utc)
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO detections (filename, device, uploaded, type, payload, label, version, "
+                "captured) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(d["filename"], d["device"], d["uploaded"].isoformat(), d["type"], d["payload"], d["label"],
+                  d["version"], d["captured"].isoformat()) for d in detections])
+            self.conn.executemany("INSERT OR IGNORE INTO stats (uploaded, stats) VALUES (?, ?)",
+                                  [(uploaded.isoformat(), json.dumps(s, sort_keys=True)) for uploaded, s in stats])
+            self.conn.executemany("INSERT INTO pulls (record) VALUES (?)",
+                                  [(json.dumps(record, default=encode),) for record in pulls])
+            self.conn.executemany("INSERT OR REPLACE INTO cloud (filename, record, revision) VALUES (?, ?, ?)",
+                                  [(filename, json.dumps(record), revision) for filename, record in cloud.items()])
+            self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                  [(key, json.dumps(value, default=encode)) for key, value in meta.items()])
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.written = written
+        for filename, record in cloud.items():
+            self.cloud[filename] = record.get("cloud")
+
+    def resume(self, aws):
+        """
+        Restores where the last ingester stopped, so a restart does not read and render the whole bucket again.
+
+        :param aws: pullS3 instance, before its first pull.
+        """
+        aws.version = self.meta("version", 0)
+        mostRecent = self.meta("mostRecent")
+        aws.mostRecent = tuple(mostRecent) if mostRecent else None
+        for device, cursor in self.meta("cursors", {}).items():
+            state = aws.devices.setdefault(device, pullS3.DeviceState(device))
+            state.cursor = cursor["cursor"]
+            state.counted = cursor["counted"]
+
+
+class StoreReader:
+    """
+    Reading side of the store, with the interface of pullS3 that the dashboard uses (counts, most recent image, cloud
+    labels, rollups, version, pull metrics, device stats, lock, notifier and prometheus). A background thread polls the
+    store revision and reads only the rows added since, then publishes the new data version to the notifier.
+    """
+
+    def __init__(self, path, poll=1.0, history=1440):
+        """
+        :param path: SQLite database file written by the ingester.
+        :param poll: Seconds between checks for a new revision.
+        :param history: Pull metrics records kept, as pullS3.PullMetrics.
+        """
+        self.path = path
+        self.poll = poll
+        self.conn = None
+        self.count = {"Parcel": 0, "Damaged Parcel": 0}
+        self.mostRecent = None
+        self.cloudLabels = {}
+        self.rollups = pullS3.Rollups()
+        self.version = 0
+        self.revision = 0
+        self.metrics = pullS3.PullMetrics(history=history)
+        self.statsHistory = []
+        self.metricsText = ""
+        self.marks = {"detections": 0, "stats": 0, "pulls": 0}
+        self.notifier = pullS3.Notifier()
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def connect(self):
+        """
+        :return: Read-only connection to the store.
+        """
+        if self.conn is None:
+            self.conn = sqlite3.connect("file:{}?mode=ro".format(urllib.parse.quote(os.path.abspath(self.path))),
+                                        uri=True, isolation_level=None, check_same_thread=False)
+        return self.conn
+
+    def refresh(self):
+        """
+        Reads what the ingester wrote since the last refresh, in one read transaction.
+
+        :return: Whether the data version changed.
+        """
+        try:
+            conn = self.connect()
+            conn.execute("BEGIN")
+        except sqlite3.OperationalError:
+            # Ingester has not created the store yet
+            self.conn = None
+            return False
+        try:
+            meta = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+            if meta.get("revision", 0) == self.revision:
+                return False
+            detections = conn.execute("SELECT id, device, COALESCE(captured, uploaded), label, version FROM detections "
+                                      "WHERE id > ? ORDER BY id", (self.marks["detections"],)).fetchall()
+            stats = conn.execute("SELECT id, uploaded, stats FROM stats WHERE id > ? ORDER BY id",
+                                 (self.marks["stats"],)).fetchall()
+            pulls = conn.execute("SELECT id, record FROM pulls WHERE id > ? ORDER BY id",
+                                 (self.marks["pulls"],)).fetchall()
+            cloud = conn.execute("SELECT filename, record FROM cloud WHERE revision > ?", (self.revision,)).fetchall()
+        finally:
+            conn.execute("COMMIT")
+
+        with self.lock:
+            for _, device, captured, label, version in detections:
+                if label in self.count:
+                    self.count[label] += 1
+                self.rollups.add(datetime.datetime.fromisoformat(captured), version)
+            for _, uploaded, s in stats:
+                self.statsHistory.append((datetime.datetime.fromisoformat(uploaded), json.loads(s)))
+            for _, record in pulls:
+                record = json.loads(record)
+                record["time"] = datetime.datetime.fromisoformat(record["time"])
+                self.metrics.history.append(record)
+            for filename, record in cloud:
+                self.cloudLabels[filename] = json.loads(record)
+            for rows, mark in ((detections, "detections"), (stats, "stats"), (pulls, "pulls")):
+                if rows:
+                    self.marks[mark] = rows[-1][0]
+            # Pull count of the store rather than of the ingester process, which starts over when it restarts
+            self.metrics.totals.update(meta.get("totals", {}), pulls=self.marks["pulls"])
+            if meta.get("mostRecent"):
+                self.mostRecent = tuple(meta["mostRecent"])
+            self.metricsText = meta.get("prometheus", "")
+            self.revision = meta["revision"]
+            changed = meta.get("version", 0) != self.version
+            self.version = meta.get("version", 0)
+        return changed
+
+    def prometheus(self):
+        """
+        :return: Metrics text rendered by the ingester with its latest pull.
+        """
+        return self.metricsText
+
+    def start(self):
+        """
+        Reads the store, then keeps refreshing in the background.
+        """
+        self.refresh()
+        self.notifier.publish(self.version)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops refreshing.
+        """
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.poll):
+            try:
+                if self.refresh():
+                    self.notifier.publish(self.version)
+            except sqlite3.Error:
+                # Keep polling, the ingester may be restarting
+                traceback.print_exc()
+                self.conn = None
+
+
+class AsyncIngester:
+    """
+    asyncio service pulling into a Store every interval seconds without event notifications, shortly after S3 reports
+    new objects, and every eventInterval seconds once notifications arrive (as pullS3.Ingester). Pulls and store writes
+    run on one worker thread, S3 requests fan out per device inside pullS3.pull, and the event loop stays free to take
+    notifications.
+    """
+
+    def __init__(self, aws, store, interval=60, eventInterval=900, settle=0.5, token=None):
+        """
+        :param aws: pullS3 instance to pull with.
+        :param store: Store to write pulls to.
+        :param interval: Seconds between pulls without event notifications.
+        :param eventInterval: Seconds between pulls once event notifications are received.
+        :param settle: Seconds to wait after a notification before pulling, so that a burst of fragment uploads is
+        picked up by a single pull.
+        :param token: Shared secret S3 event notifications must carry (?token=...), checked if set.
+        """
+        self.aws = aws
+        self.store = store
+        self.interval = interval
+        self.eventInterval = eventInterval
+        self.settle = settle
+        self.token = token
+        self.events = 0
+        self.wake = None
+        self.stopped = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    def pull(self):
+        """
+        Pulls and writes the result to the store, on the worker thread.
+        """
+        self.aws.pull()
+        self.store.write(self.aws)
+
+    def handleEvent(self, event):
+        """
+        Handles an S3 event notification, triggering a pull if it reports new objects in the bucket.
+
+        :param event: Event notification dictionary (see pullS3.s3EventKeys).
+        :return: Number of new objects reported.
+        """
+        keys = pullS3.s3EventKeys(event, self.aws.bucketname)
+        if keys:
+            self.events += len(keys)
+            self.wake.set()
+        return len(keys)
+
+    def stop(self):
+        """
+        Stops the service after the current pull.
+        """
+        self.stopped.set()
+        self.wake.set()
+
+    async def s3Events(self, query, body):
+        """
+        :param query: Parsed query string.
+        :param body: Request body.
+        :return: HTTP status.
+        """
+        if self.token and query.get("token", [None])[0] != self.token:
+            return 403
+        try:
+            event = json.loads(body or b"{}")
+        except ValueError:
+            return 400
+        if event.get("Type") == "SubscriptionConfirmation":
+            # SNS asks for the subscription to be confirmed by fetching this URL once
+            url = pullS3.subscriptionUrl(event)
+            if not url:
+                return 400
+            await asyncio.get_running_loop().run_in_executor(None, lambda: urllib.request.urlopen(url).close())
+            return 204
+        self.handleEvent(event)
+        return 204
+
+    async def serve(self, reader, writer):
+        """
+        Answers one HTTP request: POST /s3-events or GET /metrics.
+        """
+        status, body, kind = 404, b"", "text/plain"
+        try:
+            method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            url = urllib.parse.urlsplit(target)
+            if length > MAX_BODY:
+                status = 413
+            elif method == "POST" and url.path == "/s3-events":
+                data = await reader.readexactly(length)
+                status = await self.s3Events(urllib.parse.parse_qs(url.query), data)
+            elif method == "GET" and url.path == "/metrics":
+                status, body, kind = 200, self.aws.prometheus().encode(), "text/plain; version=0.0.4"
+        except (ValueError, asyncio.IncompleteReadError):
+            status = 400
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+            status, http.HTTPStatus(status).phrase, kind, len(body)).encode() + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def run(self, host="127.0.0.1", port=8051):
+        """
+        Pulls until stopped (SIGINT or SIGTERM), starting with a pull straight away.
+
+        :param host: Address to take event notifications and metrics requests on.
+        :param port: Port to take them on, no endpoint if 0.
+        """
+        loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        self.stopped = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        server = await asyncio.start_server(self.serve, host, port) if port else None
+        self.wake.set()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    await asyncio.wait_for(self.wake.wait(), self.eventInterval if self.events else self.interval)
+                    await asyncio.sleep(self.settle)
+                except asyncio.TimeoutError:
+                    pass
+                if self.stopped.is_set():
+                    break
+                self.wake.clear()
+                try:
+                    await loop.run_in_executor(self.executor, self.pull)
+                except Exception:
+                    # Keep ingesting, the next pull re-reads the bucket
+                    traceback.print_exc()
+        finally:
+            if server:
+                server.close()
+                await server.wait_closed()
+            self.executor.shutdown()
+            self.aws.resetDecoders(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pull camera uploads from S3 into a store read by the dashboard.")
+    parser.add_argument("--store", default="ingest.db", help="SQLite store, INGEST_STORE of the dashboard")
+    parser.add_argument("--bucket", default="intern-cam")
+    parser.add_argument("--assets", default="./assets", help="directory images are rendered to, served by the "
+                                                             "dashboard")
+    parser.add_argument("--interval", type=float, default=60, help="seconds between pulls without S3 events")
+    parser.add_argument("--event-interval", type=float, default=900, help="seconds between pulls with S3 events")
+    parser.add_argument("--workers", type=int, default=8, help="devices ingested in parallel")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8051, help="S3 events and metrics endpoint, 0 to disable")
+    args = parser.parse_args()
+
+    aws = pullS3.pullS3(bucketname=args.bucket, assets=args.assets, workers=args.workers)
+    aws.metrics.interval = args.interval
+    store = Store(args.store)
+    # Carry on from the stored version and device cursors, so dashboards see versions keep increasing across restarts
+    # and only new uploads are ingested
+    store.resume(aws)
+    service = AsyncIngester(aws, store, interval=args.interval, eventInterval=args.event_interval,
+                            token=os.environ.get("S3_EVENT_TOKEN"))
+    asyncio.run(service.run(args.host, args.port))
@@ -7,12 +7,47 @@ from AWS, and parsed/saved accordingly into more convenient formats.
 
 import binascii
 import barcode
-import pandas
 from barcode.writer import ImageWriter
 import boto3
 from PIL import Image, ImageFile
 from io import BytesIO
+import bisect
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import contextlib
 import datetime
+import json
+import multiprocessing
+import os
+import struct
+import threading
+import time
+import traceback
+import zlib
+from urllib.parse import unquote_plus, urlparse
+
+# Device id of objects uploaded without a device key prefix
+DEFAULT_DEVICE = "default"
+
+# Images whose end has not arrived this long after their last fragment are quarantined
+STALE_IMAGE = datetime.timedelta(minutes=10)
+
+# Binary image metadata records (see OpenMV/metarecord.py): magic, version, capture time, barcode type, label and
+# confidence, then length prefixed device id, payload and extra fields. Enumerations are in the camera's order
+RECORD_MAGIC = b"\xa5"
+RECORD_VERSION = 1
+RECORD_HEAD = struct.Struct("<BBIBBB")
+BARCODE_TYPES = ("EAN2", "EAN5", "EAN8", "UPCE", "ISBN10", "UPCA", "EAN13", "ISBN13", "I25", "DATABAR", "DATABAR_EXP",
+                 "CODABAR", "CODE39", "PDF417", "CODE93", "CODE128")
+LABELS = ("background", "Damaged Parcel", "Parcel")
+
+# Batches of small messages (see OpenMV/batch.py): magic, version, flags (bit 0: zlib compressed body) and message
+# count, then the length prefixed messages
+BATCH_MAGIC = b"\xa6"
+BATCH_VERSION = 1
+BATCH_HEAD = struct.Struct("<BBBH")
+BATCH_COMPRESSED = 1
 
 
 def datetimeToString(dt):
@@ -25,15 +60,16 @@ def datetimeToString(dt):
     return str(dt)[:10] + "-" + str(dt)[11:13] + "-" + str(dt)[14:16] + "-" + str(dt)[17:19]
 
 
-def saveBarcode(type, payload, filename):
+def saveBarcode(type, payload, filename, assets="./assets"):
     """
     Create barcode image.
 
     :param type: Barcode type.
     :param payload: Barcode payload.
     :param filename: File name.
+    :param assets: Directory to save the image in.
     """
-    with open("./assets/{}-b.png".format(filename), 'wb') as f:
+    with open("{}/{}-b.png".format(assets, filename), 'wb') as f:
         if type == "EAN8":
             barcode.EAN8(payload, writer=ImageWriter()).write(f)
         elif type == "UPCA":
@@ -50,33 +86,516 @@ def saveBarcode(type, payload, filename):
             barcode.Code128(payload, writer=ImageWriter()).write(f)
 
 
-def roundTime(dt=None, roundTo=60):
-    """Round a datetime object to any time lapse in seconds
-    dt : datetime.datetime object, default now.
-    roundTo : Closest number of seconds to round to, default 1 minute.
-    Author: Thierry Husson 2012 - Use it as you want but don't blame me.
+def renderImage(job):
+    """
+    Validates a reassembled image and renders it (and its barcode) into the assets directory. An image that is not a
+    complete, decodable JPEG is moved to the quarantine directory instead: the raw bytes as <file>.bin and the
+    diagnostics as <file>.json. Rendered images get a detection record next to them as <file>.json (see
+    detectionRecord), which reclassify.py adds cloud labels to. Runs on the decoder pool (see pullS3.render).
+
+    :param job: Dictionary - data, filename, metadata, assets, quarantine, plus device, uploaded, keys, fragments and
+    error (reassembly problem, None if there was none) for diagnostics.
+    :return: Diagnostics dictionary, None if the image was rendered.
+    """
+    data = job["data"]
+    reason, error = ("reassembly", job["error"]) if job["error"] else (None, None)
+    if reason is None and not data.startswith(b"\xff\xd8"):
+        reason, error = "structure", "no JPEG start of image marker"
+    if reason is None and not data.rstrip(b"\x00").endswith(b"\xff\xd9"):
+        reason, error = "structure", "no JPEG end of image marker, image is truncated"
+    if reason is None:
+        try:
+            # verify() checks the structure without decoding, load() decodes every scan
+            Image.open(BytesIO(data)).verify()
+            im = Image.open(BytesIO(data))
+            im.load()
+        except Exception as e:
+            reason, error = "decode", "{}: {}".format(type(e).__name__, e)
+    if reason is None:
+        try:
+            im.save("{}/{}.png".format(job["assets"], job["filename"]))
+            saveBarcode(job["metadata"][0], job["metadata"][1], job["filename"], job["assets"])
+            # Keep the cloud label reclassify.py added, the bucket is rendered again whenever the ingester restarts
+            record = detectionRecord(job)
+            path = "{}/{}.json".format(job["assets"], job["filename"])
+            try:
+                with open(path) as f:
+                    previous = json.load(f)
+            except (OSError, ValueError):
+                previous = {}
+            if isinstance(previous, dict) and "cloud" in previous:
+                record["cloud"] = previous["cloud"]
+            with open(path + ".tmp", "w") as f:
+                json.dump(record, f)
+            os.replace(path + ".tmp", path)
+            return None
+        except Exception as e:
+            reason, error = "render", "{}: {}".format(type(e).__name__, e)
+
+    diagnostics = {key: job[key] for key in ("device", "filename", "keys", "fragments", "metadata")}
+    diagnostics.update(uploaded=job["uploaded"].isoformat(), reason=reason, error=error, bytes=len(data), head=data[:16].hex(), tail=data[-16:].hex())
+    os.makedirs(job["quarantine"], exist_ok=True)
+    with open("{}/{}.bin".format(job["quarantine"], job["filename"]), "wb") as f:
+        f.write(data)
+    with open("{}/{}.json".format(job["quarantine"], job["filename"]), "w") as f:
+        json.dump(diagnostics, f, indent=2)
+    return diagnostics
+
+
+def detectionRecord(job):
+    """
+    Builds the detection record saved next to a rendered image.
+
+    :param job: Render job dictionary (see renderImage).
+    :return: Dictionary - device, uploaded (ISO format), barcode type and payload, label decided on the device.
+    """
+    metadata = job["metadata"]
+    return {"device": job["device"], "uploaded": job["uploaded"].isoformat(), "type": metadata[0],
+            "payload": metadata[1], "label": metadata[2]}
+
+
+def captureTime(metadata, uploaded, skew=300):
+    """
+    Gets the time a detection was captured, from the T= field the device stamps it with once its clock is synced, so
+    upload delays and offline buffering do not move it into a later hour. Falls back to the upload time.
+
+    :param metadata: Header fields.
+    :param uploaded: Upload time datetime object (S3 LastModified).
+    :param skew: Seconds the device clock may be ahead of S3 before its stamp is distrusted.
+    :return: datetime object, UTC, time zone aware if uploaded is.
+    """
+    for field in metadata[2:]:
+        if field.startswith("T="):
+            try:
+                captured = datetime.datetime.fromtimestamp(int(field[2:]), datetime.timezone.utc)
+            except (ValueError, OverflowError, OSError):
+                return uploaded
+            if uploaded.tzinfo is None:
+                captured = captured.replace(tzinfo=None)
+            return captured if captured <= uploaded + datetime.timedelta(seconds=skew) else uploaded
+    return uploaded
+
+
+def parseStats(field):
+    """
+    Parses a device stage stats record, piggybacked by the camera on image headers.
+
+    :param field: Stats record string, S=stage:min/p50/p95/max;stage:min/p50/p95/max...
+    :return: Dictionary of stage name to dictionary of min, p50, p95, max durations in milliseconds.
+    """
+    stats = {}
+    for entry in field[2:].split(';'):
+        if ':' not in entry:
+            continue
+        stage, values = entry.split(':', 1)
+        try:
+            stats[stage] = dict(zip(("min", "p50", "p95", "max"), [int(v) for v in values.split('/')]))
+        except ValueError:
+            continue
+    return stats
+
+
+def parseRecord(body):
+    """
+    Decodes a binary image metadata record into the fields of a text header: barcode type, payload, label, the extra
+    fields (e.g. S= stage stats), D=device, C=confidence and T=capture time (seconds since 1970, if the camera clock was
+    set).
+
+    :param body: Record bytes.
+    :return: List of header fields.
+    :raise ValueError: If the record is malformed or of an unknown version.
+    """
+    if len(body) < RECORD_HEAD.size:
+        raise ValueError("record is truncated")
+    _, version, captured, kind, label, level = RECORD_HEAD.unpack_from(body)
+    if version != RECORD_VERSION:
+        raise ValueError("unknown record version {}".format(version))
+    pos = RECORD_HEAD.size
+    strings = []
+    for size in (1, 1, 2):
+        if pos + size > len(body):
+            raise ValueError("record is truncated")
+        n = int.from_bytes(body[pos:pos + size], "little")
+        pos += size
+        if pos + n > len(body):
+            raise ValueError("record is truncated")
+        strings.append(body[pos:pos + n].decode())
+        pos += n
+    device, payload, extra = strings
+    metadata = [BARCODE_TYPES[kind] if kind < len(BARCODE_TYPES) else "", payload,
+                LABELS[label] if label < len(LABELS) else ""]
+    metadata += extra.split(',') if extra else []
+    metadata += ["D=" + device, "C={:.3f}".format(level / 255)]
+    if captured:
+        metadata.append("T={}".format(captured))
+    return metadata
+
+
+def parseBatch(body):
+    """
+    Unpacks a batch of small messages (telemetry, seen again) published together by the camera.
+
+    :param body: Batch bytes.
+    :return: List of message bytes.
+    :raise ValueError: If the batch is malformed or of an unknown version.
+    """
+    if len(body) < BATCH_HEAD.size:
+        raise ValueError("batch is truncated")
+    _, version, flags, count = BATCH_HEAD.unpack_from(body)
+    if version != BATCH_VERSION:
+        raise ValueError("unknown batch version {}".format(version))
+    data = body[BATCH_HEAD.size:]
+    if flags & BATCH_COMPRESSED:
+        try:
+            data = zlib.decompress(data)
+        except zlib.error as e:
+            raise ValueError("batch does not decompress: {}".format(e))
+    messages = []
+    pos = 0
+    for _ in range(count):
+        if pos + 2 > len(data):
+            raise ValueError("batch is truncated")
+        n = int.from_bytes(data[pos:pos + 2], "little")
+        if pos + 2 + n > len(data):
+            raise ValueError("batch is truncated")
+        messages.append(data[pos + 2:pos + 2 + n])
+        pos += 2 + n
+    return messages
+
+
+def parseHeader(body):
+    """
+    Parses the first message of an image, a binary metadata record or a {Image Start,...} text header.
+
+    :param body: Message bytes.
+    :return: List of header fields, barcode type, payload and label first.
+    :raise ValueError: If a binary record is malformed.
+    """
+    if body.startswith(RECORD_MAGIC):
+        return parseRecord(body)
+    return body.decode(errors="replace").replace('}', "").split(',')[1:]
+
+
+def parseTelemetry(message):
+    """
+    Parses a modem telemetry message sent by the camera after each upload.
+
+    :param message: Telemetry message, {Telemetry,A=name:n/timeouts/errors/h0.h1...;...,Q=key:value;...,P=key:value;...,
+    B=key:value;...}
+    :return: Dictionary with "commands" (name to n, timeouts, errors, hist), "signal" (key to value), "power" (idle
+    timeout, expected gap between parcels in seconds, estimated millijoules per parcel, naps and deep sleeps) and
+    "batch" (message batches sent, messages batched, bytes before and after compression).
+    """
+    telemetry = {"commands": {}, "signal": {}, "power": {}, "batch": {}}
+    for field in message.strip("{}").split(',')[1:]:
+        if field.startswith("A="):
+            for entry in field[2:].split(';'):
+                try:
+                    name, values = entry.split(':', 1)
+                    n, timeouts, errors, hist = values.split('/')
+                    telemetry["commands"][name] = {"n": int(n), "timeouts": int(timeouts), "errors": int(errors),
+                                                   "hist": [int(h) for h in hist.split('.')]}
+                except ValueError:
+                    continue
+        elif field[:2] in ("Q=", "P=", "B="):
+            for entry in field[2:].split(';'):
+                try:
+                    key, value = entry.split(':', 1)
+                    telemetry[{"Q": "signal", "P": "power", "B": "batch"}[field[0]]][key] = int(value)
+                except ValueError:
+                    continue
+    return telemetry
+
+
+def s3EventKeys(event, bucketname):
+    """
+    Gets the keys of objects created in a bucket from an S3 event notification, as delivered directly, through SQS or
+    wrapped in an SNS notification.
+
+    :param event: Event notification dictionary.
+    :param bucketname: S3 bucket name, records of other buckets are ignored.
+    :return: List of object keys.
+    """
+    if "Records" not in event and "Message" in event:
+        event = json.loads(event["Message"])
+    return [unquote_plus(record["s3"]["object"]["key"]) for record in event.get("Records", [])
+            if record.get("eventName", "").startswith("ObjectCreated") and
+            record["s3"]["bucket"]["name"] == bucketname]
+
+
+def subscriptionUrl(event):
+    """
+    Gets the URL confirming an SNS subscription, which has to be fetched once before notifications are delivered.
+
+    :param event: SubscriptionConfirmation message dictionary.
+    :return: URL, None unless it is an HTTPS URL of AWS.
+    """
+    url = urlparse(event.get("SubscribeURL", ""))
+    if url.scheme != "https" or not url.hostname or not url.hostname.endswith(".amazonaws.com"):
+        return None
+    return url.geturl()
+
+
+class Notifier:
+    """
+    Lets any number of threads wait for the data version to change, e.g. dashboard event streams.
+    """
+
+    def __init__(self):
+        """
+        version: Integer - latest published data version.
+        """
+        self.version = 0
+        self.condition = threading.Condition()
+
+    def publish(self, version):
+        """
+        Publishes a new data version, waking up every waiting thread.
+
+        :param version: Data version.
+        """
+        with self.condition:
+            self.version = version
+            self.condition.notify_all()
+
+    def wait(self, version, timeout=None):
+        """
+        Waits for the data version to differ from the one the caller has.
+
+        :param version: Data version the caller has.
+        :param timeout: Seconds to wait at most, forever if None.
+        :return: Latest data version, unchanged on timeout.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+class PullMetrics:
+    """
+    Timers and counters around data pulls (listing, fetching, decoding and rendering), for the dashboard operational
+    panel and the /metrics endpoint.
     """
-    if dt == None: dt = datetime.datetime.now()
-    seconds = (dt.replace(tzinfo=None) - dt.min).seconds
-    rounding = (seconds + roundTo / 2) // roundTo * roundTo
-    return dt + datetime.timedelta(0, rounding - seconds, -dt.microsecond)
 
+    STAGES = ("list", "fetch", "decode", "render")
+    COUNTERS = ("objects", "bytes", "fragments", "images", "quarantined", "seen_again", "batched")
+
+    def __init__(self, history=1440, interval=None):
+        """
+        totals: Dictionary - counters accumulated over the instance lifetime, plus pulls and overruns.
+        last: Dictionary - record of the most recent pull.
+        history: Deque - records of the most recent pulls (a day's worth at a 60 s interval by default).
+        interval: Float - expected seconds between pulls, pulls taking longer are counted as overruns.
+        """
+        self.totals = dict.fromkeys(self.COUNTERS + ("pulls", "overruns"), 0)
+        self.last = None
+        self.history = collections.deque(maxlen=history)
+        self.interval = interval
+        self.current = None
+        self.started = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts recording a new pull.
+        """
+        self.current = dict.fromkeys(self.STAGES + self.COUNTERS, 0)
+        self.current["time"] = datetime.datetime.now()
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """
+        Context manager adding the time spent in its block to a stage of the current pull. Stages running on several
+        workers at once add up their time.
+
+        :param stage: Stage name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.current[stage] += time.perf_counter() - start
+
+    def count(self, counter, n=1):
+        """
+        Increments a counter of the current pull.
+
+        :param counter: Counter name.
+        :param n: Increment.
+        """
+        with self.lock:
+            self.current[counter] += n
+
+    def finish(self, backlog=0):
+        """
+        Finishes recording the current pull.
+
+        :param backlog: Fragments belonging to an image that has not been fully received yet.
+        """
+        record = self.current
+        record["duration"] = time.perf_counter() - self.started
+        record["backlog"] = backlog
+        record["fragmentsPerSecond"] = record["fragments"] / record["duration"] if record["duration"] else 0.0
+        for counter in self.COUNTERS:
+            self.totals[counter] += record[counter]
+        self.totals["pulls"] += 1
+        if self.interval and record["duration"] > self.interval:
+            self.totals["overruns"] += 1
+        self.history.append(record)
+        self.last = record
+        self.current = None
+
+
+class Rollups:
+    """
+    Detection counts pre-aggregated into hour, day and week buckets, for time series queries over any window. Bucket
+    start times are kept sorted per resolution, so a query only touches the buckets in its window.
+    """
+
+    RESOLUTIONS = (("hour", datetime.timedelta(hours=1)), ("day", datetime.timedelta(days=1)),
+                   ("week", datetime.timedelta(weeks=1)))
+    MAX_POINTS = 200
+
+    def __init__(self):
+        """
+        keys: Dictionary - resolution to sorted list of bucket start times holding detections.
+        counts: Dictionary - resolution to dictionary of bucket start time to detection count.
+        versions: Dictionary - resolution to dictionary of bucket start time to the version it last changed in.
+        """
+        self.keys = {resolution: [] for resolution, _ in self.RESOLUTIONS}
+        self.counts = {resolution: {} for resolution, _ in self.RESOLUTIONS}
+        self.versions = {resolution: {} for resolution, _ in self.RESOLUTIONS}
+
+    @staticmethod
+    def bucket(dt, resolution):
+        """
+        Gets the start of the bucket a time falls in. Weeks start on Monday.
+
+        :param dt: datetime object.
+        :param resolution: "hour", "day" or "week".
+        :return: Bucket start datetime object.
+        """
+        dt = dt.replace(minute=0, second=0, microsecond=0)
+        if resolution != "hour":
+            dt = dt.replace(hour=0)
+        if resolution == "week":
+            dt -= datetime.timedelta(days=dt.weekday())
+        return dt
+
+    def add(self, dt, version=0):
+        """
+        Counts a detection in every resolution.
+
+        :param dt: Detection time.
+        :param version: Data version the detection was added in.
+        """
+        for resolution, _ in self.RESOLUTIONS:
+            key = self.bucket(dt, resolution)
+            counts = self.counts[resolution]
+            if key not in counts:
+                bisect.insort(self.keys[resolution], key)
+                counts[key] = 0
+            counts[key] += 1
+            self.versions[resolution][key] = version
+
+    def resolution(self, start, end, maxPoints=MAX_POINTS):
+        """
+        Picks the finest resolution showing a window in at most maxPoints buckets, the coarsest if none does.
+
+        :param start: Window start datetime object.
+        :param end: Window end datetime object.
+        :param maxPoints: Maximum number of buckets.
+        :return: Resolution name, Bucket length timedelta.
+        """
+        for resolution, step in self.RESOLUTIONS:
+            if (end - start) / step <= maxPoints:
+                return resolution, step
+        return self.RESOLUTIONS[-1]
+
+    def range(self, resolution, start, end):
+        """
+        Gets the stored buckets of a resolution in a window.
 
-def getIndexes(dfObj, value):
-    """ Get index positions of value in dataframe i.e. dfObj."""
-    listOfPos = list()
-    # Get bool dataframe with True at positions where the given value exists
-    result = dfObj.isin([value])
-    # Get list of columns that contains the value
-    seriesObj = result.any()
-    columnNames = list(seriesObj[seriesObj == True].index)
-    # Iterate over list of columns and fetch the rows indexes where value exists
-    for col in columnNames:
-        rows = list(result[col][result[col] == True].index)
-        for row in rows:
-            listOfPos.append((row, col))
-    # Return a list of tuples indicating the positions of value in the dataframe
-    return listOfPos
+        :param resolution: Resolution name.
+        :param start: Window start datetime object.
+        :param end: Window end datetime object.
+        :return: Sorted list of bucket start times.
+        """
+        keys = self.keys[resolution]
+        return keys[bisect.bisect_left(keys, self.bucket(start, resolution)):bisect.bisect_right(keys, end)]
+
+    def query(self, start=None, end=None, resolution=None):
+        """
+        Gets detection counts over a window, one value per bucket including empty ones.
+
+        :param start: Window start datetime object, the first detection if None.
+        :param end: Window end datetime object, the last detection if None.
+        :param resolution: Resolution name, picked from the window length if None.
+        :return: Resolution name, List of bucket start times, List of counts.
+        """
+        hours = self.keys["hour"]
+        if not hours and (start is None or end is None):
+            return resolution or self.RESOLUTIONS[0][0], [], []
+        start = start or hours[0]
+        end = end or hours[-1]
+        step = dict(self.RESOLUTIONS)[resolution] if resolution else None
+        if step is None:
+            resolution, step = self.resolution(start, end)
+        counts = {key: self.counts[resolution][key] for key in self.range(resolution, start, end)}
+        keys = []
+        key = self.bucket(start, resolution)
+        while key <= end:
+            keys.append(key)
+            key += step
+        return resolution, keys, [counts.get(key, 0) for key in keys]
+
+    def changed(self, resolution, version, start, end):
+        """
+        Gets the buckets in a window changed since a version.
+
+        :param resolution: Resolution name.
+        :param version: Version the caller last saw.
+        :param start: Window start datetime object.
+        :param end: Window end datetime object.
+        :return: List of (bucket start time, count).
+        """
+        versions = self.versions[resolution]
+        return [(key, self.counts[resolution][key]) for key in self.range(resolution, start, end)
+                if versions[key] > version]
+
+
+class DeviceState:
+    """
+    Ingest cursor and aggregates of one camera.
+    """
+
+    def __init__(self, device):
+        """
+        device: String - device id, also the S3 key prefix the device uploads under.
+        cursor: String - last key processed, the next pull lists from after it.
+        counted: String - key of the latest telemetry, seen again message or batch of them counted, messages are read
+        again while an image before them is pending. Keys rather than upload times, which only have a resolution of a
+        second.
+        seenAgain: Integer - parcels shown to the camera again shortly after their upload, not uploaded twice.
+        count: Dictionary - stores count of condition variable from images.
+        rollups: Rollups - detection counts per hour, day and week.
+        deviceStats: Dictionary - most recent device stage stats (see parseStats).
+        modemHealth: Dictionary - most recent modem telemetry (see parseTelemetry).
+        lastSeen: datetime object - upload time of the latest image.
+        mostRecent: Tuple - latest image file name, Parcel Condition Label.
+        """
+        self.device = device
+        self.cursor = ""
+        self.counted = ""
+        self.seenAgain = 0
+        self.count = {"Parcel": 0, "Damaged Parcel": 0}
+        self.rollups = Rollups()
+        self.deviceStats = {}
+        self.modemHealth = {}
+        self.lastSeen = None
+        self.mostRecent = None
 
 
 class pullS3:
@@ -84,107 +603,572 @@ class pullS3:
     Class for managing and processing data pulls from aws
     """
 
-    def __init__(self):
+    def __init__(self, s3=None, bucketname='intern-cam', assets="./assets", workers=8, quarantine="./quarantine",
+                 processes=None):
         """
+        s3: boto3 S3 resource (or a stand-in with the same interface), connects to AWS if None.
+        bucketname: String - S3 bucket the cameras upload to.
+        assets: String - directory parsed images and barcodes are saved to.
+        workers: Integer - devices ingested in parallel.
+        quarantine: String - directory images failing validation are moved to, with their diagnostics.
+        processes: Integer - decoder processes validating and rendering images, one per core if None.
+        quarantined: Deque - diagnostics of the most recently quarantined images.
+        seenAgain: Deque - most recent seen again messages, (upload time, device, barcode type, payload).
+        devices: Dictionary - device id to DeviceState, per device cursors and aggregates.
         files: List of filenames processed during instance lifetime
-        mostRecent: String - Most recently added filename from aws.
-        count: Dictionary - stores count of condition variable from images.
-        df: Pandas dataframe - stores date and count information in hourly intervals.
+        detections: List - filename, device, upload time, barcode type, payload, label and version of every image
+        counted, in the order counted (see ingester.Store).
+        mostRecent: Tuple - Most recently added filename from aws, Parcel Condition Label.
+        count: Dictionary - stores count of condition variable from images, fleet wide.
+        deviceStats: Dictionary - most recent device stage stats (see parseStats).
+        statsHistory: List - (upload time, device stage stats) for every image carrying stats.
+        modemHealth: Dictionary - most recent modem telemetry (see parseTelemetry).
+        telemetryHistory: List - (upload time, modem telemetry) for every telemetry message.
+        metrics: PullMetrics - timers and counters around pulls.
+        rollups: Rollups - detection counts per hour, day and week.
+        cloudLabels: Dictionary - filename to detection record, for records relabelled by reclassify.py.
+        cloudScanned: Float - modification time of the newest detection record read into cloudLabels.
+        version: Integer - incremented by every pull that adds images or cloud labels, lets clients ask for changes
+        only.
+        notifier: Notifier - published to with the new version by every pull that adds images or cloud labels.
+        lock: RLock - held while a pull updates the instance, hold it to read a consistent state from another thread.
         """
-        self.s3 = boto3.resource(
+        self.s3 = s3 or boto3.resource(
             service_name='s3',
             region_name='eu-west-2',
             aws_access_key_id='#',
             aws_secret_access_key='#'
         )
+        self.bucketname = bucketname
+        self.assets = assets
         self.files = []
+        self.detections = []
         self.mostRecent = None
+        self.workers = workers
+        self.quarantine = quarantine
+        self.processes = processes
+        self.decoders = None
+        self.quarantined = collections.deque(maxlen=100)
+        self.seenAgain = collections.deque(maxlen=100)
+        self.devices = {}
         self.count = {"Parcel": 0, "Damaged Parcel": 0}
-        self.df = pandas.DataFrame(columns=["Date", "Count"])
+        self.deviceStats = {}
+        self.statsHistory = []
+        self.modemHealth = {}
+        self.telemetryHistory = []
+        self.metrics = PullMetrics()
+        self.rollups = Rollups()
+        self.cloudLabels = {}
+        self.cloudScanned = 0.0
+        self.version = 0
+        self.notifier = Notifier()
+        self.lock = threading.RLock()
 
-    def flushBucket(self, bucketname='intern-cam'):
+    def flushBucket(self, bucketname=None):
         """
         Flushes target bucket in AWS. Use with caution.
 
-        :param bucketname: S3 bucket name
+        :param bucketname: S3 bucket name, instance bucket if None.
         """
-        self.s3.Bucket(bucketname).objects.all().delete()
+        self.s3.Bucket(bucketname or self.bucketname).objects.all().delete()
 
     def pull(self):
         """
-        Pulls data from S3 bucket in AWS and processes it.
+        Pulls data from S3 bucket in AWS and processes it. Devices are ingested in parallel, each from where its
+        previous pull stopped, then the results are applied to the fleet and device aggregates.
 
         :return: Most Recent file name, Parcel Condition Label
         """
-        # Print available bucket names
-        for bucket in self.s3.buckets.all():
-            # print(bucket.name)
-            pass
-        # Get bucket size
-        size = 0
-        for obj in self.s3.Bucket('intern-cam').objects.all():
-            size += 1
-            # print(obj.get()['Body'].read())
-
-        images = []  # List of images as byte arrays
+        self.metrics.start()
+        with self.metrics.timer("list"):
+            shards = self.listDevices()
+        for device in shards:
+            if device not in self.devices:
+                self.devices[device] = DeviceState(device)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(lambda device: self.ingestDevice(self.devices[device], shards[device]),
+                                    sorted(shards)))
+
+        # Validate and render new images on every core. Same entries are not processed more than once per instance
+        images = []
+        filenames = set()
+        for result in results:
+            for image in result["images"]:
+                if image["filename"] not in filenames and image["filename"] not in self.files:
+                    filenames.add(image["filename"])
+                    images.append(image)
+        with self.metrics.timer("render"):
+            outcomes = self.render(images)
+        rendered = set()
+        for image, diagnostics in zip(images, outcomes):
+            if diagnostics:
+                print("Quarantined {}: {}".format(image["filename"], diagnostics["error"]))
+                self.quarantined.append(diagnostics)
+                self.metrics.count("quarantined")
+            else:
+                rendered.add(image["filename"])
+                self.metrics.count("images")
+        relabelled = self.readCloudLabels()
+
+        # Apply the pull under the lock, readers in other threads see it all or nothing
+        with self.lock:
+            # Update count dict and rollups, fleet wide and per device
+            version = self.version + 1
+            newest = None
+            for result in results:
+                state = self.devices[result["device"]]
+                # Cursors move on with the messages they were read with, a pull failing before this reads them again
+                state.cursor = result["cursor"]
+                state.counted = result["counted"]
+                for uploaded, telemetry in result["telemetry"]:
+                    state.modemHealth = telemetry
+                    self.modemHealth = telemetry
+                    self.telemetryHistory.append((uploaded, telemetry))
+                for uploaded, metadata in result["seen"]:
+                    seen = self.headerDevice(metadata) if result["device"] == DEFAULT_DEVICE else None
+                    seen = seen or state
+                    seen.seenAgain += 1
+                    self.seenAgain.append((captureTime(metadata, uploaded), seen.device, metadata[0], metadata[1]))
+                for image in result["images"]:
+                    if image["filename"] not in rendered:
+                        continue
+                    filename, metadata = image["filename"], image["metadata"]
+                    uploaded = image["uploaded"]
+                    captured = captureTime(metadata, uploaded)
+                    label = metadata[2]
+                    state = self.devices[result["device"]]
+                    if result["device"] == DEFAULT_DEVICE:
+                        state = self.headerDevice(metadata) or state
+                    self.count[label] += 1
+                    state.count[label] += 1
+                    for field in metadata[3:]:
+                        if field.startswith("S="):
+                            state.deviceStats = self.deviceStats = parseStats(field)
+                            self.statsHistory.append((uploaded, self.deviceStats))
+                    self.files.append(filename)
+                    self.detections.append({"filename": filename, "device": state.device, "uploaded": uploaded,
+                                            "captured": captured, "type": metadata[0], "payload": metadata[1],
+                                            "label": label, "version": version})
+                    # Rollups go by capture time, uploads may be delayed or buffered across the hour
+                    self.rollups.add(captured, version)
+                    state.rollups.add(captured, version)
+                    state.lastSeen = uploaded
+                    state.mostRecent = (filename, label)
+                    if newest is None or uploaded > newest[1]:
+                        newest = (filename, uploaded, label)
+            self.metrics.finish(backlog=sum(result["pending"] for result in results))
+            print("Pulled Data from AWS!")
+            if newest:
+                self.mostRecent = (newest[0], newest[2])
+            self.cloudLabels.update(relabelled)
+            if self.metrics.last["images"] or relabelled:
+                self.version = version
+                self.notifier.publish(version)
+
+    def readCloudLabels(self):
+        """
+        Reads the detection records reclassify.py added a cloud label to since the last call. Only records modified
+        after the newest one already read are opened, records modified in the last few seconds are read again next
+        time in case a write with an older modification time is still being moved into place.
+
+        :return: Dictionary - filename to detection record, for new or changed cloud labels.
+        """
+        relabelled = {}
+        newest = self.cloudScanned
+        settled = time.time() - 5
+        try:
+            entries = list(os.scandir(self.assets))
+        except OSError:
+            return relabelled
+        for entry in entries:
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+                if mtime <= self.cloudScanned:
+                    continue
+                with open(entry.path) as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            filename = entry.name[:-len(".json")]
+            known = self.cloudLabels.get(filename)
+            if "cloud" in record and (known is None or known["cloud"] != record["cloud"]):
+                relabelled[filename] = record
+            newest = max(newest, min(mtime, settled))
+        self.cloudScanned = newest
+        return relabelled
+
+    def headerDevice(self, metadata):
+        """
+        Gets the device named in an image header (D= field), for images uploaded without a device key prefix.
+
+        :param metadata: Image header fields, or seen again message fields.
+        :return: DeviceState, None if the header names no device.
+        """
+        for field in metadata[2:]:
+            if field.startswith("D="):
+                if field[2:] not in self.devices:
+                    self.devices[field[2:]] = DeviceState(field[2:])
+                return self.devices[field[2:]]
+        return None
+
+    def listDevices(self):
+        """
+        Lists the devices uploading to the bucket, one per top level key prefix ({device}/...). Objects at the top
+        level (single camera deployments from before device prefixes) belong to DEFAULT_DEVICE.
+
+        :return: Dictionary of device id to its top level objects (DEFAULT_DEVICE) or None (listed when ingesting).
+        """
+        client = self.s3.meta.client
+        bucket = self.s3.Bucket(self.bucketname)
+        kwargs = {"Bucket": self.bucketname, "Delimiter": "/"}
+        shards = {}
+        root = []
+        while True:
+            page = client.list_objects_v2(**kwargs)
+            for prefix in page.get("CommonPrefixes", []):
+                shards[prefix["Prefix"][:-1]] = None
+            root.extend(bucket.Object(obj["Key"]) for obj in page.get("Contents", []))
+            if not page.get("IsTruncated"):
+                break
+            kwargs["ContinuationToken"] = page["NextContinuationToken"]
+        if root:
+            shards[DEFAULT_DEVICE] = root
+        return shards
+
+    def filename(self, device, uploaded):
+        """
+        Gets the file name of an image (and its barcode).
+
+        :param device: Device id.
+        :param uploaded: Upload time datetime object.
+        :return: File name, without extension.
+        """
+        if device == DEFAULT_DEVICE:
+            return datetimeToString(uploaded)
+        return "{}-{}".format(device, datetimeToString(uploaded))
+
+    def ingestDevice(self, state, objects=None):
+        """
+        Fetches and reassembles the uploads of one device since its cursor. Runs on a worker thread, the results are
+        rendered and applied by pull().
+
+        :param state: DeviceState of the device.
+        :param objects: Objects of the device, listed from its key prefix after the cursor if None.
+        :return: Dictionary - device, images (see render), telemetry (upload time, telemetry), seen again messages
+        (upload time, metadata), cursor to resume from, key of the latest message counted and pending fragments. The
+        device state is left for pull() to update.
+        """
+        if objects is None:
+            bucket = self.s3.Bucket(self.bucketname)
+            marker = {"Marker": state.cursor} if state.cursor else {}
+            with self.metrics.timer("list"):
+                objects = list(bucket.objects.filter(Prefix=state.device + "/", **marker))
+        else:
+            objects = [obj for obj in objects if obj.key > state.cursor]
+
+        images = []  # List of reassembled images
+        telemetry = []
+        seen = []
         parsing = False  # Flags whether or not an image the current AWS bucket entry is part of an image
         metadata = None  # Entry metadata
+        pending = 0  # Fragments received for the image currently being parsed
+        error = None  # Why the image currently being parsed is broken, None if it is not
+        cursor = state.cursor  # Last key of which everything up to is processed
+        previous = state.cursor
+        counted = state.counted
+
+        def image(reason=None):
+            return {"data": bytes(arr), "filename": self.filename(state.device, last), "metadata": metadata,
+                    "device": state.device, "uploaded": last, "keys": [first, lastKey], "fragments": pending,
+                    "error": reason or error}
+
+        def message(body, uploaded):
+            if body.startswith(b"{Telemetry"):
+                telemetry.append((uploaded, parseTelemetry(body.decode(errors="replace"))))
+            elif body.startswith(b"{Seen Again"):
+                fields = body.decode(errors="replace").replace('}', "").split(',')[1:]
+                if len(fields) >= 2:
+                    seen.append((uploaded, fields))
+                    self.metrics.count("seen_again")
 
         """
         Each detection by the camera is sent to AWS in the following format:
-        {Image Start,__headers__}   # marks the start of an entry, __headers__ is comma separated
+        {Image Start,__headers__}   # marks the start of an entry, __headers__ is comma separated, or a binary
+                                    # metadata record (see parseRecord)
         image hex string            # There can be multiple image hex strings
         {Image End}                 # marks the end of an entry
+        Modem telemetry is sent as a separate {Telemetry,...} entry after the end of an image. A parcel scanned again
+        soon after its upload is not uploaded twice, the camera sends a {Seen Again,type,payload,D=device,T=time} entry.
+        Telemetry and seen again entries may also arrive packed together in one batch (see parseBatch).
+        An image which is not complete yet is read again from its start by the next pull. Broken images are kept, with
+        the reason, to be quarantined.
         """
-        for obj in self.s3.Bucket('intern-cam').objects.all():
-            if "Image Start" in obj.get()['Body'].read().decode():
-                parsing = True
-                arr = bytearray()
-                metadata = obj.get()['Body'].read().decode().replace('}', "").split(',')[1:]
-                if len(metadata) < 1:
-                    parsing = False
-                continue
-            if parsing and obj.get()['Body'].read().decode() != "{Image Start}":
-                if obj.get()['Body'].read().decode() == "{Image End}":
-                    images.append((arr, obj.get()['LastModified'], metadata))
-                    metadata = None
-                    parsing = False
+        for obj in objects:
+            with self.metrics.timer("fetch"):
+                response = obj.get()
+                body = response['Body'].read()
+            self.metrics.count("objects")
+            self.metrics.count("bytes", len(body))
+            with self.metrics.timer("decode"):
+                key, previous = previous, obj.key
+                if body.startswith(b"{Telemetry") or body.startswith(b"{Seen Again"):
+                    # Read again while an image before it is pending, only count it once
+                    if obj.key > counted:
+                        message(body, response['LastModified'])
+                        counted = obj.key
+                    if not parsing:
+                        cursor = obj.key
                     continue
-                arr.extend(binascii.unhexlify(obj.get()['Body'].read()))
-        # print(images)
-
-        # Get most recent entry
-        newest = None
-        if images:
-            newest = images[0]
-
-        # Save parsed images as files. Same entries are not processed more than once per instance
-        # count dict and df instance variables are updated accordingly
-        for img in images:
-            if not datetimeToString(img[1]) in self.files:
-                im = Image.open(BytesIO(img[0]))
-                # im.show()
-                im.save("./assets/{}.png".format(datetimeToString(img[1])))
-                if img[2]:
-                    saveBarcode(img[2][0], img[2][1], datetimeToString(img[1]))
-                    self.count[img[2][2]] += 1
-                self.files.append(datetimeToString(img[1]))
-                roundDate = roundTime(img[1], 60 * 60)
-                if roundDate not in self.df.values:
-                    self.df = self.df.append({"Date": roundDate, "Count": 0}, ignore_index=True)
-                loc = getIndexes(self.df, roundDate)[0][0]
-                self.df.at[loc, "Count"] += 1
-
-            newest = img
-        print("Pulled Data from AWS!")
-        self.mostRecent = (datetimeToString(newest[1]), newest[2][2])
+                if body.startswith(BATCH_MAGIC):
+                    if obj.key > counted:
+                        try:
+                            batched = parseBatch(body)
+                        except ValueError as e:
+                            print("Skipped batch {}: {}".format(obj.key, e))
+                            batched = []
+                        for entry in batched:
+                            message(entry, response['LastModified'])
+                        self.metrics.count("batched", len(batched))
+                        counted = obj.key
+                    if not parsing:
+                        cursor = obj.key
+                    continue
+                if body.startswith(RECORD_MAGIC) or b"Image Start" in body:
+                    if parsing:
+                        images.append(image("image end never arrived, next image started at " + obj.key))
+                    # Anything before the start of an image is done with
+                    cursor = key
+                    parsing = True
+                    arr = bytearray()
+                    pending = 0
+                    first = lastKey = obj.key
+                    last = response['LastModified']
+                    error = None
+                    try:
+                        metadata = parseHeader(body)
+                    except ValueError as e:
+                        metadata = []
+                        error = "header record is malformed: {}".format(e)
+                    if error is None and len(metadata) < 3:
+                        error = "header has {} fields, expected type, payload and label".format(len(metadata))
+                    elif error is None and metadata[2] not in self.count:
+                        error = "unknown label " + metadata[2]
+                    continue
+                if parsing:
+                    last = response['LastModified']
+                    lastKey = obj.key
+                    if body == b"{Image End}":
+                        images.append(image())
+                        metadata = None
+                        parsing = False
+                        cursor = obj.key
+                        continue
+                    try:
+                        arr.extend(binascii.unhexlify(body))
+                    except (binascii.Error, ValueError) as e:
+                        error = error or "fragment {} is not hex: {}".format(obj.key, e)
+                    pending += 1
+                    self.metrics.count("fragments")
+                else:
+                    cursor = obj.key
+        if parsing and datetime.datetime.now(datetime.timezone.utc) - last > STALE_IMAGE:
+            # Give up on an image whose end is long overdue, rather than reading it again on every pull
+            images.append(image("image end never arrived, last fragment at " + last.isoformat()))
+            parsing = False
+            cursor = lastKey
+        return {"device": state.device, "images": images, "telemetry": telemetry, "seen": seen, "cursor": cursor,
+                "counted": counted, "pending": pending if parsing else 0}
+
+    def decoderPool(self):
+        """
+        Gets the pool images are validated and rendered on, started on first use. Workers are processes, so that they
+        use every core. They are started from a fork server with this module preloaded, or spawned where there is none,
+        rather than forked from this process, which runs the ingest and dashboard threads.
+
+        :return: Executor.
+        """
+        if self.decoders is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            self.decoders = concurrent.futures.ProcessPoolExecutor(self.processes, mp_context=context)
+        return self.decoders
+
+    def resetDecoders(self, wait=False):
+        """
+        Shuts the decoder pool down, the next render starts a new one.
+
+        :param wait: Flags whether to wait for the workers to exit, do so before the process exits.
+        """
+        if self.decoders is not None:
+            self.decoders.shutdown(wait=wait, cancel_futures=True)
+            self.decoders = None
+
+    def render(self, images):
+        """
+        Validates and renders reassembled images on the decoder pool (see renderImage). Images which are not valid are
+        moved to the quarantine directory instead, without holding up the others.
+
+        :param images: List of dictionaries - data, filename, metadata, plus device, uploaded, keys, fragments and
+        error for diagnostics.
+        :return: List of diagnostics dictionaries (None for rendered images), in image order.
+        """
+        jobs = [dict(image, assets=self.assets, quarantine=self.quarantine) for image in images]
+        if not jobs:
+            return []
+        chunksize = max(1, len(jobs) // (4 * (self.processes or os.cpu_count() or 1)))
+        try:
+            return list(self.decoderPool().map(renderImage, jobs, chunksize=chunksize))
+        except concurrent.futures.process.BrokenProcessPool:
+            # A worker died, e.g. killed for running out of memory. A broken pool fails every later map, start a new
+            # one and render again once. If that breaks too the pull fails, and the next one starts another pool
+            print("Decoder pool broke, restarting it")
+            self.resetDecoders()
+            try:
+                return list(self.decoderPool().map(renderImage, jobs, chunksize=chunksize))
+            except concurrent.futures.process.BrokenProcessPool:
+                self.resetDecoders()
+                raise
+
+    def prometheus(self):
+        """
+        Renders pull and device metrics in the Prometheus text exposition format.
+
+        :return: Metrics text.
+        """
+        lines = []
+
+        def metric(name, kind, description, samples):
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for labels, value in samples:
+                label = ",".join('{}="{}"'.format(k, v) for k, v in labels.items())
+                lines.append("{}{} {}".format(name, "{" + label + "}" if label else "", value))
+
+        last = self.metrics.last or {}
+        metric("ltem_pull_duration_seconds", "gauge", "Duration of the last pull from S3.",
+               [({}, last.get("duration", 0))])
+        metric("ltem_pull_stage_seconds", "gauge", "Time spent in each stage of the last pull.",
+               [({"stage": stage}, last.get(stage, 0)) for stage in PullMetrics.STAGES])
+        if self.metrics.interval:
+            metric("ltem_pull_interval_seconds", "gauge", "Expected interval between pulls.",
+                   [({}, self.metrics.interval)])
+        metric("ltem_pull_reassembly_backlog", "gauge", "Fragments of images not fully received yet.",
+               [({}, last.get("backlog", 0))])
+        metric("ltem_pull_fragments_per_second", "gauge", "Image fragments processed per second in the last pull.",
+               [({}, last.get("fragmentsPerSecond", 0))])
+        totals = {
+            "pulls": "Pulls completed.",
+            "overruns": "Pulls that took longer than the pull interval.",
+            "objects": "S3 objects fetched.",
+            "bytes": "Bytes fetched from S3.",
+            "fragments": "Image fragments reassembled.",
+            "images": "New images rendered.",
+            "quarantined": "Images failing validation, moved to quarantine.",
+            "seen_again": "Parcels scanned again soon after their upload, reported without an image.",
+            "batched": "Small messages received in batches.",
+        }
+        for counter, description in totals.items():
+            metric("ltem_{}_total".format(counter), "counter", description, [({}, self.metrics.totals[counter])])
+        stages = sorted(self.deviceStats.items())
+        metric("ltem_device_stage_milliseconds", "gauge", "Device stage duration quantiles from the latest image "
+               "header.", [({"stage": stage, "quantile": q}, values[key])
+                           for stage, values in stages for q, key in (("0.5", "p50"), ("0.95", "p95"))])
+        metric("ltem_device_stage_min_milliseconds", "gauge", "Shortest device stage duration from the latest image "
+               "header.", [({"stage": stage}, values["min"]) for stage, values in stages])
+        metric("ltem_device_stage_max_milliseconds", "gauge", "Longest device stage duration from the latest image "
+               "header.", [({"stage": stage}, values["max"]) for stage, values in stages])
+        metric("ltem_modem_signal", "gauge", "Latest modem signal quality sample.",
+               [({"key": key}, value) for key, value in self.modemHealth.get("signal", {}).items()])
+        devices = sorted(self.devices.items())
+        metric("ltem_device_parcels_total", "counter", "Parcels detected per device and condition.",
+               [({"device": device, "label": label}, n)
+                for device, state in devices for label, n in state.count.items()])
+        metric("ltem_device_power", "gauge", "Latest camera duty cycle record per device (timeout and gap in seconds, "
+               "mj per parcel, naps and sleeps).",
+               [({"device": device, "key": key}, value)
+                for device, state in devices for key, value in state.modemHealth.get("power", {}).items()])
+        metric("ltem_device_seen_again_total", "counter", "Parcels scanned again soon after their upload per device.",
+               [({"device": device}, state.seenAgain) for device, state in devices])
+        metric("ltem_device_last_seen_timestamp_seconds", "gauge", "Upload time of each device's latest image.",
+               [({"device": device}, state.lastSeen.timestamp()) for device, state in devices if state.lastSeen])
+        metric("ltem_device_modem_signal", "gauge", "Latest modem signal quality sample per device.",
+               [({"device": device, "key": key}, value)
+                for device, state in devices for key, value in state.modemHealth.get("signal", {}).items()])
+        return "\n".join(lines) + "\n"
+
+
+class Ingester(threading.Thread):
+    """
+    Background thread running the pulls, so that dashboard callbacks never wait on S3. Pulls shortly after S3 reports
+    new objects (see handleEvent), and every interval seconds as long as no event has been received. Once events
+    arrive polling backs off to eventInterval, only as a safety net for lost notifications.
+    """
+
+    def __init__(self, aws, interval=60, eventInterval=900, settle=0.5):
+        """
+        :param aws: pullS3 instance to pull with.
+        :param interval: Seconds between pulls without event notifications.
+        :param eventInterval: Seconds between pulls once event notifications are received.
+        :param settle: Seconds to wait after a notification before pulling, so that a burst of fragment uploads is
+        picked up by a single pull.
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.aws = aws
+        self.interval = interval
+        self.eventInterval = eventInterval
+        self.settle = settle
+        self.events = 0
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+    def handleEvent(self, event):
+        """
+        Handles an S3 event notification, triggering a pull if it reports new objects in the bucket.
+
+        :param event: Event notification dictionary (see s3EventKeys).
+        :return: Number of new objects reported.
+        """
+        keys = s3EventKeys(event, self.aws.bucketname)
+        if keys:
+            self.events += len(keys)
+            self.wake.set()
+        return len(keys)
+
+    def trigger(self):
+        """
+        Triggers a pull.
+        """
+        self.wake.set()
+
+    def stop(self):
+        """
+        Stops the thread after the current pull.
+        """
+        self.stopped.set()
+        self.wake.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            if self.wake.wait(self.eventInterval if self.events else self.interval):
+                self.stopped.wait(self.settle)
+            if self.stopped.is_set():
+                break
+            self.wake.clear()
+            try:
+                self.aws.pull()
+            except Exception:
+                # Keep ingesting, the next pull re-reads the bucket
+                traceback.print_exc()
 
 
 if __name__ == "__main__":
     obj = pullS3()
     obj.pull()
     # print(obj.count)
-    # print(obj.df)
     # obj.pull()
     # print(obj.count)
-    # print(obj.df)
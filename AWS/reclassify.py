@@ -0,0 +1,266 @@
+"""
+Batch re-classification of archived detection images. Runs a TFLite classifier (trained.tflite, or a newer model) over
+the images pullS3 rendered into the assets directory, and writes the cloud label, scores and model version into each
+image's detection record (<file>.json, see pullS3.detectionRecord). The dashboard then compares device and cloud labels.
+
+Images are preprocessed into NumPy batches and classified one batch per interpreter invocation, on a pool of worker
+processes each holding its own interpreter. Records already classified by the same model version are skipped, so the
+script can be re-run as new images arrive.
+
+Usage: python reclassify.py --model trained.tflite [--assets ./assets] [--processes 4] [--batch 32] [--all]
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "OpenMV", "host"))
+from classifier import LABELS, loadInterpreter
+
+# Interpreter of the current worker process, set by initWorker
+worker = None
+
+
+def modelVersion(path):
+    """
+    Names a model after its file and contents, so that retraining into the same file gives a new version.
+
+    :param path: .tflite file.
+    :return: Model version string, <file name>@<first 8 hex digits of its SHA-256>.
+    """
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return "{}@{}".format(os.path.basename(path), digest[:8])
+
+
+class BatchClassifier:
+    """
+    Classifies images in batches with one TFLite interpreter. The input tensor is resized to the batch size once, the
+    last partial batch is padded. Models whose batch dimension cannot be resized are run one image at a time.
+    """
+
+    def __init__(self, path, batch=32, threads=1):
+        """
+        :param path: .tflite file.
+        :param batch: Images per invocation.
+        :param threads: Interpreter threads.
+        """
+        self.interpreter = loadInterpreter(path, threads)
+        self.input = self.interpreter.get_input_details()[0]
+        _, self.height, self.width, self.channels = self.input["shape"]
+        self.batch = batch
+        try:
+            self.interpreter.resize_tensor_input(self.input["index"], [batch, self.height, self.width, self.channels])
+            self.interpreter.allocate_tensors()
+        except (RuntimeError, ValueError):
+            self.batch = 1
+            self.interpreter = loadInterpreter(path, threads)
+            self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+
+    def load(self, path):
+        """
+        :param path: Image file.
+        :return: uint8 array of shape (height, width, channels), the image scaled to the model input.
+        """
+        with Image.open(path) as im:
+            im = im.convert("L" if self.channels == 1 else "RGB").resize((self.width, self.height), Image.BILINEAR)
+            return numpy.asarray(im).reshape(self.height, self.width, self.channels)
+
+    def convert(self, pixels):
+        """
+        Converts a batch of pixels the way the camera feeds the model: 0-255 for uint8 models, -128-127 for int8 and
+        0-1 for float.
+
+        :param pixels: uint8 array of shape (n, height, width, channels).
+        :return: Array of the model input type.
+        """
+        dtype = self.input["dtype"]
+        if dtype == numpy.int8:
+            return (pixels.astype(numpy.int16) - 128).astype(numpy.int8)
+        if dtype != numpy.uint8:
+            return pixels.astype(dtype) / numpy.array(255, dtype=dtype)
+        return pixels
+
+    def invoke(self, pixels):
+        """
+        :param pixels: Input array of at most batch images.
+        :return: Float array of scores, one row per image.
+        """
+        n = len(pixels)
+        if n < self.batch:
+            pixels = numpy.concatenate([pixels, numpy.zeros((self.batch - n,) + pixels.shape[1:], pixels.dtype)])
+        self.interpreter.set_tensor(self.input["index"], pixels)
+        self.interpreter.invoke()
+        scores = self.interpreter.get_tensor(self.output["index"])[:n].astype(numpy.float32)
+        scale, zero = self.output["quantization"]
+        if scale:
+            scores = (scores - zero) * scale
+        return scores
+
+    def infer(self, pixels):
+        """
+        :param pixels: Input array, from convert().
+        :return: Float array of scores, one row per image.
+        """
+        return numpy.concatenate([self.invoke(pixels[i:i + self.batch]) for i in range(0, len(pixels), self.batch)])
+
+
+def initWorker(path, batch):
+    """
+    Loads the model once per worker process.
+
+    :param path: .tflite file.
+    :param batch: Images per invocation.
+    """
+    global worker
+    worker = BatchClassifier(path, batch=batch)
+
+
+def classifyChunk(assets, filenames):
+    """
+    Classifies a chunk of images on a worker. An image that cannot be decoded only skips that image.
+
+    :param assets: Assets directory.
+    :param filenames: Image file names, without extension.
+    :return: List of (filename, scores list or None), Seconds spent preprocessing, Seconds spent in inference.
+    """
+    start = time.perf_counter()
+    pixels = numpy.empty((len(filenames), worker.height, worker.width, worker.channels), dtype=numpy.uint8)
+    found = []
+    for filename in filenames:
+        try:
+            pixels[len(found)] = worker.load(os.path.join(assets, filename + ".png"))
+        except Exception:
+            continue
+        found.append(filename)
+    pixels = worker.convert(pixels[:len(found)])
+    loaded = time.perf_counter()
+    scores = worker.infer(pixels) if found else []
+    done = time.perf_counter()
+    results = dict(zip(found, (row.tolist() for row in scores)))
+    return [(filename, results.get(filename)) for filename in filenames], loaded - start, done - loaded
+
+
+def pendingImages(assets, version, everything=False):
+    """
+    Lists the images to classify: every rendered image (barcode images excluded) whose record has no cloud label from
+    this model version. Images without a detection record, e.g. static assets, are left alone.
+
+    :param assets: Assets directory.
+    :param version: Model version.
+    :param everything: Flags whether to classify images already labelled by this version too.
+    :return: List of image file names, without extension.
+    """
+    pending = []
+    for name in sorted(os.listdir(assets)):
+        if not name.endswith(".png") or name.endswith("-b.png"):
+            continue
+        filename = name[:-len(".png")]
+        record = readRecord(assets, filename)
+        if record is None:
+            continue
+        if everything or record.get("cloud", {}).get("model") != version:
+            pending.append(filename)
+    return pending
+
+
+def readRecord(assets, filename):
+    """
+    :param assets: Assets directory.
+    :param filename: Image file name, without extension.
+    :return: Detection record, None if missing or unreadable.
+    """
+    try:
+        with open(os.path.join(assets, filename + ".json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def writeRecord(assets, filename, scores, version, labels=LABELS):
+    """
+    Adds the cloud label to a detection record. The record is replaced atomically, the dashboard may be reading it.
+
+    :param assets: Assets directory.
+    :param filename: Image file name, without extension.
+    :param scores: Per-label scores.
+    :param version: Model version.
+    :param labels: Model labels, in output order.
+    """
+    record = readRecord(assets, filename) or {}
+    best = max(range(len(scores)), key=scores.__getitem__)
+    record["cloud"] = {"label": labels[best] if best < len(labels) else str(best),
+                       "confidence": round(scores[best], 4), "scores": [round(s, 4) for s in scores],
+                       "model": version,
+                       "classified": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")}
+    path = os.path.join(assets, filename + ".json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(record, f)
+    os.replace(path + ".tmp", path)
+
+
+def reclassify(model, assets="./assets", processes=None, batch=32, chunk=256, everything=False, version=None):
+    """
+    Re-classifies archived images and writes the results into their detection records.
+
+    :param model: .tflite file.
+    :param assets: Assets directory.
+    :param processes: Worker processes, one per core if None.
+    :param batch: Images per interpreter invocation.
+    :param chunk: Images per task sent to a worker.
+    :param everything: Flags whether to re-classify images already labelled by this model version.
+    :param version: Model version recorded, derived from the model file if None.
+    :return: Dictionary - images classified, skipped (unreadable), seconds, preprocessing and inference seconds
+    summed over workers, processes, images per second and per second per core.
+    """
+    version = version or modelVersion(model)
+    processes = processes or os.cpu_count() or 1
+    pending = pendingImages(assets, version, everything)
+    summary = {"model": version, "images": 0, "skipped": 0, "processes": processes, "preprocess_s": 0.0,
+               "inference_s": 0.0}
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(processes, initializer=initWorker,
+                                                initargs=(model, batch)) as pool:
+        futures = [pool.submit(classifyChunk, assets, pending[i:i + chunk]) for i in range(0, len(pending), chunk)]
+        for future in concurrent.futures.as_completed(futures):
+            results, preprocess, inference = future.result()
+            summary["preprocess_s"] += preprocess
+            summary["inference_s"] += inference
+            for filename, scores in results:
+                if scores is None:
+                    summary["skipped"] += 1
+                    continue
+                writeRecord(assets, filename, scores, version)
+                summary["images"] += 1
+    summary["seconds"] = time.perf_counter() - start
+    summary["images_per_s"] = summary["images"] / summary["seconds"] if summary["seconds"] else 0.0
+    summary["images_per_s_per_core"] = summary["images_per_s"] / processes
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-classify archived detection images with a TFLite model.")
+    parser.add_argument("--model", default="trained.tflite")
+    parser.add_argument("--assets", default="./assets")
+    parser.add_argument("--processes", type=int, help="worker processes, one per core by default")
+    parser.add_argument("--batch", type=int, default=32, help="images per interpreter invocation")
+    parser.add_argument("--version", help="model version recorded, <file>@<sha256 prefix> by default")
+    parser.add_argument("--all", action="store_true", help="also re-classify images labelled by this model version")
+    args = parser.parse_args()
+
+    result = reclassify(args.model, args.assets, args.processes, args.batch, everything=args.all,
+                        version=args.version)
+    print("{model}: {images} images classified, {skipped} skipped in {seconds:.1f} s on {processes} processes".format(
+        **result))
+    print("{:.1f} images/s, {:.1f} images/s per core (worker time: preprocessing {:.1f} s, inference {:.1f} s)".format(
+        result["images_per_s"], result["images_per_s_per_core"], result["preprocess_s"], result["inference_s"]))
@@ -0,0 +1,21 @@
+"""
+Barcode type lookup shared by the OpenMV scripts. The table is built once at import from the image module constants,
+so resolving a barcode type is a single dictionary lookup instead of an if-chain calling code.type() per branch.
+"""
+
+import image
+
+BARCODE_TYPES = ("EAN2", "EAN5", "EAN8", "UPCE", "ISBN10", "UPCA", "EAN13", "ISBN13", "I25", "DATABAR", "DATABAR_EXP",
+                 "CODABAR", "CODE39", "PDF417", "CODE93", "CODE128")
+
+BARCODE_NAMES = {getattr(image, name): name for name in BARCODE_TYPES}
+
+
+def barcode_name(code):
+    """
+    Gets barcode type from barcode object.
+
+    :param code: Barcode object.
+    :return: Barcode type.
+    """
+    return BARCODE_NAMES.get(code.type())
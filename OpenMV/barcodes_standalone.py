@@ -1,4 +1,5 @@
-import sensor, image, time, math
+import sensor, time, math
+from barcode_types import barcode_name
 
 sensor.reset()
 sensor.set_pixformat(sensor.GRAYSCALE)
@@ -10,41 +11,6 @@ sensor.set_auto_whitebal(False)  # must turn this off to prevent image washout..
 clock = time.clock()
 
 
-def barcode_name(code):
-    if code.type() == image.EAN2:
-        return "EAN2"
-    if code.type() == image.EAN5:
-        return "EAN5"
-    if code.type() == image.EAN8:
-        return "EAN8"
-    if code.type() == image.UPCE:
-        return "UPCE"
-    if code.type() == image.ISBN10:
-        return "ISBN10"
-    if code.type() == image.UPCA:
-        return "UPCA"
-    if code.type() == image.EAN13:
-        return "EAN13"
-    if code.type() == image.ISBN13:
-        return "ISBN13"
-    if code.type() == image.I25:
-        return "I25"
-    if code.type() == image.DATABAR:
-        return "DATABAR"
-    if code.type() == image.DATABAR_EXP:
-        return "DATABAR_EXP"
-    if code.type() == image.CODABAR:
-        return "CODABAR"
-    if code.type() == image.CODE39:
-        return "CODE39"
-    if code.type() == image.PDF417:
-        return "PDF417"
-    if code.type() == image.CODE93:
-        return "CODE93"
-    if code.type() == image.CODE128:
-        return "CODE128"
-
-
 while True:
     clock.tick()
     img = sensor.snapshot()
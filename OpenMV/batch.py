@@ -0,0 +1,189 @@
+"""
+Batching of small messages (modem telemetry, seen again events). Every MQTT publish costs a +SMPUB round trip waiting
+for the modem acknowledgement, so small messages are queued and sent together in one publish once the batch is full or
+old, or before the MQTT session is closed. Batches are zlib compressed, by the firmware if it has a compressor and by
+fixedzlib otherwise (stock OpenMV firmware has none), and the number of messages packed adapts to the compression ratio
+seen so far to fill the publish size limit.
+
+Layout, little endian:
+    magic       B       0xA6, never the first byte of a text message, hex fragment or metadata record
+    version     B       batch layout version, 1
+    flags       B       bit 0: body is a zlib stream
+    count       H       number of messages
+    body                messages, each H + n bytes, compressed if flagged
+
+AWS/pullS3.py unpacks batches and reads each message as if it was published on its own. Plain Python so the same code
+runs on the OpenMV camera and on the host (see host/replay.py).
+"""
+
+import io
+import struct
+
+import fixedzlib
+
+try:
+    import zlib
+except ImportError:
+    zlib = None
+try:
+    import deflate  # MicroPython 1.21+, compresses if the port is built with compression
+except ImportError:
+    deflate = None
+
+MAGIC = 0xA6
+VERSION = 1
+COMPRESSED = 1
+
+HEAD = "<BBBH"
+HEAD_SIZE = struct.calcsize(HEAD)
+
+
+def compress(data):
+    """
+    :param data: Bytes.
+    :return: zlib stream of data.
+    """
+    if zlib is not None and hasattr(zlib, "compress"):
+        return zlib.compress(data)
+    if deflate is not None:
+        stream = io.BytesIO()
+        try:
+            compressor = deflate.DeflateIO(stream, deflate.ZLIB)
+            compressor.write(data)
+            compressor.close()
+        except OSError:
+            # Port built without compression
+            return fixedzlib.compress(data)
+        return stream.getvalue()
+    return fixedzlib.compress(data)
+
+
+def unpack(data):
+    """
+    Unpacks a batch, the inverse of Batcher.pack().
+
+    :param data: Batch bytes.
+    :return: List of message bytes.
+    :raise ValueError: If the data is not a batch of a known version.
+    """
+    if len(data) < HEAD_SIZE or data[0] != MAGIC:
+        raise ValueError("not a message batch")
+    magic, version, flags, count = struct.unpack(HEAD, data[:HEAD_SIZE])
+    if version != VERSION:
+        raise ValueError("unknown message batch version %d" % version)
+    body = data[HEAD_SIZE:]
+    if flags & COMPRESSED:
+        body = zlib.decompress(body)
+    messages = []
+    pos = 0
+    for _ in range(count):
+        if pos + 2 > len(body):
+            raise ValueError("message batch is truncated")
+        n = struct.unpack("<H", body[pos:pos + 2])[0]
+        if pos + 2 + n > len(body):
+            raise ValueError("message batch is truncated")
+        messages.append(bytes(body[pos + 2:pos + 2 + n]))
+        pos += 2 + n
+    return messages
+
+
+class Batcher:
+    """
+    Queues small messages and packs them into batches of at most limit bytes.
+    """
+
+    def __init__(self, limit=1024, max_age=300, compression=True):
+        """
+        :param limit: Most bytes in a batch, within the modem publish size limit.
+        :param max_age: Seconds the oldest queued message may wait before the batch is due.
+        :param compression: Flags whether to compress batches.
+        """
+        self.limit = limit
+        self.max_age = max_age
+        self.compression = compression
+        self.messages = []
+        self.queued = []
+        self.oldest = None
+        self.ratio = 1.0
+        self.batches = 0
+        self.packed = 0
+        self.raw = 0
+        self.sent = 0
+
+    def add(self, message, now):
+        """
+        Queues a message.
+
+        :param message: Message text or bytes.
+        :param now: Time in seconds.
+        """
+        self.messages.append(message.encode("utf-8") if isinstance(message, str) else bytes(message))
+        self.queued.append(now)
+        if self.oldest is None:
+            self.oldest = now
+
+    def size(self, count=None):
+        """
+        :param count: Number of queued messages, all if None.
+        :return: Uncompressed body size of the first count messages.
+        """
+        messages = self.messages if count is None else self.messages[:count]
+        return sum(2 + len(message) for message in messages)
+
+    def full(self):
+        """
+        :return: Whether the queued messages are expected to fill a batch, at the compression ratio seen so far.
+        """
+        return HEAD_SIZE + self.size() / self.ratio >= self.limit
+
+    def due(self, now):
+        """
+        :param now: Time in seconds.
+        :return: Whether a batch should be sent, because it is full or its oldest message waited max_age seconds.
+        """
+        if not self.messages:
+            return False
+        return self.full() or now - self.oldest >= self.max_age
+
+    def pack(self):
+        """
+        Packs as many queued messages as fit in one batch, at least one.
+
+        :return: Batch bytes, None if no message is queued.
+        """
+        if not self.messages:
+            return None
+        count = 1
+        while count < len(self.messages) and HEAD_SIZE + self.size(count + 1) / self.ratio <= self.limit:
+            count += 1
+        while True:
+            body = b"".join(struct.pack("<H", len(message)) + message for message in self.messages[:count])
+            flags = 0
+            packed = compress(body) if self.compression else None
+            if packed is not None and len(packed) < len(body):
+                flags = COMPRESSED
+                body = packed
+            if HEAD_SIZE + len(body) <= self.limit or count == 1:
+                break
+            count -= 1
+        raw = self.size(count)
+        if flags:
+            self.ratio = raw / len(body)
+        self.batches += 1
+        self.packed += count
+        self.raw += HEAD_SIZE + raw
+        self.sent += HEAD_SIZE + len(body)
+        # Messages left over wait from when they were queued, not from when the first packed message was
+        self.messages = self.messages[count:]
+        self.queued = self.queued[count:]
+        self.oldest = self.queued[0] if self.queued else None
+        return struct.pack(HEAD, MAGIC, VERSION, flags, count) + body
+
+    def telemetry(self):
+        """
+        Compact batching record, sent with the modem telemetry. Format: B=key:value;key:value...
+
+        :return: Batching record string.
+        """
+        fields = {"batches": self.batches, "messages": self.packed, "raw": self.raw, "sent": self.sent}
+        return "B=" + ";".join("%s:%d" % (key, fields[key]) for key in fields)
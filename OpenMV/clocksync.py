@@ -0,0 +1,99 @@
+"""
+Camera clock sync. The camera RTC is not set at power up, so capture times are taken from the modem clock instead: it
+is set from NTP (+CNTP) at bring-up and read with +CCLK?, and its offset from the camera clock is cached. Detections
+are then stamped with their capture time in seconds since 1970 UTC, however late they are uploaded.
+
+Plain Python so the same code runs on the OpenMV camera and on the host (see host/replay.py).
+"""
+
+import time
+
+# Seconds from 1970 to the epoch of time.time(), MicroPython ports count from 2000
+EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
+
+# Clock readings before 2021 mean the clock was never set
+CLOCK_SET = 1609459200
+
+
+def civilDays(year, month, day):
+    """
+    :param year: Year, e.g. 2021.
+    :param month: Month, 1-12.
+    :param day: Day of the month, 1-31.
+    :return: Days since 1970-01-01.
+    """
+    year -= month <= 2
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def parseCclk(response):
+    """
+    Parses the modem clock. Format: +CCLK: "yy/MM/dd,hh:mm:ss+zz", local time zz quarter hours ahead of UTC.
+
+    :param response: +CCLK? response text.
+    :return: Seconds since 1970-01-01 UTC, None if the response has no clock or the modem clock is not set.
+    """
+    start = response.find('+CCLK: "')
+    if start < 0:
+        return None
+    value = response[start + 8:start + 28]
+    try:
+        year, month, day = (int(part) for part in value[0:8].split("/"))
+        hour, minute, second = (int(part) for part in value[9:17].split(":"))
+        zone = int(value[17:20])
+    except ValueError:
+        return None
+    seconds = civilDays(2000 + year, month, day) * 86400 + hour * 3600 + minute * 60 + second - zone * 900
+    return seconds if seconds >= CLOCK_SET else None
+
+
+class DeviceClock:
+    """
+    Converts camera clock readings into seconds since 1970 UTC, from the offset to the modem clock at the last sync.
+    """
+
+    def __init__(self, resync=24 * 3600):
+        """
+        :param resync: Seconds after which the clock is synced again, bounding the drift of the camera clock.
+        """
+        self.resync = resync
+        self.offset = None
+        self.synced = None
+
+    def sync(self, unix, now=None):
+        """
+        Caches the offset between the camera clock and a reading of the modem clock.
+
+        :param unix: Modem clock in seconds since 1970 UTC (see parseCclk), None if it could not be read.
+        :param now: Camera clock reading taken with the modem clock, time.time() if None.
+        :return: Whether the clock is synced.
+        """
+        if unix is None:
+            return False
+        now = time.time() if now is None else now
+        self.offset = unix - now
+        self.synced = now
+        return True
+
+    def due(self, now=None):
+        """
+        :param now: Camera clock reading, time.time() if None.
+        :return: Whether the clock was never synced or was synced more than resync seconds ago.
+        """
+        now = time.time() if now is None else now
+        return self.synced is None or now - self.synced > self.resync
+
+    def unix(self, t=None):
+        """
+        :param t: Camera clock reading, time.time() if None.
+        :return: Seconds since 1970-01-01 UTC, from the camera RTC if never synced, 0 if that is not set either.
+        """
+        t = time.time() if t is None else t
+        if self.offset is not None:
+            return int(t + self.offset)
+        t = int(t) + EPOCH_OFFSET
+        return t if t >= CLOCK_SET else 0
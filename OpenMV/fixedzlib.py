@@ -0,0 +1,170 @@
+"""
+zlib compression in plain Python, for firmware built without a compressor (stock OpenMV firmware has neither
+zlib.compress nor deflate.DeflateIO). Matches are found with a small hash chain over the last WINDOW bytes and coded
+with the fixed Huffman codes of deflate (RFC 1951), so there are no code tables to build or send, and the stream is a
+regular zlib stream (RFC 1950) that zlib.decompress inflates on the cloud side. Ratios are close to zlib for the short
+text messages it is meant for.
+
+Plain Python so the same code runs on the OpenMV camera and on the host (see host/replay.py).
+"""
+
+import struct
+
+WINDOW = 4096
+MIN_MATCH = 3
+MAX_MATCH = 258
+# Earlier positions tried per match, bounds the time spent on repetitive input
+CHAIN = 8
+
+LENGTH_BASE = (3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 15, 17, 19, 23, 27, 31, 35, 43, 51, 59, 67, 83, 99, 115, 131, 163,
+               195, 227, 258)
+LENGTH_EXTRA = (0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 0)
+DISTANCE_BASE = (1, 2, 3, 4, 5, 7, 9, 13, 17, 25, 33, 49, 65, 97, 129, 193, 257, 385, 513, 769, 1025, 1537, 2049,
+                 3073, 4097, 6145, 8193, 12289, 16385, 24577)
+DISTANCE_EXTRA = (0, 0, 0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6, 7, 7, 8, 8, 9, 9, 10, 10, 11, 11, 12, 12, 13, 13)
+
+
+def reverse(code, bits):
+    """
+    :param code: Huffman code.
+    :param bits: Code length.
+    :return: Code with its bits reversed, Huffman codes are packed starting from their most significant bit.
+    """
+    out = 0
+    for _ in range(bits):
+        out = (out << 1) | (code & 1)
+        code >>= 1
+    return out
+
+
+def fixedCode(symbol):
+    """
+    :param symbol: Literal/length symbol, 0-287.
+    :return: Fixed Huffman code of the symbol, reversed for packing, and its length.
+    """
+    if symbol < 144:
+        return reverse(0x30 + symbol, 8), 8
+    if symbol < 256:
+        return reverse(0x190 + symbol - 144, 9), 9
+    if symbol < 280:
+        return reverse(symbol - 256, 7), 7
+    return reverse(0xC0 + symbol - 280, 8), 8
+
+
+LITERALS = [fixedCode(symbol) for symbol in range(288)]
+DISTANCES = [reverse(code, 5) for code in range(30)]
+
+
+def bucket(value, bases):
+    """
+    :param value: Match length or distance.
+    :param bases: LENGTH_BASE or DISTANCE_BASE.
+    :return: Index of the last base not above value.
+    """
+    i = len(bases) - 1
+    while bases[i] > value:
+        i -= 1
+    return i
+
+
+class BitWriter:
+    """
+    Packs bit fields into bytes, least significant bit first.
+    """
+
+    def __init__(self):
+        self.out = bytearray()
+        self.bits = 0
+        self.count = 0
+
+    def write(self, value, bits):
+        """
+        :param value: Field value.
+        :param bits: Field width.
+        """
+        self.bits |= value << self.count
+        self.count += bits
+        while self.count >= 8:
+            self.out.append(self.bits & 0xFF)
+            self.bits >>= 8
+            self.count -= 8
+
+    def flush(self):
+        """
+        :return: Packed bytes, the last byte padded with zero bits.
+        """
+        if self.count:
+            self.out.append(self.bits & 0xFF)
+            self.bits = 0
+            self.count = 0
+        return bytes(self.out)
+
+
+def adler32(data):
+    """
+    :param data: Bytes.
+    :return: Adler-32 checksum of data, the zlib stream trailer.
+    """
+    a, b = 1, 0
+    for i in range(0, len(data), 5552):
+        for byte in data[i:i + 5552]:
+            a += byte
+            b += a
+        a %= 65521
+        b %= 65521
+    return (b << 16) | a
+
+
+def compress(data):
+    """
+    :param data: Bytes.
+    :return: zlib stream of data, in a single fixed Huffman block.
+    """
+    data = bytes(data)
+    out = BitWriter()
+    out.write(1, 1)  # last block
+    out.write(1, 2)  # fixed Huffman codes
+    chains = {}
+    n = len(data)
+    pos = 0
+    while pos < n:
+        length = 0
+        distance = 0
+        if pos + MIN_MATCH <= n:
+            key = data[pos:pos + MIN_MATCH]
+            candidates = chains.get(key)
+            if candidates:
+                limit = min(MAX_MATCH, n - pos)
+                for start in reversed(candidates):
+                    if pos - start > WINDOW:
+                        break
+                    k = MIN_MATCH
+                    while k < limit and data[start + k] == data[pos + k]:
+                        k += 1
+                    if k > length:
+                        length, distance = k, pos - start
+                        if k == limit:
+                            break
+        step = length if length else 1
+        for i in range(pos, min(pos + step, n - MIN_MATCH + 1)):
+            key = data[i:i + MIN_MATCH]
+            candidates = chains.get(key)
+            if candidates is None:
+                chains[key] = [i]
+            else:
+                candidates.append(i)
+                if len(candidates) > CHAIN:
+                    candidates.pop(0)
+        if length:
+            i = bucket(length, LENGTH_BASE)
+            out.write(*LITERALS[257 + i])
+            out.write(length - LENGTH_BASE[i], LENGTH_EXTRA[i])
+            i = bucket(distance, DISTANCE_BASE)
+            out.write(DISTANCES[i], 5)
+            out.write(distance - DISTANCE_BASE[i], DISTANCE_EXTRA[i])
+        else:
+            out.write(*LITERALS[data[pos]])
+        pos += step
+    out.write(*LITERALS[256])  # end of block
+    # CMF: deflate with a 4 KB window, FLG: no dictionary, checked so that CMF * 256 + FLG is a multiple of 31
+    return b"\x48\x0d" + out.flush() + struct.pack(">I", adler32(data))
@@ -0,0 +1,28 @@
+"""
+Classifier helpers shared by the host-side tools (replay.py, replay_votes.py, model_variants.py and
+AWS/reclassify.py): the model's label order and a TFLite interpreter loader.
+
+LABELS is the one copy the host tools read, a model retrained with its labels in another order is fixed here. It must
+match the enumeration the camera sends (metarecord.LABELS) and pullS3 decodes (pullS3.LABELS), which
+tests/test_enumerations.py checks.
+"""
+
+# Model output order, the same labels as on the camera
+LABELS = ("background", "Damaged Parcel", "Parcel")
+
+
+def loadInterpreter(path, threads=1):
+    """
+    :param path: .tflite file.
+    :param threads: Interpreter threads.
+    :return: TFLite interpreter, from tflite-runtime or else TensorFlow, tensors not allocated yet.
+    """
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        try:
+            import tensorflow
+            Interpreter = tensorflow.lite.Interpreter
+        except ImportError:
+            raise ImportError("classifying needs tflite-runtime (pip install tflite-runtime) or tensorflow")
+    return Interpreter(model_path=path, num_threads=threads)
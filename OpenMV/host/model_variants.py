@@ -0,0 +1,304 @@
+"""
+Model variants for the on-device parcel classifier. Builds reduced input size and int8 quantized variants of the
+classifier from its Keras/SavedModel source (needs TensorFlow), benchmarks them (and any existing .tflite, such as
+trained.tflite) on the host CPU with tflite-runtime against a labelled image set, and exports the chosen variant as
+model_config.json for main.py (see loadModelConfig) together with the model file.
+
+The labelled set is a directory with one sub-directory of images per label (background, Damaged Parcel, Parcel), taken
+with the camera's 240x240 RGB window. Images are fed the way the camera feeds the model: scaled to the model input and
+converted to 0-255 for uint8 models, -128-127 for int8 and 0-1 for float. Latency is measured on one thread, per image.
+
+Usage: python model_variants.py dataset/ [--source saved_model/ --sizes 240 160 96 --int8] [--models trained.tflite]
+                                         [--out variants/] [--export auto|<variant>]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import voting
+from classifier import LABELS, loadInterpreter
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+# Camera frame sizes the RGB window can be captured from, widest first. The window keeps the field of view of the
+# default 240x240 window of QVGA (320x240), so its side is 3/4 of the frame height
+FRAME_SIZES = (("QVGA", 240), ("QQVGA", 120))
+
+
+def loadDataset(path, labels=LABELS):
+    """
+    Lists a labelled image set.
+
+    :param path: Directory with one sub-directory of images per label.
+    :param labels: Model labels, in output order.
+    :return: List of (image file, label index).
+    """
+    dataset = []
+    for index, label in enumerate(labels):
+        folder = os.path.join(path, label)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                dataset.append((os.path.join(folder, name), index))
+    return dataset
+
+
+def loadImages(dataset, size, channels=3):
+    """
+    :param dataset: List of (image file, label index).
+    :param size: Model input side.
+    :param channels: Model input channels.
+    :return: uint8 array of shape (len(dataset), size, size, channels).
+    """
+    pixels = numpy.empty((len(dataset), size, size, channels), dtype=numpy.uint8)
+    for i, (path, _) in enumerate(dataset):
+        with Image.open(path) as im:
+            im = im.convert("L" if channels == 1 else "RGB").resize((size, size), Image.BILINEAR)
+            pixels[i] = numpy.asarray(im).reshape(size, size, channels)
+    return pixels
+
+
+def convertInput(pixels, dtype):
+    """
+    Converts uint8 pixels to a model input type, like tf.classify on the camera.
+
+    :param pixels: uint8 array.
+    :param dtype: Model input type.
+    :return: Array of the input type.
+    """
+    if dtype == numpy.int8:
+        return (pixels.astype(numpy.int16) - 128).astype(numpy.int8)
+    if dtype != numpy.uint8:
+        return pixels.astype(numpy.float32) / 255
+    return pixels
+
+
+def buildVariants(source, dataset, sizes, int8=True, out="variants"):
+    """
+    Converts the classifier source into .tflite variants: for each input size a float variant and, with int8, a full
+    integer variant post-training quantized with the labelled images as the representative dataset. Smaller inputs
+    reuse the source weights, which works for convolutional models ending in global pooling; sizes the model cannot
+    be rebuilt at are skipped.
+
+    :param source: Keras model file or SavedModel directory, taking 0-1 float RGB input.
+    :param dataset: List of (image file, label index), representative images for quantization.
+    :param sizes: Input sides to build.
+    :param int8: Flags whether to build int8 quantized variants.
+    :param out: Directory the .tflite files are written to.
+    :return: List of variant file paths.
+    """
+    try:
+        import tensorflow as tf
+    except ImportError:
+        raise ImportError("building variants needs tensorflow (pip install tensorflow)")
+    model = tf.keras.models.load_model(source)
+    _, height, width, channels = model.input_shape
+    os.makedirs(out, exist_ok=True)
+    paths = []
+    for size in sizes:
+        if (size, size) == (height, width):
+            resized = model
+        else:
+            try:
+                resized = tf.keras.models.clone_model(model, input_tensors=tf.keras.Input((size, size, channels)))
+                resized.set_weights(model.get_weights())
+            except ValueError as e:
+                print("Skipping {0}x{0}: {1}".format(size, e))
+                continue
+        images = loadImages(dataset, size, channels).astype(numpy.float32) / 255
+
+        def representative():
+            for i in range(min(len(images), 200)):
+                yield [images[i:i + 1]]
+
+        for quantized in ((False, True) if int8 else (False,)):
+            converter = tf.lite.TFLiteConverter.from_keras_model(resized)
+            if quantized:
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.representative_dataset = representative
+                converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+                converter.inference_input_type = tf.int8
+                converter.inference_output_type = tf.int8
+            path = os.path.join(out, "classifier_{}_{}.tflite".format(size, "int8" if quantized else "float"))
+            with open(path, "wb") as f:
+                f.write(converter.convert())
+            paths.append(path)
+    return paths
+
+
+def percentile(values, pct):
+    """
+    :param values: Sorted list of values.
+    :param pct: Percentile (0-100).
+    :return: Value, None if empty.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))]
+
+
+def chooseThreshold(scores, truth, labels=LABELS, precision=0.95):
+    """
+    Lowest per-frame score threshold at which decisions on non-background labels reach a precision, i.e. the lowest
+    voter threshold that keeps wrong decisions rare.
+
+    :param scores: Per image score lists.
+    :param truth: Per image label indexes.
+    :param labels: Model labels.
+    :param precision: Fraction of decisions that must be correct.
+    :return: Threshold, 0.95 if no threshold reaches the precision.
+    """
+    voter = voting.StreakVoter(labels, threshold=1.0)
+    best = [voter.best(s) for s in scores]
+    decisions = sorted((score, index == t) for (index, score), t in zip(best, truth))
+    correct = sum(ok for _, ok in decisions)
+    for i, (score, ok) in enumerate(decisions):
+        if correct / (len(decisions) - i) >= precision:
+            return round(min(max(score, 0.5), 0.99), 2)
+        correct -= ok
+    return 0.95
+
+
+def benchmark(path, dataset, labels=LABELS, warmup=5):
+    """
+    Benchmarks a .tflite variant on the host CPU.
+
+    :param path: .tflite file.
+    :param dataset: List of (image file, label index).
+    :param labels: Model labels.
+    :param warmup: Invocations before timing starts.
+    :return: Dictionary - model, input side, input type, size in bytes, latency p50/p95/mean in ms, accuracy,
+    per label accuracy, chosen voter threshold.
+    """
+    interpreter = loadInterpreter(path)
+    interpreter.allocate_tensors()
+    inp = interpreter.get_input_details()[0]
+    out = interpreter.get_output_details()[0]
+    _, height, width, channels = inp["shape"]
+    pixels = convertInput(loadImages(dataset, height, channels), inp["dtype"])
+    for i in range(min(warmup, len(pixels))):
+        interpreter.set_tensor(inp["index"], pixels[i:i + 1])
+        interpreter.invoke()
+
+    latencies = []
+    scores = []
+    scale, zero = out["quantization"]
+    for i in range(len(pixels)):
+        interpreter.set_tensor(inp["index"], pixels[i:i + 1])
+        start = time.perf_counter()
+        interpreter.invoke()
+        latencies.append(1000 * (time.perf_counter() - start))
+        output = interpreter.get_tensor(out["index"])[0].astype(numpy.float32)
+        scores.append(((output - zero) * scale if scale else output).tolist())
+
+    truth = [label for _, label in dataset]
+    predicted = [max(range(len(s)), key=s.__getitem__) for s in scores]
+    perLabel = {}
+    for index, label in enumerate(labels):
+        hits = [p == t for p, t in zip(predicted, truth) if t == index]
+        if hits:
+            perLabel[label] = sum(hits) / len(hits)
+    latencies.sort()
+    return {
+        "model": path,
+        "input": int(width),
+        "dtype": numpy.dtype(inp["dtype"]).name,
+        "bytes": os.path.getsize(path),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+        "accuracy": sum(p == t for p, t in zip(predicted, truth)) / len(truth) if truth else None,
+        "per_label": perLabel,
+        "threshold": chooseThreshold(scores, truth, labels),
+    }
+
+
+def choose(results, maxDrop=0.02):
+    """
+    Picks the fastest variant whose accuracy is within maxDrop of the most accurate one.
+
+    :param results: Benchmark results.
+    :param maxDrop: Accuracy that may be traded for speed.
+    :return: Chosen benchmark result.
+    """
+    best = max(result["accuracy"] for result in results)
+    eligible = [result for result in results if result["accuracy"] >= best - maxDrop]
+    return min(eligible, key=lambda result: result["p50_ms"])
+
+
+def exportConfig(result, out):
+    """
+    Copies the chosen variant into a directory with the model_config.json main.py reads, both to be copied onto the
+    camera. The capture window is the smallest frame size's 240x240-of-QVGA equivalent still at least as large as the
+    model input, so the camera does not capture pixels the model scales away.
+
+    :param result: Benchmark result of the variant.
+    :param out: Directory to write to.
+    :return: Config dictionary.
+    """
+    framesize, window = FRAME_SIZES[0]
+    for name, side in FRAME_SIZES:
+        if side >= result["input"]:
+            framesize, window = name, side
+    model = os.path.basename(result["model"])
+    os.makedirs(out, exist_ok=True)
+    if os.path.abspath(os.path.join(out, model)) != os.path.abspath(result["model"]):
+        shutil.copyfile(result["model"], os.path.join(out, model))
+    config = {"model": model, "framesize": framesize, "window": [window, window], "threshold": result["threshold"]}
+    with open(os.path.join(out, "model_config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+def printResults(results):
+    """
+    :param results: Benchmark results.
+    """
+    print("{:<32} {:>5} {:>7} {:>9} {:>8} {:>8} {:>9} {:>9}".format(
+        "variant", "input", "type", "KB", "p50 ms", "p95 ms", "accuracy", "threshold"))
+    for r in results:
+        print("{:<32} {:>5} {:>7} {:>9.1f} {:>8.2f} {:>8.2f} {:>9.3f} {:>9}".format(
+            os.path.basename(r["model"]), r["input"], r["dtype"], r["bytes"] / 1024, r["p50_ms"], r["p95_ms"],
+            r["accuracy"], r["threshold"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, benchmark and export classifier variants.")
+    parser.add_argument("dataset", help="directory with one sub-directory of images per label")
+    parser.add_argument("--source", help="Keras model file or SavedModel directory to build variants from")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[240, 160, 96], help="input sides to build")
+    parser.add_argument("--int8", action="store_true", help="also build int8 quantized variants")
+    parser.add_argument("--models", nargs="*", default=[], help="existing .tflite files to benchmark too")
+    parser.add_argument("--out", default="variants", help="directory for built variants and the export")
+    parser.add_argument("--export", help="variant file name to export, or auto for the fastest accurate one")
+    parser.add_argument("--max-drop", type=float, default=0.02, help="accuracy auto export may trade for speed")
+    parser.add_argument("--json", help="file to write the benchmark results to")
+    args = parser.parse_args()
+
+    dataset = loadDataset(args.dataset)
+    if not dataset:
+        parser.error("no labelled images in {}".format(args.dataset))
+    models = list(args.models)
+    if args.source:
+        models += buildVariants(args.source, dataset, args.sizes, args.int8, args.out)
+    results = [benchmark(model, dataset) for model in models]
+    printResults(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.export and results:
+        if args.export == "auto":
+            chosen = choose(results, args.max_drop)
+        else:
+            chosen = next((r for r in results if os.path.basename(r["model"]) == args.export), None)
+            if chosen is None:
+                parser.error("no benchmarked variant named {}".format(args.export))
+        print("Exported", exportConfig(chosen, args.out))
@@ -0,0 +1,368 @@
+"""
+Shared state of the OpenMV stand-in modules (sensor, image, tf, pyb, machine): the camera clock, the recorded frame
+source, per-stage host timings and the fake SIM7000 modem on UART 3. A Replay is set up by host/replay.py before the
+camera script runs, the stand-ins look it up through emulator.replay on every call.
+"""
+
+import contextlib
+import os
+import time
+
+from PIL import Image
+
+FRAME_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".pgm", ".ppm")
+
+# Host clock functions, kept before time is patched
+_perf_counter = time.perf_counter
+_time = time.time
+
+# Replay the stand-ins are currently attached to
+replay = None
+
+
+class ReplayFinished(Exception):
+    """
+    Raised by sensor.snapshot() once the recorded frames run out, to end the camera script's main loop.
+    """
+    pass
+
+
+class CameraClock:
+    """
+    Camera time. Follows the host clock while the script computes, while sleeps, sensor settling delays and modem
+    latency advance it instantly, so a loop waiting seconds for the user replays in its compute time.
+    """
+
+    def __init__(self):
+        self.origin = _perf_counter()
+        self.epoch = _time()
+        self.offset = 0.0
+
+    def now(self):
+        """
+        :return: Seconds since the replay started.
+        """
+        return _perf_counter() - self.origin + self.offset
+
+    def advance(self, seconds):
+        """
+        Moves camera time, negative to hide host work (e.g. loading frames) from the script.
+
+        :param seconds: Seconds to add.
+        """
+        self.offset += seconds
+
+
+class CameraTimer:
+    """
+    Stand-in for the object returned by time.clock() on the camera.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.last = clock.now()
+
+    def tick(self):
+        self.last = self.clock.now()
+
+    def avg(self):
+        """
+        :return: Milliseconds since tick().
+        """
+        return (self.clock.now() - self.last) * 1000
+
+    def fps(self):
+        """
+        :return: Frames per second, as if one frame was processed since tick().
+        """
+        elapsed = self.clock.now() - self.last
+        return 1 / elapsed if elapsed > 0 else 0.0
+
+
+class Timings:
+    """
+    Host durations of the operations the stand-ins replace, in seconds, keyed by stage name.
+    """
+
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        """
+        Context manager recording the duration of its block.
+
+        :param stage: Stage name.
+        """
+        start = _perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, _perf_counter() - start)
+
+    def summary(self):
+        """
+        :return: Dictionary of stage to count, mean, p50, p95 and max in milliseconds.
+        """
+        summary = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            n = len(ordered)
+            summary[stage] = {"n": n, "mean": 1000 * sum(ordered) / n, "p50": 1000 * ordered[n // 2],
+                              "p95": 1000 * ordered[min(n - 1, (n * 95) // 100)], "max": 1000 * ordered[-1]}
+        return summary
+
+
+class FrameSource:
+    """
+    Recorded frames, either a directory of images (replayed in file name order) or a video file (needs OpenCV).
+
+    Without fps every snapshot gets the next frame, so each recorded frame is processed once. With fps the frames are
+    paced like a live sensor: a snapshot gets the frame current at camera time, frames recorded while the script was
+    busy are skipped and a script faster than the sensor waits for the next one.
+    """
+
+    def __init__(self, path, fps=None, loop=1, limit=None):
+        """
+        :param path: Frame directory or video file.
+        :param fps: Recording frame rate, None to process every frame.
+        :param loop: Number of times the recording is replayed.
+        :param limit: Maximum number of frames served, None for no limit.
+        """
+        self.path = path
+        self.fps = fps
+        self.loop = loop
+        self.limit = limit
+        self.frames = self.read()
+        self.index = -1
+        self.served = 0
+        self.skipped = 0
+
+    def read(self):
+        """
+        Generator of frames as RGB PIL images.
+        """
+        for _ in range(self.loop):
+            if os.path.isdir(self.path):
+                for name in sorted(os.listdir(self.path)):
+                    if name.lower().endswith(FRAME_EXTENSIONS):
+                        with Image.open(os.path.join(self.path, name)) as im:
+                            yield im.convert("RGB")
+            else:
+                try:
+                    import cv2
+                except ImportError:
+                    raise ImportError("replaying a video file needs OpenCV (pip install opencv-python), "
+                                      "or extract its frames into a directory")
+                capture = cv2.VideoCapture(self.path)
+                ok, frame = capture.read()
+                while ok:
+                    yield Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                    ok, frame = capture.read()
+                capture.release()
+
+    def next(self, clock):
+        """
+        Gets the frame for a snapshot. Loading is hidden from the camera clock.
+
+        :param clock: CameraClock.
+        :return: RGB PIL image.
+        """
+        if self.limit is not None and self.served >= self.limit:
+            raise ReplayFinished
+        index = self.index + 1
+        if self.fps:
+            now = clock.now()
+            index = max(index, int(now * self.fps))
+            due = index / self.fps
+            if due > now:
+                clock.advance(due - now)
+        start = _perf_counter()
+        try:
+            for _ in range(index - self.index - 1):
+                next(self.frames)
+            frame = next(self.frames)
+        except StopIteration:
+            raise ReplayFinished
+        finally:
+            clock.advance(-(_perf_counter() - start))
+        self.skipped += index - self.index - 1
+        self.index = index
+        self.served += 1
+        return frame
+
+
+class Modem:
+    """
+    Fake SIM7000 on UART 3. Every write is answered OK, after the time the write takes at the UART baud rate plus a
+    fixed command latency, with plausible response lines for the queries the camera scripts parse, including the MQTT
+    session state (+SMSTATE?) following +SMCONN and +SMDISC and the NTP synced modem clock (+CCLK?) following the
+    camera clock. The message written after each +SMPUB is kept as a publish, and optionally saved under
+    out/<device>/<sequence> like the AWS IoT rule stores it in the bucket, so replayed uploads can be pulled by pullS3
+    from a local copy.
+    """
+
+    RESPONSES = {
+        "+GSN": "860000000000001",
+        "+CGCONTRDP": "+CGCONTRDP: 1,5,\"replay\",\"10.0.0.2\"",
+        "+CNACT?": "+CNACT: 1,\"10.0.0.2\"",
+        "+CSQ": "+CSQ: 20,99",
+        "+CPSI?": "+CPSI: LTE CAT-M1,Online,234-10,0x1A2B,12345678,123,EUTRAN-BAND20,6300,3,3,-11,-98,-70,6",
+        "+CNTP": "+CNTP: 1",
+        "+CSTT?": "+CSTT: \"replay\",\"\",\"\"",
+    }
+
+    def __init__(self, clock, latency=0.1, baud=9600, out=None):
+        """
+        :param clock: CameraClock.
+        :param latency: Seconds between a command being written and its response.
+        :param baud: UART baud rate, 10 bits per byte.
+        :param out: Directory to save publishes to, None to only keep them in memory.
+        """
+        self.clock = clock
+        self.latency = latency
+        self.baud = baud
+        self.out = out
+        self.pending = b""
+        self.ready = 0.0
+        self.publishing = None
+        self.commands = 0
+        self.published = []
+        self.connected = False
+
+    def write(self, data):
+        data = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+        now = self.clock.now()
+        self.ready = max(now, self.ready) + len(data) * 10 / self.baud + self.latency
+        if self.publishing:
+            self.publish(self.publishing, data)
+            self.publishing = None
+            self.pending += b"\r\nOK\r\n"
+            return len(data)
+
+        command = data.decode("utf-8", "replace").strip()
+        if command.startswith("AT"):
+            command = command[2:]
+        self.commands += 1
+        name = command
+        for i in range(len(command)):
+            if command[i] in '="':
+                name = command[:i]
+                break
+        if name == "+SMPUB":
+            self.publishing = command.split("\"")[1]
+        elif name in ("+SMCONN", "+SMDISC"):
+            self.connected = name == "+SMCONN"
+        if name == "+SMSTATE?":
+            line = "+SMSTATE: %d" % self.connected
+        elif name == "+CCLK?":
+            line = time.strftime('+CCLK: "%y/%m/%d,%H:%M:%S+00"', time.gmtime(self.clock.epoch + self.clock.now()))
+        else:
+            line = self.RESPONSES.get(name)
+        self.pending += ("\r\n" + line + "\r\n" if line else "").encode() + b"\r\nOK\r\n"
+        return len(data)
+
+    def publish(self, topic, message):
+        """
+        Keeps a published message.
+
+        :param topic: MQTT topic.
+        :param message: Message bytes.
+        """
+        self.published.append((self.clock.now(), topic, message))
+        if message.startswith(b"{Image Start"):
+            replay.event("upload", message.decode("utf-8", "replace"))
+        elif message[:1] == b"\xa5":
+            # Binary metadata record of the camera scripts, imported here as it imports the image stand-in
+            import metarecord
+            record = metarecord.decode(message)
+            replay.event("upload", "{Image Start,%s,%s,%s}" % (record["type"], record["payload"], record["label"]))
+        if self.out:
+            folder = os.path.join(self.out, topic.rsplit("/", 1)[-1])
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, "{:010d}".format(len(self.published) - 1)), "wb") as f:
+                f.write(message)
+
+    def any(self):
+        return len(self.pending) if self.pending and self.clock.now() >= self.ready else 0
+
+    def read(self, nbytes=None):
+        if not self.any():
+            return None
+        nbytes = len(self.pending) if nbytes is None else nbytes
+        data, self.pending = self.pending[:nbytes], self.pending[nbytes:]
+        return data
+
+
+class Replay:
+    """
+    One replay run.
+
+    clock: CameraClock - camera time.
+    frames: FrameSource - recorded frames.
+    modem: Modem - fake modem on UART 3.
+    timings: Timings - host durations of snapshots, barcode decoding, classification and compression.
+    events: List - (camera time, kind, detail) of barcode reads, classifications, uploads and sleeps.
+    threads: Integer - inference threads, 1 like the camera.
+    interrupts: List - external interrupt lines (pyb.ExtInt) set up by the script.
+    """
+
+    def __init__(self, frames, fps=None, loop=1, limit=None, latency=0.1, out=None, threads=1):
+        self.clock = CameraClock()
+        self.frames = FrameSource(frames, fps=fps, loop=loop, limit=limit)
+        self.modem = Modem(self.clock, latency=latency, out=out)
+        self.timings = Timings()
+        self.events = []
+        self.threads = threads
+        self.interrupts = []
+
+    def event(self, kind, detail=None):
+        self.events.append((self.clock.now(), kind, detail))
+
+
+def ticks_diff(new, old):
+    return new - old
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+@contextlib.contextmanager
+def attached(run):
+    """
+    Attaches the stand-ins to a replay for the duration of the block, and patches the time module with the MicroPython
+    functions (ticks_ms, sleep_ms, clock, ...) running on camera time.
+
+    :param run: Replay.
+    """
+    global replay
+    clock = run.clock
+    patches = {
+        "ticks_ms": lambda: int(clock.now() * 1000),
+        "ticks_us": lambda: int(clock.now() * 1000000),
+        "ticks_cpu": lambda: int(clock.now() * 1000000),
+        "ticks_diff": ticks_diff,
+        "ticks_add": ticks_add,
+        "sleep": lambda seconds: clock.advance(seconds),
+        "sleep_ms": lambda ms: clock.advance(ms / 1000),
+        "sleep_us": lambda us: clock.advance(us / 1000000),
+        "time": lambda: clock.epoch + clock.now(),
+        "clock": lambda: CameraTimer(clock),
+    }
+    saved = {name: getattr(time, name) for name in patches if hasattr(time, name)}
+    replay = run
+    for name, patch in patches.items():
+        setattr(time, name, patch)
+    try:
+        yield run
+    finally:
+        for name in patches:
+            if name in saved:
+                setattr(time, name, saved[name])
+            else:
+                delattr(time, name)
+        replay = None
@@ -0,0 +1,258 @@
+"""
+Stand-in for the OpenMV image module. Images wrap a PIL image, barcodes are decoded with pyzbar (ZBar, the library the
+camera's find_barcodes() is ported from), or with the OpenCV barcode detector when pyzbar is not installed.
+"""
+
+import io
+import math
+
+from PIL import ImageDraw
+
+import emulator
+
+# Barcode types, in the order of barcode_types.BARCODE_TYPES
+EAN2 = 0
+EAN5 = 1
+EAN8 = 2
+UPCE = 3
+ISBN10 = 4
+UPCA = 5
+EAN13 = 6
+ISBN13 = 7
+I25 = 8
+DATABAR = 9
+DATABAR_EXP = 10
+CODABAR = 11
+CODE39 = 12
+PDF417 = 13
+CODE93 = 14
+CODE128 = 15
+
+BARCODE_TYPES = {"EAN2": EAN2, "EAN5": EAN5, "EAN8": EAN8, "UPCE": UPCE, "ISBN10": ISBN10, "UPCA": UPCA,
+                 "EAN13": EAN13, "ISBN13": ISBN13, "I25": I25, "DATABAR": DATABAR, "DATABAR_EXP": DATABAR_EXP,
+                 "CODABAR": CODABAR, "CODE39": CODE39, "PDF417": PDF417, "CODE93": CODE93, "CODE128": CODE128}
+
+# OpenCV barcode type names, the detector only reads EAN/UPC
+OPENCV_TYPES = {"EAN_8": EAN8, "EAN_13": EAN13, "UPC_A": UPCA, "UPC_E": UPCE}
+
+# pyzbar orientation to rotation in radians
+ORIENTATIONS = {"UP": 0.0, "RIGHT": math.pi / 2, "DOWN": math.pi, "LEFT": 3 * math.pi / 2}
+
+_decoder = None
+
+
+class Barcode:
+    """
+    Stand-in for the barcode objects returned by find_barcodes().
+    """
+
+    def __init__(self, rect, payload, type, rotation=0.0, quality=1):
+        self._rect = rect
+        self._payload = payload
+        self._type = type
+        self._rotation = rotation
+        self._quality = quality
+
+    def rect(self):
+        return self._rect
+
+    def x(self):
+        return self._rect[0]
+
+    def y(self):
+        return self._rect[1]
+
+    def w(self):
+        return self._rect[2]
+
+    def h(self):
+        return self._rect[3]
+
+    def payload(self):
+        return self._payload
+
+    def type(self):
+        return self._type
+
+    def rotation(self):
+        return self._rotation
+
+    def quality(self):
+        return self._quality
+
+
+def pyzbarDecoder():
+    """
+    :return: Function decoding the barcodes of a PIL image with pyzbar, None if pyzbar is not installed.
+    """
+    try:
+        from pyzbar import pyzbar
+    except ImportError:
+        return None
+    symbols = [symbol for symbol in pyzbar.ZBarSymbol if symbol.name in BARCODE_TYPES]
+
+    def decode(im):
+        codes = []
+        for found in pyzbar.decode(im, symbols=symbols):
+            rotation = ORIENTATIONS.get(getattr(found, "orientation", None), 0.0)
+            codes.append(Barcode(tuple(found.rect), found.data.decode("utf-8", "replace"), BARCODE_TYPES[found.type],
+                                 rotation, found.quality))
+        return codes
+
+    return decode
+
+
+def opencvDecoder():
+    """
+    :return: Function decoding the barcodes of a PIL image with the OpenCV barcode detector, None if OpenCV is not
+             installed or too old to have it.
+    """
+    try:
+        import cv2
+        import numpy
+        detector = cv2.barcode.BarcodeDetector()
+        detector.detectAndDecodeWithType
+    except (ImportError, AttributeError):
+        return None
+
+    def decode(im):
+        ok, payloads, types, corners = detector.detectAndDecodeWithType(numpy.asarray(im.convert("L")))
+        codes = []
+        if not ok:
+            return codes
+        for payload, name, points in zip(payloads, types, corners):
+            if not payload or name not in OPENCV_TYPES:
+                continue
+            xs, ys = [p[0] for p in points], [p[1] for p in points]
+            rect = (int(min(xs)), int(min(ys)), int(max(xs) - min(xs)), int(max(ys) - min(ys)))
+            rotation = math.atan2(points[2][1] - points[1][1], points[2][0] - points[1][0]) % (2 * math.pi)
+            codes.append(Barcode(rect, payload, OPENCV_TYPES[name], rotation))
+        return codes
+
+    return decode
+
+
+def decoder():
+    """
+    :return: Barcode decoding function, chosen once.
+    """
+    global _decoder
+    if _decoder is None:
+        _decoder = pyzbarDecoder() or opencvDecoder()
+        if _decoder is None:
+            raise ImportError("find_barcodes() needs pyzbar (pip install pyzbar, plus the zbar library) "
+                              "or OpenCV >= 4.8 (pip install opencv-python)")
+    return _decoder
+
+
+class Image:
+    """
+    Stand-in for OpenMV image objects. Operations work in place and return the image, like on the camera.
+    """
+
+    def __init__(self, im):
+        """
+        :param im: PIL image, mode L (GRAYSCALE) or RGB (RGB565).
+        """
+        self.im = im
+        self.jpeg = None
+
+    def width(self):
+        return self.im.width
+
+    def height(self):
+        return self.im.height
+
+    def format(self):
+        return "JPEG" if self.jpeg else self.im.mode
+
+    def size(self):
+        return len(self.jpeg) if self.jpeg else len(self.im.tobytes())
+
+    def find_barcodes(self, roi=None):
+        """
+        Decodes the barcodes in the image.
+
+        :param roi: (x, y, w, h) region to search, whole image if None.
+        :return: List of Barcode, rectangles in image coordinates.
+        """
+        with emulator.replay.timings.timed("find_barcodes"):
+            im = self.im
+            if roi:
+                x, y, w, h = roi
+                im = im.crop((x, y, x + w, y + h))
+            codes = decoder()(im)
+            if roi:
+                for code in codes:
+                    rx, ry, rw, rh = code.rect()
+                    code._rect = (rx + roi[0], ry + roi[1], rw, rh)
+        for code in codes:
+            emulator.replay.event("barcode", code.payload())
+        return codes
+
+    def crop(self, roi=None, x_scale=1.0, y_scale=1.0, **kwargs):
+        """
+        Crops and scales the image.
+
+        :param roi: (x, y, w, h) region to keep, whole image if None.
+        :param x_scale: Horizontal scale.
+        :param y_scale: Vertical scale.
+        :return: self
+        """
+        x, y, w, h = roi or (0, 0, self.im.width, self.im.height)
+        im = self.im.crop((x, y, x + w, y + h))
+        size = (max(1, int(w * x_scale)), max(1, int(h * y_scale)))
+        self.im = im.resize(size) if size != im.size else im
+        self.jpeg = None
+        return self
+
+    def compress(self, quality=50):
+        """
+        JPEG compresses the image.
+
+        :param quality: JPEG quality.
+        :return: self
+        """
+        with emulator.replay.timings.timed("compress"):
+            buf = io.BytesIO()
+            self.im.save(buf, "JPEG", quality=quality)
+            self.jpeg = buf.getvalue()
+        return self
+
+    def bytearray(self):
+        """
+        :return: JPEG data once compressed, raw pixels otherwise.
+        """
+        return bytearray(self.jpeg if self.jpeg else self.im.tobytes())
+
+    def color(self, color):
+        if color is None:
+            color = (255, 255, 255)
+        if self.im.mode == "L" and isinstance(color, tuple):
+            return sum(color) // len(color)
+        if self.im.mode == "RGB" and isinstance(color, int):
+            return color, color, color
+        return color
+
+    def draw_rectangle(self, *args, color=None, thickness=1, fill=False):
+        """
+        :param args: (x, y, w, h) tuple or x, y, w, h.
+        """
+        x, y, w, h = args[0] if len(args) == 1 else args[:4]
+        ImageDraw.Draw(self.im).rectangle((x, y, x + w - 1, y + h - 1), outline=self.color(color), width=thickness,
+                                          fill=self.color(color) if fill else None)
+        self.jpeg = None
+        return self
+
+    def draw_string(self, x, y, text, color=None, scale=1.0, mono_space=True, **kwargs):
+        ImageDraw.Draw(self.im).text((x, y), text, fill=self.color(color))
+        self.jpeg = None
+        return self
+
+    def save(self, path, quality=50):
+        if self.jpeg:
+            with open(path, "wb") as f:
+                f.write(self.jpeg)
+        else:
+            self.im.save(path, quality=quality)
+        return self
@@ -0,0 +1,24 @@
+"""
+Stand-in for the OpenMV machine module. The recording keeps running while the camera sleeps, so sleep returns at once
+and idle fires the external interrupts at once, as if the motion sensor woke the camera on the next frame.
+"""
+
+import emulator
+
+
+def sleep():
+    emulator.replay.event("sleep")
+
+
+def deepsleep():
+    emulator.replay.event("sleep")
+
+
+def idle():
+    emulator.replay.event("sleep")
+    for line in emulator.replay.interrupts:
+        line.callback(line.pin)
+
+
+def reset():
+    raise emulator.ReplayFinished
@@ -0,0 +1,87 @@
+"""
+Stand-in for the OpenMV pyb module. UART 3 is wired to the replay's fake modem, external interrupts fire when the script
+idles (see machine.idle), LEDs and pins do nothing.
+"""
+
+import emulator
+
+
+class LED:
+    def __init__(self, id):
+        self.id = id
+        self.lit = False
+
+    def on(self):
+        self.lit = True
+
+    def off(self):
+        self.lit = False
+
+    def toggle(self):
+        self.lit = not self.lit
+
+
+class UART:
+    def __init__(self, bus, baudrate=9600, **kwargs):
+        self.bus = bus
+        self.modem = emulator.replay.modem if bus == 3 else None
+        if self.modem:
+            self.modem.baud = baudrate
+
+    def any(self):
+        return self.modem.any() if self.modem else 0
+
+    def read(self, nbytes=None):
+        return self.modem.read(nbytes) if self.modem else None
+
+    def write(self, data):
+        return self.modem.write(data) if self.modem else len(data)
+
+
+class Pin:
+    IN = 0
+    OUT_PP = 1
+    OUT_OD = 2
+    PULL_NONE = 0
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode=IN, pull=PULL_NONE):
+        self.id = id
+        self.level = 1 if pull == Pin.PULL_UP else 0
+
+    def value(self, level=None):
+        if level is None:
+            return self.level
+        self.level = level
+
+    def high(self):
+        self.level = 1
+
+    def low(self):
+        self.level = 0
+
+
+class ExtInt:
+    IRQ_RISING = 0
+    IRQ_FALLING = 1
+    IRQ_RISING_FALLING = 2
+
+    def __init__(self, pin, mode, pull, callback):
+        self.pin = pin
+        self.callback = callback
+        emulator.replay.interrupts.append(self)
+
+    def enable(self):
+        pass
+
+    def disable(self):
+        pass
+
+
+def delay(ms):
+    emulator.replay.clock.advance(ms / 1000)
+
+
+def millis():
+    return int(emulator.replay.clock.now() * 1000)
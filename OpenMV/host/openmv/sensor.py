@@ -0,0 +1,129 @@
+"""
+Stand-in for the OpenMV sensor module. Snapshots are recorded frames, scaled to the frame size and cropped to the
+window the script configured, like the sensor driver does.
+"""
+
+import emulator
+import image
+
+# Pixel formats
+GRAYSCALE = 1
+RGB565 = 2
+
+# Frame sizes
+QQVGA = 4
+QVGA = 5
+VGA = 6
+FRAME_SIZES = {QQVGA: (160, 120), QVGA: (320, 240), VGA: (640, 480)}
+
+# Sensor ids
+OV2640 = 0x26
+OV5640 = 0x56
+OV7690 = 0x76
+OV7725 = 0x77
+MT9V034 = 0x13
+
+_state = {}
+_registers = {}
+
+
+def reset():
+    """
+    Resets the sensor configuration.
+    """
+    _state.clear()
+    _state.update(pixformat=RGB565, framesize=QVGA, windowing=None, sleeping=False, shutdown=False)
+
+
+def set_pixformat(pixformat):
+    _state["pixformat"] = pixformat
+
+
+def set_framesize(framesize):
+    _state["framesize"] = framesize
+    _state["windowing"] = None
+
+
+def set_windowing(roi):
+    """
+    :param roi: (w, h) window centred in the frame, or (x, y, w, h).
+    """
+    if len(roi) == 2:
+        fw, fh = FRAME_SIZES[_state["framesize"]]
+        roi = ((fw - roi[0]) // 2, (fh - roi[1]) // 2, roi[0], roi[1])
+    _state["windowing"] = tuple(roi)
+
+
+def skip_frames(n=None, time=None):
+    """
+    Lets the sensor settle, for a number of frames or milliseconds of camera time.
+
+    :param n: Frames to skip.
+    :param time: Milliseconds to wait, 300 if neither is given.
+    """
+    if n is not None:
+        for _ in range(n):
+            emulator.replay.frames.next(emulator.replay.clock)
+    else:
+        emulator.replay.clock.advance((300 if time is None else time) / 1000)
+
+
+def set_auto_gain(enable, gain_db=None, gain_db_ceiling=None):
+    pass
+
+
+def set_auto_whitebal(enable, rgb_gain_db=None):
+    pass
+
+
+def set_auto_exposure(enable, exposure_us=None):
+    pass
+
+
+def width():
+    return (_state["windowing"] or (0, 0) + FRAME_SIZES[_state["framesize"]])[2]
+
+
+def height():
+    return (_state["windowing"] or (0, 0) + FRAME_SIZES[_state["framesize"]])[3]
+
+
+def snapshot():
+    """
+    Takes the next recorded frame.
+
+    :return: image.Image in the configured pixel format and window.
+    :raise emulator.ReplayFinished: Once the recording has been replayed.
+    """
+    if not _state:
+        reset()
+    frame = emulator.replay.frames.next(emulator.replay.clock)
+    with emulator.replay.timings.timed("snapshot"):
+        size = FRAME_SIZES[_state["framesize"]]
+        if frame.size != size:
+            frame = frame.resize(size)
+        if _state["windowing"]:
+            x, y, w, h = _state["windowing"]
+            frame = frame.crop((x, y, x + w, y + h))
+        frame = frame.convert("L" if _state["pixformat"] == GRAYSCALE else "RGB")
+    return image.Image(frame)
+
+
+def sleep(enable):
+    _state["sleeping"] = enable
+
+
+def shutdown(enable):
+    _state["shutdown"] = enable
+
+
+def get_id():
+    return OV7725
+
+
+def __write_reg(address, value):
+    _registers[address] = value
+
+
+def __read_reg(address):
+    return _registers.get(address, 0)
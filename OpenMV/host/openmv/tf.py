@@ -0,0 +1,147 @@
+"""
+Stand-in for the OpenMV tf module. Models run on the host CPU with tflite-runtime, or the TensorFlow Lite interpreter
+when only tensorflow is installed, on one thread like the camera. classify() slides the same windows as on the camera
+and feeds them with the camera's input conversion: 0-255 for uint8 models, -128-127 for int8 and 0-1 for float.
+"""
+
+import os
+import sys
+
+import numpy
+
+import emulator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import classifier
+
+_models = {}
+
+
+class tf_classification:
+    """
+    Stand-in for the classification results returned by classify().
+    """
+
+    def __init__(self, rect, output):
+        self._rect = rect
+        self._output = output
+
+    def rect(self):
+        return self._rect
+
+    def x(self):
+        return self._rect[0]
+
+    def y(self):
+        return self._rect[1]
+
+    def w(self):
+        return self._rect[2]
+
+    def h(self):
+        return self._rect[3]
+
+    def output(self):
+        return self._output
+
+    def classification_output(self):
+        return self._output
+
+
+class tf_model:
+    """
+    Loaded model, stand-in for the object returned by load().
+    """
+
+    def __init__(self, path):
+        """
+        :param path: .tflite file.
+        """
+        self.interpreter = classifier.loadInterpreter(path, emulator.replay.threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        _, self.height, self.width, self.channels = self.input["shape"]
+
+    def len(self):
+        return self.output["shape"][-1]
+
+    def invoke(self, im):
+        """
+        Classifies one window.
+
+        :param im: PIL image of the window.
+        :return: List of per-label scores.
+        """
+        im = im.convert("L" if self.channels == 1 else "RGB").resize((self.width, self.height))
+        pixels = numpy.asarray(im, dtype=numpy.uint8).reshape(self.input["shape"])
+        dtype = self.input["dtype"]
+        if dtype == numpy.int8:
+            pixels = (pixels.astype(numpy.int16) - 128).astype(numpy.int8)
+        elif dtype != numpy.uint8:
+            pixels = pixels.astype(dtype) / 255
+        self.interpreter.set_tensor(self.input["index"], pixels)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output["index"])[0].astype(numpy.float32)
+        scale, zero = self.output["quantization"]
+        if scale:
+            output = (output - zero) * scale
+        return output.tolist()
+
+
+def load(path, load_to_fb=False):
+    """
+    :param path: .tflite file.
+    :return: tf_model, loaded once per path.
+    """
+    if path not in _models:
+        _models[path] = tf_model(path)
+    return _models[path]
+
+
+def windows(start, length, size, overlap):
+    """
+    Window offsets along one axis.
+
+    :param start: Region offset.
+    :param length: Region length.
+    :param size: Window length.
+    :param overlap: Fraction of a window shared with the next one, -1 for a single centred window.
+    :return: List of offsets.
+    """
+    if overlap < 0 or size >= length:
+        return [start + (length - size) // 2]
+    step = max(1, int(size * (1 - overlap)))
+    return list(range(start, start + length - size + 1, step))
+
+
+def classify(model, img, roi=None, min_scale=1.0, scale_mul=0.5, x_overlap=0, y_overlap=0):
+    """
+    Classifies windows of an image, at scales from 1.0 down to min_scale.
+
+    :param model: .tflite file or tf_model.
+    :param img: image.Image.
+    :param roi: (x, y, w, h) region to classify, whole image if None.
+    :param min_scale: Smallest window, relative to the region.
+    :param scale_mul: Scale factor between window sizes.
+    :param x_overlap: Horizontal window overlap, -1 for one centred window.
+    :param y_overlap: Vertical window overlap, -1 for one centred window.
+    :return: List of tf_classification.
+    """
+    if not isinstance(model, tf_model):
+        model = load(model)
+    rx, ry, rw, rh = roi or (0, 0, img.width(), img.height())
+    results = []
+    with emulator.replay.timings.timed("classify"):
+        scale = 1.0
+        while scale >= min_scale:
+            w, h = max(1, int(rw * scale)), max(1, int(rh * scale))
+            for y in windows(ry, rh, h, y_overlap):
+                for x in windows(rx, rw, w, x_overlap):
+                    output = model.invoke(img.im.crop((x, y, x + w, y + h)))
+                    results.append(tf_classification((x, y, w, h), output))
+            if scale_mul <= 0 or scale_mul >= 1:
+                break
+            scale *= scale_mul
+    emulator.replay.event("classify", len(results))
+    return results
@@ -0,0 +1,188 @@
+"""
+Runs the OpenMV camera scripts (main.py, model_standalone.py, barcodes_standalone.py) unmodified on the host against
+recorded frames, with the stand-in sensor, image, tf, pyb and machine modules in host/openmv. Barcodes are decoded with
+pyzbar (or OpenCV), the classifier runs with tflite-runtime on the same trained.tflite, and the modem is a fake that
+answers every AT command after a fixed latency plus the UART transfer time.
+
+The script sees camera time: sleeps, sensor settling and modem round trips advance it instantly, computation takes
+host time. After the recording has been replayed a report is printed with the host time of each stand-in operation,
+the script's own profiler stages, barcode scan rate and, per parcel, the time from barcode read to image upload and
+the number of classified frames it took to decide.
+
+Usage: python replay.py frames/ [--script ../main.py] [--root drive/] [--fps 30] [--modem-ms 100] [--quiet]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "openmv"))
+import emulator
+
+
+def runScript(path, replay, quiet=False):
+    """
+    Runs a camera script as __main__ until the recorded frames run out.
+
+    :param path: Script file.
+    :param replay: emulator.Replay the stand-ins are attached to.
+    :param quiet: Flags whether to discard the script's output.
+    :return: Script globals.
+    """
+    with open(path) as f:
+        code = compile(f.read(), path, "exec")
+    scope = {"__name__": "__main__", "__file__": path}
+    with emulator.attached(replay), contextlib.ExitStack() as stack:
+        if quiet:
+            stack.enter_context(contextlib.redirect_stdout(open(os.devnull, "w")))
+        try:
+            exec(code, scope)
+        except emulator.ReplayFinished:
+            pass
+    return scope
+
+
+def parcels(events):
+    """
+    Splits the event log into parcels: a barcode read, the frames classified after it, and the upload if a decision
+    was made. A parcel without upload ended in the classifier timeout (or the end of the recording).
+
+    :param events: Replay event list.
+    :return: List of parcel dictionaries.
+    """
+    found = []
+    parcel = None
+    for t, kind, detail in events:
+        if kind == "barcode" and (parcel is None or parcel["uploaded"] is not None or parcel["frames"]):
+            parcel = {"read": t, "payload": detail, "frames": 0, "first": None, "last": None, "uploaded": None,
+                      "label": None}
+            found.append(parcel)
+        elif kind == "classify" and parcel and parcel["uploaded"] is None:
+            parcel["frames"] += 1
+            parcel["first"] = t if parcel["first"] is None else parcel["first"]
+            parcel["last"] = t
+        elif kind == "upload" and parcel and parcel["uploaded"] is None:
+            parcel["uploaded"] = t
+            fields = detail.strip("{}").split(",")
+            parcel["label"] = fields[3] if len(fields) > 3 else None
+    return found
+
+
+def report(replay, scope):
+    """
+    Gathers the replay results.
+
+    :param replay: Finished emulator.Replay.
+    :param scope: Script globals.
+    :return: Report dictionary.
+    """
+    found = parcels(replay.events)
+    decided = [p for p in found if p["uploaded"] is not None]
+    timings = replay.timings.summary()
+    scans = timings.get("find_barcodes")
+    result = {
+        "frames": replay.frames.served,
+        "skipped": replay.frames.skipped,
+        "camera_s": replay.clock.now(),
+        "stand_ins": timings,
+        "scan_fps": 1000 / (scans["mean"] + timings.get("snapshot", {"mean": 0})["mean"]) if scans else None,
+        "parcels": len(found),
+        "decided": len(decided),
+        "labels": [p["label"] for p in decided],
+        "read_to_upload_s": [p["uploaded"] - p["read"] for p in decided],
+        "frames_to_decide": [p["frames"] for p in decided],
+        "classify_to_decide_s": [p["last"] - p["first"] for p in decided if p["first"] is not None],
+        "sleeps": sum(kind == "sleep" for _, kind, _ in replay.events),
+        "modem_commands": replay.modem.commands,
+        "publishes": len(replay.modem.published),
+        "published_bytes": sum(len(message) for _, _, message in replay.modem.published),
+        "profiler": {},
+    }
+    profiler = scope.get("profiler")
+    if profiler is not None and hasattr(profiler, "summary"):
+        for stage in profiler.stages:
+            summary = profiler.summary(stage)
+            if summary:
+                result["profiler"][stage] = [us / 1000 for us in summary]
+    duty = scope.get("duty")
+    if duty is not None and hasattr(duty, "energy"):
+        result["power"] = {"timeout_s": duty.timeout(), "gap_s": duty.gap, "mj_per_parcel": duty.energy(),
+                           "naps": duty.naps, "sleeps": duty.sleeps}
+    batcher = scope.get("batcher")
+    if batcher is not None and hasattr(batcher, "pack"):
+        result["batch"] = {"batches": batcher.batches, "messages": batcher.packed, "raw_bytes": batcher.raw,
+                           "sent_bytes": batcher.sent, "queued": len(batcher.messages)}
+    return result
+
+
+def mean(values):
+    return sum(values) / len(values) if values else 0.0
+
+
+def printReport(result):
+    """
+    :param result: Report dictionary.
+    """
+    print("Replayed {} frames ({} skipped) in {:.1f} s of camera time".format(
+        result["frames"], result["skipped"], result["camera_s"]))
+    print("\n{:<16} {:>6} {:>9} {:>9} {:>9} {:>9}".format("host (ms)", "n", "mean", "p50", "p95", "max"))
+    for stage, s in result["stand_ins"].items():
+        print("{:<16} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(stage, s["n"], s["mean"], s["p50"], s["p95"],
+                                                                        s["max"]))
+    if result["profiler"]:
+        print("\n{:<16} {:>9} {:>9} {:>9} {:>9}".format("profiler (ms)", "min", "p50", "p95", "max"))
+        for stage, s in result["profiler"].items():
+            print("{:<16} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(stage, *s))
+    print()
+    if result["scan_fps"]:
+        print("Barcode scan: {:.1f} fps".format(result["scan_fps"]))
+    if result["parcels"]:
+        print("Parcels: {} read, {} decided {}".format(result["parcels"], result["decided"], result["labels"]))
+    if result["decided"]:
+        print("Barcode read to upload: mean {:.2f} s, classifier decision: mean {:.2f} s over {:.1f} frames".format(
+            mean(result["read_to_upload_s"]), mean(result["classify_to_decide_s"]),
+            mean(result["frames_to_decide"])))
+    print("Modem: {} commands, {} publishes, {} bytes, {} sleeps".format(
+        result["modem_commands"], result["publishes"], result["published_bytes"], result["sleeps"]))
+    if result.get("power"):
+        p = result["power"]
+        print("Power: idle timeout {:.0f} s, {} naps, {} deep sleeps, {} mJ per parcel (estimated)".format(
+            p["timeout_s"], p["naps"], p["sleeps"], "-" if p["mj_per_parcel"] is None else
+            "{:.0f}".format(p["mj_per_parcel"])))
+    if result.get("batch"):
+        b = result["batch"]
+        print("Batching: {} messages in {} publishes, {} bytes sent for {} ({} still queued)".format(
+            b["messages"], b["batches"], b["sent_bytes"], b["raw_bytes"], b["queued"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded frames through an OpenMV camera script.")
+    parser.add_argument("frames", help="directory of frames (replayed in file name order) or video file")
+    parser.add_argument("--script", default=os.path.join(HERE, "..", "main.py"))
+    parser.add_argument("--root", default=".", help="camera drive contents: trained.tflite, device.json")
+    parser.add_argument("--fps", type=float, help="recording frame rate, frames are paced on camera time if given")
+    parser.add_argument("--loop", type=int, default=1, help="times the recording is replayed")
+    parser.add_argument("--max-frames", type=int)
+    parser.add_argument("--modem-ms", type=float, default=100, help="fake modem response latency")
+    parser.add_argument("--threads", type=int, default=1, help="inference threads")
+    parser.add_argument("--out", help="directory to save published messages to, as <device>/<sequence> objects")
+    parser.add_argument("--json", help="file to write the report to")
+    parser.add_argument("--quiet", action="store_true", help="discard the script's output")
+    args = parser.parse_args()
+
+    script = os.path.abspath(args.script)
+    frames = os.path.abspath(args.frames)
+    out = os.path.abspath(args.out) if args.out else None
+    json_path = os.path.abspath(args.json) if args.json else None
+    os.chdir(args.root)
+    replay = emulator.Replay(frames, fps=args.fps, loop=args.loop, limit=args.max_frames,
+                             latency=args.modem_ms / 1000, out=out, threads=args.threads)
+    result = report(replay, runScript(script, replay, quiet=args.quiet))
+    printReport(result)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(result, f, indent=2)
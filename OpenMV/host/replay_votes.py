@@ -0,0 +1,132 @@
+"""
+Replays per-frame classifier score traces recorded by modelDetect (trace=...) through different temporal voters, and
+reports the time-to-decision distribution of each, so voter settings can be compared without the camera.
+
+Each trace line is a JSON object: {"t": [frame times in ms], "s": [per-frame scores], "decided": device label}. An
+optional "truth" key holds the correct label, when present the accuracy of each voter is reported as well.
+
+Usage: python replay_votes.py traces.jsonl [--frame-ms 100]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import voting
+from classifier import LABELS
+
+# Voter configurations to compare, the first one matches the original single frame decision at 0.95
+VOTERS = [
+    ("single>0.95", lambda labels: voting.StreakVoter(labels, threshold=0.95, agree=1)),
+    ("streak2>0.8", lambda labels: voting.StreakVoter(labels, threshold=0.8, agree=2)),
+    ("ema0.5>0.8", lambda labels: voting.EMAVoter(labels, threshold=0.8, alpha=0.5)),
+    ("ema0.3>0.75", lambda labels: voting.EMAVoter(labels, threshold=0.75, alpha=0.3)),
+    ("3of5>0.7", lambda labels: voting.KofNVoter(labels, threshold=0.7, k=3, n=5)),
+    ("2of3>0.6", lambda labels: voting.KofNVoter(labels, threshold=0.6, k=2, n=3)),
+]
+
+
+def loadTraces(path):
+    """
+    Loads score traces from a JSON lines file.
+
+    :param path: Trace file path.
+    :return: List of trace dictionaries.
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile.
+
+    :param values: Sorted list of values.
+    :param pct: Percentile (0-100).
+    :return: Value, None if empty.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))]
+
+
+def replay(trace, voter, frame_ms):
+    """
+    Feeds a trace through a voter.
+
+    :param trace: Trace dictionary.
+    :param voter: Voter instance.
+    :param frame_ms: Frame duration used when the trace has no frame times.
+    :return: Decided label (None if undecided), Frames used, Milliseconds to decision
+    """
+    voter.reset()
+    times = trace.get("t")
+    for i, scores in enumerate(trace["s"]):
+        label = voter.vote(scores)
+        if label:
+            ms = times[i] - times[0] + frame_ms if times else (i + 1) * frame_ms
+            return label, i + 1, ms
+    return None, len(trace["s"]), None
+
+
+def benchmark(traces, labels, frame_ms):
+    """
+    Replays all traces through every voter configuration.
+
+    :param traces: List of trace dictionaries.
+    :param labels: Model labels.
+    :param frame_ms: Frame duration used when a trace has no frame times.
+    :return: List of result dictionaries, one per voter.
+    """
+    results = []
+    for name, make in VOTERS:
+        voter = make(labels)
+        ms = []
+        frames = []
+        decided = correct = judged = 0
+        for trace in traces:
+            label, n, t = replay(trace, voter, frame_ms)
+            if label:
+                decided += 1
+                ms.append(t)
+                frames.append(n)
+            if trace.get("truth"):
+                judged += 1
+                correct += label == trace["truth"]
+        ms.sort()
+        frames.sort()
+        results.append({
+            "voter": name,
+            "decided": decided / len(traces) if traces else 0,
+            "accuracy": correct / judged if judged else None,
+            "frames_p50": percentile(frames, 50),
+            "ms_p50": percentile(ms, 50),
+            "ms_p90": percentile(ms, 90),
+            "ms_max": ms[-1] if ms else None,
+        })
+    return results
+
+
+def printResults(results):
+    """
+    Prints benchmark results as a table.
+
+    :param results: List of result dictionaries.
+    """
+    fmt = lambda v: "-" if v is None else ("%.2f" % v if isinstance(v, float) else str(v))
+    columns = ["voter", "decided", "accuracy", "frames_p50", "ms_p50", "ms_p90", "ms_max"]
+    print("".join("%-14s" % c for c in columns))
+    for result in results:
+        print("".join("%-14s" % fmt(result[c]) for c in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay classifier score traces through temporal voters.")
+    parser.add_argument("traces", help="JSON lines trace file recorded by modelDetect")
+    parser.add_argument("--frame-ms", type=float, default=100, help="frame duration for traces without times")
+    parser.add_argument("--labels", nargs="+", default=LABELS, help="model labels in output order")
+    args = parser.parse_args()
+
+    printResults(benchmark(loadTraces(args.traces), args.labels, args.frame_ms))
@@ -25,8 +25,9 @@
 
 # 3) Run the following script in OpenMV IDE:
 
-import pyb, tf, os, sensor, image, time, math, binascii
+import pyb, tf, os, sensor, time, math, binascii
 from pyb import UART
+from barcode_types import barcode_name
 
 sensor.reset()
 sensor.set_pixformat(sensor.RGB565) # Modify as you like.
@@ -222,41 +223,6 @@ def wireless(apn, ip):
     AT('+CIFSR', success=ip)
 
 
-def barcode_name(code):
-    if(code.type() == image.EAN2):
-        return "EAN2"
-    if(code.type() == image.EAN5):
-        return "EAN5"
-    if(code.type() == image.EAN8):
-        return "EAN8"
-    if(code.type() == image.UPCE):
-        return "UPCE"
-    if(code.type() == image.ISBN10):
-        return "ISBN10"
-    if(code.type() == image.UPCA):
-        return "UPCA"
-    if(code.type() == image.EAN13):
-        return "EAN13"
-    if(code.type() == image.ISBN13):
-        return "ISBN13"
-    if(code.type() == image.I25):
-        return "I25"
-    if(code.type() == image.DATABAR):
-        return "DATABAR"
-    if(code.type() == image.DATABAR_EXP):
-        return "DATABAR_EXP"
-    if(code.type() == image.CODABAR):
-        return "CODABAR"
-    if(code.type() == image.CODE39):
-        return "CODE39"
-    if(code.type() == image.PDF417):
-        return "PDF417"
-    if(code.type() == image.CODE93):
-        return "CODE93"
-    if(code.type() == image.CODE128):
-        return "CODE128"
-
-
 def takePicture():
     img = sensor.snapshot()
     return img
@@ -405,7 +371,8 @@ if __name__ == "__main__":
         codes = img.find_barcodes()
         for code in codes:
             img.draw_rectangle(code.rect())
-            print_args = (barcode_name(code), code.payload(), (180 * code.rotation()) / math.pi, code.quality(), clock.fps())
+            name = barcode_name(code)
+            print_args = (name, code.payload(), (180 * code.rotation()) / math.pi, code.quality(), clock.fps())
             print("Barcode %s, Payload \"%s\", rotation %f (degrees), quality %d, FPS %f" % print_args)
             #Add one time read only restriction
             time.sleep(5)
@@ -415,7 +382,7 @@ if __name__ == "__main__":
 
             msgs = imgToChunks(imgout, chunk_size=512)
             mqttconn()
-            mqttsendimg(msgs=msgs, headers=(barcode_name(code),code.payload(),outlabel))
+            mqttsendimg(msgs=msgs, headers=(name,code.payload(),outlabel))
             mqttdisc()
             setGRAYSCALE()
             break
@@ -1,4 +1,12 @@
-import pyb, machine, tf, os, sensor, image, time, math, binascii
+import pyb, machine, tf, os, sensor, time, math, binascii, json
+import voting
+import scanwindow
+import power
+import metarecord
+import clocksync
+import batch
+import recentcache
+from barcode_types import barcode_name
 from pyb import UART, Pin, ExtInt
 
 # sensor.reset()
@@ -8,9 +16,208 @@ from pyb import UART, Pin, ExtInt
 
 clock = time.clock()
 
+# Unified pipeline classifier window (VGA frame) matching the QVGA 240x240 view, barcodes are searched for in the strips
+# chosen by scanwindow.ScanWindow
+UNIFIED_MODEL_ROI = (80, 0, 480, 480)
+
 # Init UART 3, and with specific baudrate.
 uart = UART(3, 9600, timeout_char=1000)
 
+# Set by the motion sensor interrupt, ends a nap
+motion = False
+
+# Optional device identity file ({"id": "..."}), the modem IMEI is used otherwise. Uploads are published to
+# MQTT_TOPIC/<device id>, for the AWS IoT rule to store them under a <device id>/ key prefix
+DEVICE_CONFIG = "device.json"
+MQTT_TOPIC = "sdk/test/Python"
+
+# Optional classifier variant file, exported by host/model_variants.py for the chosen model variant: model file,
+# RGB capture frame size and window (same field of view as the default 240x240 of QVGA, at the model's resolution)
+# and voting threshold. Missing keys keep the defaults
+MODEL_CONFIG = "model_config.json"
+MODEL_DEFAULTS = {"model": "trained.tflite", "framesize": "QVGA", "window": [240, 240], "threshold": 0.8}
+
+
+class Profiler:
+    """
+    Records per-stage durations into fixed-size ring buffers, so memory use stays constant however long the camera
+    runs. Summaries are sent to AWS piggybacked on the next image upload.
+    """
+
+    def __init__(self, stages, size=32):
+        """
+        :param stages: Stage names, in reporting order.
+        :param size: Number of most recent samples kept per stage.
+        """
+        self.stages = stages
+        self.size = size
+        self.samples = {stage: [0] * size for stage in stages}
+        self.counts = {stage: 0 for stage in stages}
+
+    def start(self):
+        """
+        :return: Start timestamp to pass to stop().
+        """
+        return time.ticks_us()
+
+    def stop(self, stage, start):
+        """
+        Records the duration of a stage.
+
+        :param stage: Stage name.
+        :param start: Timestamp returned by start().
+        """
+        self.record(stage, time.ticks_diff(time.ticks_us(), start))
+
+    def record(self, stage, us):
+        """
+        Adds a duration sample to a stage's ring buffer.
+
+        :param stage: Stage name.
+        :param us: Duration in microseconds.
+        """
+        self.samples[stage][self.counts[stage] % self.size] = us
+        self.counts[stage] += 1
+
+    def summary(self, stage):
+        """
+        Summarizes the samples currently held for a stage.
+
+        :param stage: Stage name.
+        :return: min, p50, p95, max in microseconds, None if the stage has no samples.
+        """
+        n = min(self.counts[stage], self.size)
+        if not n:
+            return None
+        ordered = sorted(self.samples[stage][:n])
+        return ordered[0], ordered[n // 2], ordered[min(n - 1, (n * 95) // 100)], ordered[-1]
+
+    def total(self, stage):
+        """
+        Estimates the time spent in a stage since start up, from the mean of the samples held.
+
+        :param stage: Stage name.
+        :return: Total duration in microseconds.
+        """
+        n = min(self.counts[stage], self.size)
+        if not n:
+            return 0
+        return sum(self.samples[stage][:n]) * self.counts[stage] // n
+
+    def stats(self):
+        """
+        Compact stats record for transmission, in milliseconds. Contains no commas so it can be sent as a header field.
+        Format: S=stage:min/p50/p95/max;stage:min/p50/p95/max...
+
+        :return: Stats record string.
+        """
+        fields = []
+        for stage in self.stages:
+            summary = self.summary(stage)
+            if summary:
+                fields.append(stage + ":" + "/".join(str(us // 1000) for us in summary))
+        return "S=" + ";".join(fields)
+
+
+# Per parcel stage durations: wake from deep sleep or from a nap, modem bring-up, barcode scan frame, sensor mode
+# switch, classification, JPEG compression and each MQTT publish
+profiler = Profiler(("wake", "nap", "modem", "scan", "switch", "classify", "compress", "publish"))
+
+
+class ATStats:
+    """
+    Modem health metrics: per AT command latency histograms, timeout and +CME ERROR counts, and the latest signal
+    quality sample. Commands are keyed by name without arguments (e.g. +SMCONF), the data write and acknowledgement of
+    a publish are kept apart from the +SMPUB command itself as +SMPUB.data and +SMPUB.ack.
+    """
+
+    # Histogram bucket upper bounds in milliseconds, the last bucket holds anything slower
+    BUCKETS_MS = (50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.commands = {}
+        self.signal = {}
+
+    @staticmethod
+    def name(command):
+        """
+        Gets the name of an AT command, without arguments.
+
+        :param command: AT command (not including 'AT')
+        :return: Command name.
+        """
+        for i in range(len(command)):
+            if command[i] in '="':
+                return command[:i]
+        return command or "AT"
+
+    def record(self, name, ms, response):
+        """
+        Records a command round trip.
+
+        :param name: Command name.
+        :param ms: Round trip duration in milliseconds.
+        :param response: Response as returned by listen().
+        """
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = {"n": 0, "timeouts": 0, "errors": 0, "hist": [0] * (len(self.BUCKETS_MS) + 1)}
+            self.commands[name] = stats
+        stats["n"] += 1
+        if response == "TIMEOUT":
+            stats["timeouts"] += 1
+        elif "+CME ERROR" in response[1]:
+            stats["errors"] += 1
+        i = 0
+        while i < len(self.BUCKETS_MS) and ms >= self.BUCKETS_MS[i]:
+            i += 1
+        stats["hist"][i] += 1
+
+    def sample(self, csq, cpsi):
+        """
+        Stores a signal quality sample.
+
+        :param csq: +CSQ response line.
+        :param cpsi: +CPSI? response line.
+        """
+        signal = {"time": time.time()}
+        try:
+            signal["csq"] = int(csq.split("+CSQ:")[1].split(",")[0])
+        except (IndexError, ValueError):
+            pass
+        try:
+            # +CPSI: <mode>,<op mode>,<MCC-MNC>,<TAC>,<SCellID>,<PCellID>,<band>,<earfcn>,<dlbw>,<ulbw>,
+            #        <RSRQ>,<RSRP>,<RSSI>,<RSSNR>
+            fields = cpsi.split("+CPSI:")[1].strip().split(",")
+            for key, idx in (("rsrq", 10), ("rsrp", 11), ("rssi", 12), ("snr", 13)):
+                signal[key] = int(fields[idx].split()[0])
+        except (IndexError, ValueError):
+            pass
+        self.signal = signal
+
+    def snapshot(self):
+        """
+        :return: Dictionary of command name to stats, and latest signal sample under "signal".
+        """
+        return {"commands": self.commands, "signal": self.signal}
+
+    def telemetry(self, fields=()):
+        """
+        Compact telemetry message:
+        {Telemetry,A=name:n/timeouts/errors/h0.h1...;name:...,Q=key:value;key:value...}
+
+        :param fields: Extra fields appended to the message, e.g. the power record.
+        :return: Telemetry message string.
+        """
+        commands = ";".join("%s:%d/%d/%d/%s" % (name, stats["n"], stats["timeouts"], stats["errors"],
+                                                 ".".join(str(h) for h in stats["hist"]))
+                            for name, stats in self.commands.items())
+        signal = ";".join("%s:%d" % (key, value) for key, value in self.signal.items() if key != "time")
+        return "{Telemetry,A=" + commands + ",Q=" + signal + "".join("," + field for field in fields) + "}"
+
+
+atStats = ATStats()
+
 
 def sendData(data, raw=False):
     """
@@ -50,10 +257,13 @@ def AT(command="", timeout=10, success="OK", failure="+CME ERROR"):
     :param failure: Expected failure response
     :return: Response from modem
     """
+    start = time.ticks_ms()
+    name = atStats.name(command)
     command = "AT" + command
     print("--->", command)
     sendData(command)
     response = listen(timeout=timeout, success=success, failure=failure)
+    atStats.record(name, time.ticks_diff(time.ticks_ms(), start), response)
     if failure in response:
         print(response[1])
     print("TIMEOUT") if "TIMEOUT" in response else print("<---", response[1])
@@ -120,6 +330,24 @@ def ntp(apn="payandgo.o2.co.uk", dest="pool.ntp.org"):
     AT('+SAPBR=0,1')
 
 
+def syncClock(wallclock, apn="payandgo.o2.co.uk"):
+    """
+    Sets the modem clock from NTP and caches its offset from the camera clock, so detections are stamped with their
+    capture time. Call while the MQTT session is down.
+
+    :param wallclock: clocksync.DeviceClock to sync.
+    :param apn: Operator APN.
+    :return: Whether the clock is synced.
+    """
+    ntp(apn=apn)
+    response = AT('+CCLK?', success="+CCLK")
+    now = time.time()
+    synced = wallclock.sync(clocksync.parseCclk(response[1]) if response != "TIMEOUT" else None, now)
+    if not synced:
+        print("Modem clock not set, capture times unknown until the next sync")
+    return synced
+
+
 def httpGet(apn="payandgo.o2.co.uk", dest="http://www.google.com"):
     """
     Tests modem connection over HTTP.
@@ -235,6 +463,17 @@ def mqttconn():
     AT("+SMCONN", timeout=10)
 
 
+def mqttensure(linked):
+    """
+    Starts an MQTT session, unless the session kept up since the last upload is still connected.
+
+    :param linked: Flags whether the last session was kept up.
+    """
+    if linked and "+SMSTATE: 1" in AT("+SMSTATE?")[1]:
+        return
+    mqttconn()
+
+
 def mqttdisc():
     """
     Disconnect from MQTT session.
@@ -250,9 +489,15 @@ def mqttpub(topic="basicPubSub", message="Hello World!", raw=False):
     :param message: Publish message.
     :param raw: Flags whether or not to encode data when sending over UART.
     """
+    t = profiler.start()
     AT("+SMPUB=\"{}\",{},1,0".format(topic, len(message)))
+    start = time.ticks_ms()
     sendData(message, raw)
+    sent = time.ticks_ms()
+    atStats.record("+SMPUB.data", time.ticks_diff(sent, start), (None, ""))
     response = listen(success="OK", failure="ERROR")
+    atStats.record("+SMPUB.ack", time.ticks_diff(time.ticks_ms(), sent), response)
+    profiler.stop("publish", t)
     if "+CME ERROR" in response:
         print(response[1])
     print("TIMEOUT") if "TIMEOUT" in response else print("<---", response[1])
@@ -260,6 +505,18 @@ def mqttpub(topic="basicPubSub", message="Hello World!", raw=False):
         gotoErrorState(red_led)
 
 
+def mqttflush(batcher, topic=MQTT_TOPIC, everything=False):
+    """
+    Publishes queued small messages as batches over the current MQTT session.
+
+    :param batcher: batch.Batcher holding the messages.
+    :param topic: Publish topic.
+    :param everything: Flags whether to send every queued message, rather than only the batches which are due.
+    """
+    while batcher.messages and (everything or batcher.due(time.time())):
+        mqttpub(topic=topic, message=batcher.pack(), raw=True)
+
+
 def mqttsub(topic="basicPubSub"):
     """
     Subscribe to topic for current MQTT session.
@@ -278,6 +535,36 @@ def mqttunsub(topic="basicPubSub"):
     AT("+SMUNSUB=\"{}\"".format(topic))
 
 
+def powerSaving(edrx="0101", psm=False, tau="00100001", active="00000101"):
+    """
+    Lets the modem save power while idle without detaching from the network, so that waking up does not need the PDP
+    context and MQTT configuration set up again.
+
+    :param edrx: eDRX cycle requested for LTE-M (4 bit string, 0101 is 81.92 s), eDRX is disabled if None.
+    :param psm: Flags whether to also request PSM. The modem then stops answering AT commands once the active time
+    after its last transfer has passed, until it is woken by PWRKEY or the TAU timer.
+    :param tau: Requested periodic TAU (T3412, 8 bit string, 00100001 is 1 hour).
+    :param active: Requested active time (T3324, 8 bit string, 00000101 is 10 s).
+    """
+    if edrx:
+        AT('+CEDRXS=1,4,"{}"'.format(edrx))  # 4: LTE-M
+    else:
+        AT("+CEDRXS=0")
+    if psm:
+        AT('+CPSMS=1,,,"{}","{}"'.format(tau, active))
+    else:
+        AT("+CPSMS=0")
+
+
+def sampleSignal():
+    """
+    Samples signal quality (+CSQ and +CPSI?) into the modem health metrics.
+    """
+    csq = AT("+CSQ")
+    cpsi = AT("+CPSI?")
+    atStats.sample(csq[1] if csq != "TIMEOUT" else "", cpsi[1] if cpsi != "TIMEOUT" else "")
+
+
 def getapnip():
     """
     Fetches modem APN and IP address.
@@ -294,6 +581,25 @@ def getapnip():
     return apn, ip
 
 
+def deviceId():
+    """
+    Gets the identity of this camera, from DEVICE_CONFIG or else the modem IMEI.
+
+    :return: Device id, "simcom" if neither is available.
+    """
+    try:
+        with open(DEVICE_CONFIG) as f:
+            return json.load(f)["id"]
+    except (OSError, ValueError, KeyError):
+        pass
+    gsn = AT("+GSN")  # Get IMEI number
+    if gsn != "TIMEOUT":
+        imei = "".join(c for c in gsn[1] if c.isdigit())
+        if imei:
+            return imei
+    return "simcom"
+
+
 def wireless(apn, ip):
     """
     Configures modem for TCP connection.
@@ -310,45 +616,22 @@ def wireless(apn, ip):
     AT('+CIFSR', success=ip)
 
 
-def barcode_name(code):
-    """
-    Gets barcode type from barcode object.
-
-    :param code: Barcode object.
-    :return: Barcode type.
-    """
-    if code.type() == image.EAN2:
-        return "EAN2"
-    if code.type() == image.EAN5:
-        return "EAN5"
-    if code.type() == image.EAN8:
-        return "EAN8"
-    if code.type() == image.UPCE:
-        return "UPCE"
-    if code.type() == image.ISBN10:
-        return "ISBN10"
-    if code.type() == image.UPCA:
-        return "UPCA"
-    if code.type() == image.EAN13:
-        return "EAN13"
-    if code.type() == image.ISBN13:
-        return "ISBN13"
-    if code.type() == image.I25:
-        return "I25"
-    if code.type() == image.DATABAR:
-        return "DATABAR"
-    if code.type() == image.DATABAR_EXP:
-        return "DATABAR_EXP"
-    if code.type() == image.CODABAR:
-        return "CODABAR"
-    if code.type() == image.CODE39:
-        return "CODE39"
-    if code.type() == image.PDF417:
-        return "PDF417"
-    if code.type() == image.CODE93:
-        return "CODE93"
-    if code.type() == image.CODE128:
-        return "CODE128"
+def loadModelConfig():
+    """
+    Reads the classifier variant settings from MODEL_CONFIG.
+
+    :return: Dictionary - model, framesize, window, threshold (see MODEL_DEFAULTS).
+    """
+    config = dict(MODEL_DEFAULTS)
+    try:
+        with open(MODEL_CONFIG) as f:
+            config.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    return config
+
+
+modelConfig = loadModelConfig()
 
 
 def takePicture():
@@ -361,56 +644,95 @@ def takePicture():
     return img
 
 
-def imgToChunks(img, chunk_size=512):
+HEX_DIGITS = b"0123456789abcdef"
+
+
+def hexlifyInto(src, dst):
+    """
+    Hex encodes a buffer into a preallocated buffer, so that no new bytes object is allocated per chunk. The UART at
+    9600 baud dominates transmission time, so a Python loop is fast enough here.
+
+    :param src: Buffer to encode.
+    :param dst: Destination buffer, at least twice the size of src.
+    :return: Number of bytes written to dst.
+    """
+    for i in range(len(src)):
+        b = src[i]
+        dst[2 * i] = HEX_DIGITS[b >> 4]
+        dst[2 * i + 1] = HEX_DIGITS[b & 0x0F]
+    return 2 * len(src)
+
+
+def hexChunks(buf, chunk_size=512):
+    """
+    Generator yielding hex encoded chunks of a buffer. Chunks are memoryview slices of buf encoded into one reused
+    scratch buffer, so each yielded chunk is only valid until the next one is requested.
+
+    :param buf: memoryview of the data to split.
+    :param chunk_size: Size of split (before encoding).
     """
-    JPEG compresses image and converts it into chunks of hex strings that the modem can transmit over MQTT.
+    scratch = bytearray(2 * chunk_size)
+    out = memoryview(scratch)
+    for i in range(0, len(buf), chunk_size):
+        yield out[:hexlifyInto(buf[i:i + chunk_size], scratch)]
+
+
+def imgToChunks(img, chunk_size=512, debug=False):
+    """
+    JPEG compresses image and splits it into chunks of hex strings that the modem can transmit over MQTT. The image is
+    compressed in place and never copied, chunks are encoded lazily just before being written to the UART.
 
     :param img: Image object.
     :param chunk_size: Size of split.
-    :return: List of hex strings representing the compressed image.
+    :param debug: Flags whether or not to print the whole compressed image as hex.
+    :return: Generator of hex encoded chunks representing the compressed image.
     """
-    byte_arr = img.compress(quality=10).bytearray()
-    print(len(byte_arr))
-    # div, mod = divmod(len(byte_arr), chunk_size)
-    # send_num = div + 1 if mod > 0 else 0
-    l = lambda byte_arr, x: [byte_arr[i:i + x] for i in range(0, len(byte_arr), x)]
-    msgs = l(bytes(byte_arr), chunk_size)
-    print(binascii.hexlify(bytes(byte_arr)))
-    return msgs
+    buf = memoryview(img.compress(quality=10).bytearray())
+    print(len(buf))
+    if debug:
+        print(binascii.hexlify(buf))
+    return hexChunks(buf, chunk_size)
 
 
-def mqttsendimg(msgs, headers=None):
+def mqttsendimg(msgs, headers=None, topic=MQTT_TOPIC, record=None):
     """
     Starts the transmission loop for sending chunks of an image over MQTT.
 
-    :param msgs: List of hex strings representing compressed image.
-    :param headers: Relevant metadata to be sent to AWS.
+    :param msgs: Iterable of hex encoded chunks representing compressed image.
+    :param headers: Relevant metadata to be sent to AWS, as a comma separated text header.
+    :param topic: Publish topic.
+    :param record: Binary metadata record (see metarecord.encode), sent instead of the text header.
     """
-    header = "{Image Start"
-    if headers:
-        for metadata in headers:
-            header = header + "," + metadata
-    header += "}"
+    if record is not None:
+        header = record
+    else:
+        header = "{Image Start"
+        if headers:
+            for metadata in headers:
+                header = header + "," + metadata
+        header += "}"
     red_led.on()
-    mqttpub(topic="sdk/test/Python", message=header, raw=True)
+    mqttpub(topic=topic, message=header, raw=True)
     red_led.off()
     for msg in msgs:
         red_led.on()
-        mqttpub(topic="sdk/test/Python", message=binascii.hexlify(msg), raw=True)
+        mqttpub(topic=topic, message=msg, raw=True)
         red_led.off()
     red_led.on()
-    mqttpub(topic="sdk/test/Python", message="{Image End}", raw=True)
+    mqttpub(topic=topic, message="{Image End}", raw=True)
     red_led.off()
 
 
-def setGRAYSCALE():
+def setGRAYSCALE(strip=(0, 220, 640, 40)):
     """
     Sets OpenMV camera to grayscale mode, fit for scanning barcodes.
+
+    :param strip: Scanning window (x, y, w, h), moved frame by frame afterwards (see scanwindow.ScanWindow).
     """
     sensor.reset()
     sensor.set_pixformat(sensor.GRAYSCALE)
     sensor.set_framesize(sensor.VGA)  # High Res!
-    sensor.set_windowing((640, 40))  # V Res of 80 == less work (40 for 2X the speed).
+    sensor.set_windowing(strip)  # V Res of 80 == less work (40 for 2X the speed).
     sensor.skip_frames(time=2000)
     sensor.set_auto_gain(False)  # must turn this off to prevent image washout...
     sensor.set_auto_whitebal(False)  # must turn this off to prevent image washout...
@@ -422,12 +744,103 @@ def setRGB565():
     """
     sensor.reset()  # Reset and initialize the sensor.
     sensor.set_pixformat(sensor.RGB565)  # Set pixel format to RGB565 (or GRAYSCALE)
-    sensor.set_framesize(sensor.QVGA)  # Set frame size to QVGA (320x240)
-    sensor.set_windowing((240, 240))  # Set 240x240 window.
+    sensor.set_framesize(getattr(sensor, modelConfig["framesize"]))  # QVGA (320x240) unless set by MODEL_CONFIG
+    sensor.set_windowing(tuple(modelConfig["window"]))  # 240x240 window unless set by MODEL_CONFIG
     sensor.skip_frames(time=2000)  # Let the camera adjust.
 
 
-def modelDetect(model, labels, timeout=60):
+def setUNIFIED():
+    """
+    Sets OpenMV camera to a single RGB mode fit for both barcode scanning and ML model inference, so that both run on
+    the same frame without reconfiguring the sensor in between.
+    """
+    sensor.reset()
+    sensor.set_pixformat(sensor.RGB565)
+    sensor.set_framesize(sensor.VGA)  # High Res for barcodes, classifier runs on a scaled down ROI
+    sensor.skip_frames(time=2000)
+    sensor.set_auto_gain(False)  # must turn this off to prevent image washout...
+    sensor.set_auto_whitebal(False)  # must turn this off to prevent image washout...
+
+
+def setScanMode(unified=False, strip=(0, 220, 640, 40)):
+    """
+    Sets OpenMV camera up for barcode scanning.
+
+    :param unified: Flags whether or not to use the single capture pipeline instead of the grayscale strip.
+    :param strip: Grayscale scanning window.
+    """
+    setUNIFIED() if unified else setGRAYSCALE(strip)
+
+
+def cropToModel(img, roi=UNIFIED_MODEL_ROI):
+    """
+    Crops and scales a unified pipeline frame in place down to the classifier window, so it can be transmitted at the
+    same size as frames taken in RGB mode.
+
+    :param img: Image object.
+    :param roi: Classifier window.
+    :return: Image object.
+    """
+    return img.crop(roi=roi, x_scale=240 / roi[2], y_scale=240 / roi[3])
+
+
+def barcodeRoi(rect, size=160, unified=False, strip=(0, 220, 640, 40)):
+    """
+    Gets a square classifier region centred on a barcode, so that the model only runs around the scanned parcel.
+
+    :param rect: Barcode rectangle, in barcode scanning frame coordinates.
+    :param size: Side of the region, in 240x240 classifier window pixels.
+    :param unified: Flags whether the barcode was read by the unified pipeline (same frame) or the grayscale strip.
+    :param strip: Grayscale window the barcode was read in, VGA coordinates.
+    :return: Region of interest in classifier frame coordinates.
+    """
+    cx, cy = rect[0] + rect[2] // 2, rect[1] + rect[3] // 2
+    if unified:
+        bx, by, bw, bh = UNIFIED_MODEL_ROI
+        size *= bw // 240
+    else:
+        # Grayscale strip is a window of VGA, RGB window is the centre 240x240 of QVGA, scaled to the window of the
+        # configured model variant
+        bw, bh = modelConfig["window"]
+        cx, cy = (cx // 2 - 40) * bw // 240, (cy + strip[1]) // 2 * bw // 240
+        size = size * bw // 240
+        bx, by = 0, 0
+    size = min(size, bw, bh)
+    x = min(max(cx - size // 2, bx), bx + bw - size)
+    y = min(max(cy - size // 2, by), by + bh - size)
+    return x, y, size, size
+
+
+def printTiming(name, stages, frames):
+    """
+    Prints average per-stage durations of a vision loop.
+
+    :param name: Loop name.
+    :param stages: Dictionary of stage name to accumulated duration in microseconds.
+    :param frames: Number of frames processed.
+    """
+    frames = max(frames, 1)
+    total = sum(stages.values()) / frames
+    timing = ", ".join("%s %d us" % (stage, stages[stage] / frames) for stage in stages)
+    print("%s: %d frames, %s, %f fps" % (name, frames, timing, 1000000 / total if total else 0))
+
+
+def saveTrace(trace, record, label):
+    """
+    Appends a per-frame score trace as a JSON line, in the format read by host/replay_votes.py.
+
+    :param trace: Trace file name, nothing is saved if None.
+    :param record: Dictionary of frame times (ms) and scores.
+    :param label: Label decided on the device.
+    """
+    if not trace:
+        return
+    record["decided"] = label
+    with open(trace, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def modelDetect(model, labels, timeout=60, img=None, roi=None, voter=None, debug=False, trace=None):
     """
     Uses the OpenMV camera to search for a parcel in good/bad condition, and returns once it has found it. Aborts process if a timeout occurs.
     ML model needs to be present in flash memory. Timeout if no parcel is detected for a set duration.
@@ -435,42 +848,87 @@ def modelDetect(model, labels, timeout=60):
     :param model: ML model file name.
     :param labels: Model labels
     :param timeout: Timeout duration.
-    :return: Image, Label
+    :param img: Already captured frame to classify first (unified pipeline), avoids taking another snapshot.
+    :param roi: Region of the frame to run the classifier on, whole frame if None.
+    :param voter: Temporal voter deciding on a label from per-frame scores, single confident frame if None.
+    :param debug: Flags whether or not to print model outputs and draw detections for every frame.
+    :param trace: Optional file to append the per-frame score trace to, for replay on the host.
+    :return: Image, Label, score of the label in the deciding frame
     """
     green_led.on()
     start = time.time()
+    stages = {"snapshot": 0, "classify": 0, "decide": 0}
+    frames = 0
+    if voter is None:
+        voter = voting.StreakVoter(labels)
+    voter.reset()
+    record = {"t": [], "s": []} if trace else None
     while True:
         clock.tick()
 
-        img = sensor.snapshot()
+        t0 = time.ticks_us()
+        if img is None:
+            img = sensor.snapshot()
+        t1 = time.ticks_us()
+        objs = tf.classify(model, img, roi=roi or (0, 0, img.width(), img.height()), min_scale=1.0, scale_mul=0.5,
+                           x_overlap=-1, y_overlap=-1)
+        t2 = time.ticks_us()
+
+        decision = None
+        for obj in objs:
+            output = obj.output()
+            if record:
+                record["t"].append(time.ticks_ms())
+                record["s"].append(output)
+            label = voter.vote(output)
+            if debug:
+                print("**********\nDetections at [x=%d,y=%d,w=%d,h=%d]" % obj.rect())
+                for i in range(len(output)):
+                    print("%s = %f" % (labels[i], output[i]))
+                img.draw_rectangle(obj.rect())
+                img.draw_string(obj.x() + 3, obj.y() - 1, labels[output.index(max(output))], mono_space=False)
+
+            if label:
+                decision = obj
+                break
 
-        for obj in tf.classify(model, img, min_scale=1.0, scale_mul=0.5, x_overlap=-1, y_overlap=-1):
-            print("**********\nDetections at [x=%d,y=%d,w=%d,h=%d]" % obj.rect())
-            for i in range(len(obj.output())):
-                print("%s = %f" % (labels[i], obj.output()[i]))
-            img.draw_rectangle(obj.rect())
-            img.draw_string(obj.x() + 3, obj.y() - 1, labels[obj.output().index(max(obj.output()))], mono_space=False)
+        frames += 1
+        stages["snapshot"] += time.ticks_diff(t1, t0)
+        stages["classify"] += time.ticks_diff(t2, t1)
+        stages["decide"] += time.ticks_diff(time.ticks_us(), t2)
 
-            if max(obj.output()) > 0.95:  # HIGH CONFIDENCE
-                green_led.off()
-                return img, labels[obj.output().index(max(obj.output()))]
-        print(clock.fps(), "fps")
+        if decision:
+            if not debug:  # only the returned frame gets annotated
+                img.draw_rectangle(decision.rect())
+                img.draw_string(decision.x() + 3, decision.y() - 1, label, mono_space=False)
+            green_led.off()
+            printTiming("modelDetect", stages, frames)
+            saveTrace(trace, record, label)
+            return img, label, output[labels.index(label)]
+        if debug:
+            print(clock.fps(), "fps")
+        img = None
 
         if (time.time() - start) > timeout:
             green_led.off()
-            return None, None
+            printTiming("modelDetect", stages, frames)
+            saveTrace(trace, record, None)
+            return None, None, 0.0
 
 
 def callback(line):
     """
-    Defines callback function for external interrupt.
+    Defines callback function for external interrupt, flags the motion that ends a nap.
     """
-    pass
+    global motion
+    motion = True
 
 
 def gotoSleep():
     """
-    Sets OpenMV camera into sleep mode.
+    Sets OpenMV camera into deep sleep: the sensor is shut down and the CPU stops its clocks until the motion sensor
+    interrupt. machine.deepsleep() would reset the camera on wake up and lose the queued messages, so this is the
+    deepest sleep that keeps RAM.
     """
     sensor.reset()
 
@@ -489,19 +947,40 @@ def gotoSleep():
     machine.sleep()
 
 
+def gotoNap():
+    """
+    Sets OpenMV camera into a light sleep keeping the sensor configuration, for a fast wake up. The CPU idles between
+    interrupts with its clocks, UART and timers running until the motion sensor interrupt.
+    """
+    global motion
+    motion = False
+    sensor.sleep(True)
+    while not motion:
+        machine.idle()
+
+
+def wakeFromNap():
+    """
+    Wakes the sensor up from a nap, its scanning configuration is unchanged.
+    """
+    sensor.sleep(False)
+    sensor.skip_frames(n=3)
+
+
 if __name__ == "__main__":
     # Set interrupt for motion sensor on pin 9
     IOpin = Pin("P9", Pin.IN, Pin.PULL_UP)
     ext = ExtInt(IOpin, ExtInt.IRQ_FALLING, Pin.PULL_UP, callback)
 
     # Initialize variables for ML and LEDs
-    net = 'trained.tflite'
-    labels = ['background', 'Damaged Parcel', 'Parcel']
+    net = modelConfig["model"]
+    labels = metarecord.LABELS
     red_led = pyb.LED(1)
     green_led = pyb.LED(2)
     blue_led = pyb.LED(3)
 
     # Test if modem is responding
+    t = profiler.start()
     red_led.on()
     while "OK" not in AT():
         pass
@@ -518,16 +997,57 @@ if __name__ == "__main__":
 
     # configure SSL certificates and private key + setup mqtt session details
     sslconf(rootca="rootleg.pem", clientca="clientcert.pem", clientkey="clientkey.pem", ip=ip, rootonly=False)
-    mqttconf(clientid="simcom", url="a1qrdh5dmin77y.iot.eu-west-2.amazonaws.com", port="8883", topic="sdk/test/Python")
+    # Device identity is the MQTT client id, and is carried in the publish topic and image headers
+    device = deviceId()
+    topic = "{}/{}".format(MQTT_TOPIC, device)
+    mqttconf(clientid=device, url="a1qrdh5dmin77y.iot.eu-west-2.amazonaws.com", port="8883", topic=topic)
+    # Capture times come from the modem clock, set from NTP, the camera RTC is not set at power up
+    wallclock = clocksync.DeviceClock(resync=24 * 3600)
+    syncClock(wallclock, apn=apn)
+    # Stay registered in eDRX between uploads rather than tearing the link down
+    powerSaving()
+    profiler.stop("modem", t)
+    sampleSignal()
 
     # go to sleep and wait for interrupt
     gotoSleep()
 
-    # Set grayscale for reading barcode
-    setGRAYSCALE()
-
-    # Configure idle timeout
-    timeout = 30
+    # Use a single RGB capture for both barcode scanning and ML model inference instead of switching sensor modes
+    unified = False
+
+    # Model inference settings: only classify around the scanned barcode, how per-frame scores are voted on, whether
+    # to print/draw every model output, and optional score trace file for replaying on the host
+    roi_inference = False
+    voter = voting.EMAVoter(labels, threshold=modelConfig["threshold"], alpha=0.5)
+    debug = False
+    trace = None
+
+    # Send image metadata as a compact binary record (see metarecord.py) rather than the comma separated text header
+    binary_header = True
+
+    # Barcode scanning window: narrow strips cycled through, widened around low quality reads
+    scan = scanwindow.ScanWindow()
+
+    # Recently uploaded barcodes are not classified and uploaded again. A barcode shown again after being out of view
+    # for seen_gap seconds is reported with a small {Seen Again,...} message if seen_again is set
+    recent = recentcache.RecentCache(ttl=60, capacity=16)
+    seen_again = True
+    seen_gap = 10
+
+    # Telemetry and seen again messages are queued and published together in compressed batches of up to 1 KB, sent
+    # along with the next upload, or when full or max_age seconds old
+    batcher = batch.Batcher(limit=1024, max_age=300)
+
+    # Set grayscale (or unified mode) for reading barcode
+    t = profiler.start()
+    setScanMode(unified, scan.reset())
+    profiler.stop("wake", t)
+
+    # Idle timeout and sleep depth adapt to the parcel arrival rate, the MQTT session is kept up across short gaps.
+    # Minimum time between signal quality samples sent with modem telemetry
+    duty = power.PowerManager(profiler, timeout=30)
+    linked = False
+    signal_interval = 300
     start_time = time.time()
 
     # Start main loop
@@ -535,51 +1055,129 @@ if __name__ == "__main__":
         # light up blue LED while searching for barcodes
         blue_led.on()
 
-        # Search for barcode (for best performance scan barcode from top to bottom
+        # Search for barcode in the current scanning window, only good quality or confirmed reads are acted on
         clock.tick()
+        t = profiler.start()
+        strip = scan.window() if unified else scan.apply(sensor.set_windowing)
         img = sensor.snapshot()
-        codes = img.find_barcodes()
+        captured = time.time()
+        codes = img.find_barcodes(roi=strip) if unified else img.find_barcodes()
+        codes = scan.update(codes, strip, offset=not unified)
+        profiler.stop("scan", t)
         # If barcode is found init ML model
         for code in codes:
+            # Resolve barcode type once per detected code
+            name = barcode_name(code)
+            gap = recent.seen((name, code.payload()))
+            if gap is not None:
+                # Uploaded recently, most likely the same parcel still in view
+                print("Barcode %s, Payload \"%s\" uploaded recently, skipped" % (name, code.payload()))
+                if seen_again and gap >= seen_gap:
+                    message = "{Seen Again,%s,%s,D=%s" % (name, code.payload(), device)
+                    stamp = wallclock.unix(captured)
+                    batcher.add(message + (",T=%d}" % stamp if stamp else "}"), time.time())
+                continue
+            duty.parcel(time.time())
             blue_led.off()
-            img.draw_rectangle(code.rect())
-            print_args = (
-                barcode_name(code), code.payload(), (180 * code.rotation()) / math.pi, code.quality(), clock.fps())
+            if debug:
+                img.draw_rectangle(code.rect())
+            print_args = (name, code.payload(), (180 * code.rotation()) / math.pi, code.quality(), clock.fps())
             print("Barcode %s, Payload \"%s\", rotation %f (degrees), quality %d, FPS %f" % print_args)
-            # Give some time for users to show full parcel
-            time.sleep(5)
-
-            # Set to RGB to use image classification model
-            setRGB565()
-            imgout, outlabel = modelDetect(model=net, labels=labels)
+            roi = barcodeRoi(code.rect(), unified=unified, strip=strip) if roi_inference else None
+            if unified:
+                # Classify the same frame the barcode was read from, keep sampling in the same mode if not confident
+                t = profiler.start()
+                imgout, outlabel, score = modelDetect(model=net, labels=labels, img=img,
+                                                      roi=roi or UNIFIED_MODEL_ROI, voter=voter, debug=debug,
+                                                      trace=trace)
+                profiler.stop("classify", t)
+                if imgout is not None:
+                    imgout = cropToModel(imgout)
+            else:
+                # Give some time for users to show full parcel
+                time.sleep(5)
+
+                # Set to RGB to use image classification model
+                t = profiler.start()
+                setRGB565()
+                profiler.stop("switch", t)
+                t = profiler.start()
+                imgout, outlabel, score = modelDetect(model=net, labels=labels, roi=roi, voter=voter,
+                                                      debug=debug, trace=trace)
+                profiler.stop("classify", t)
 
             # Model timeout
             if imgout is None and outlabel is None:
-                setGRAYSCALE()
+                if not unified:
+                    setGRAYSCALE(scan.reset())
                 break
 
             # Prepare image+headers for data transmission
-            msgs = imgToChunks(imgout, chunk_size=512)
-
-            # Start data transmission loop
-            mqttconn()
-            mqttsendimg(msgs=msgs, headers=(barcode_name(code), code.payload(), outlabel))
-            mqttdisc()
+            t = profiler.start()
+            msgs = imgToChunks(imgout, chunk_size=512, debug=debug)
+            profiler.stop("compress", t)
+
+            # Start data transmission loop, stage stats so far are piggybacked on the image header
+            t = profiler.start()
+            mqttensure(linked)
+            profiler.stop("modem", t)
+            stamp = wallclock.unix(captured)
+            if binary_header:
+                record = metarecord.encode(name, code.payload(), outlabel, device, confidence=score,
+                                           timestamp=stamp, fields=(profiler.stats(),))
+                mqttsendimg(msgs=msgs, topic=topic, record=record)
+            else:
+                headers = (name, code.payload(), outlabel, profiler.stats(), "D=" + device)
+                mqttsendimg(msgs=msgs, headers=headers + (("T=%d" % stamp,) if stamp else ()), topic=topic)
+            recent.add((name, code.payload()))
+            if (time.time() - atStats.signal.get("time", 0)) > signal_interval:
+                sampleSignal()
+            batcher.add(atStats.telemetry((duty.telemetry(), batcher.telemetry())), time.time())
+            linked = duty.keepLink()
+            mqttflush(batcher, topic=topic, everything=not linked)
+            if not linked:
+                mqttdisc()
 
             # not needed anymore with timeout
             # gotoSleep()
             # refresh timeout to allow for multiple packages to be read
             start_time = time.time()
 
-            # prepare for barcode reading
-            setGRAYSCALE()
+            # prepare for barcode reading (unified mode never left scanning configuration)
+            if not unified:
+                t = profiler.start()
+                setGRAYSCALE(scan.reset())
+                profiler.stop("switch", t)
             break
         if not codes:
             print("FPS %f" % clock.fps())
 
-        # Timeout has occured
-        if (time.time() - start_time) > timeout:
+        # Timeout has occured: nap through a short expected gap, deep sleep through a long one
+        if (time.time() - start_time) > duty.timeout():
             blue_led.off()
-            gotoSleep()
+            nap = duty.nap()
+            # Queued messages are kept across sleeps (machine.sleep() keeps RAM), sent here once they waited too long
+            if batcher.due(time.time()):
+                t = profiler.start()
+                mqttensure(linked)
+                profiler.stop("modem", t)
+                mqttflush(batcher, topic=topic, everything=True)
+                linked = True
+            if linked and not (nap and duty.keepLink()):
+                mqttdisc()
+                linked = False
+            slept = time.time()
+            gotoNap() if nap else gotoSleep()
+            duty.slept(nap, time.time() - slept)
             start_time = time.time()
-            setGRAYSCALE()
+            t = profiler.start()
+            if nap:
+                wakeFromNap()
+            else:
+                setScanMode(unified, scan.reset())
+            profiler.stop("nap" if nap else "wake", t)
+            # Resync the clock daily against camera clock drift, the MQTT session is down after a deep sleep
+            if not nap and wallclock.due():
+                t = profiler.start()
+                syncClock(wallclock, apn=apn)
+                profiler.stop("modem", t)
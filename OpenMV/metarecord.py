@@ -0,0 +1,114 @@
+"""
+Compact binary metadata record, sent as the first message of an image upload instead of the comma separated
+{Image Start,...} text header. Numbers are packed and strings are length prefixed, so a payload may contain commas or
+braces. The record also carries the capture time and label confidence, and still takes about 60% of the bytes of the
+text header without the stage stats field (see AWS/benchmarks/bench_metadata.py).
+
+Layout, little endian:
+    magic       B       0xA5, never the first byte of a text message or hex fragment
+    version     B       record layout version, 1
+    time        I       capture time, seconds since 1970-01-01 UTC, 0 if the camera clock is not set
+    type        B       barcode type, index in barcode_types.BARCODE_TYPES, 255 if unknown
+    label       B       decided label, index in LABELS, 255 if unknown
+    confidence  B       score of the decided label, 0-255 for 0.0-1.0
+    device      B + n   device id, UTF-8
+    payload     B + n   barcode payload, UTF-8
+    fields      H + n   extra text fields, comma separated (e.g. the stage stats S=...)
+
+AWS/pullS3.py decodes records into the same field list as text headers. Plain Python so the same code runs on the
+OpenMV camera and on the host (see host/replay.py).
+"""
+
+import struct
+
+from barcode_types import BARCODE_TYPES
+
+MAGIC = 0xA5
+VERSION = 1
+LABELS = ("background", "Damaged Parcel", "Parcel")
+UNKNOWN = 255
+
+HEAD = "<BBIBBB"
+HEAD_SIZE = struct.calcsize(HEAD)
+
+
+def index(values, value):
+    """
+    :param values: Enumeration, e.g. LABELS.
+    :param value: Value to look up.
+    :return: Index of value in values, UNKNOWN if it is not one of them.
+    """
+    for i in range(len(values)):
+        if values[i] == value:
+            return i
+    return UNKNOWN
+
+
+def text(value, limit):
+    """
+    :param value: String.
+    :param limit: Most bytes kept.
+    :return: UTF-8 bytes, truncated to limit on a character boundary.
+    """
+    data = value.encode("utf-8") if isinstance(value, str) else bytes(value)
+    if len(data) <= limit:
+        return data
+    # Back off over continuation bytes (0b10xxxxxx), a split character would not decode
+    while limit and data[limit] & 0xC0 == 0x80:
+        limit -= 1
+    return data[:limit]
+
+
+def encode(name, payload, label, device, confidence=0.0, timestamp=0, fields=()):
+    """
+    Packs the metadata of an image.
+
+    :param name: Barcode type name (see barcode_types.barcode_name).
+    :param payload: Barcode payload.
+    :param label: Decided label.
+    :param device: Device id.
+    :param confidence: Score of the decided label.
+    :param timestamp: Capture time, seconds since 1970 (see clocksync.DeviceClock.unix).
+    :param fields: Extra text fields, without commas.
+    :return: Record bytes.
+    """
+    device = text(device, 255)
+    payload = text(payload, 255)
+    extra = text(",".join(fields), 65535)
+    level = int(confidence * 255 + 0.5)
+    head = struct.pack(HEAD, MAGIC, VERSION, timestamp, index(BARCODE_TYPES, name), index(LABELS, label),
+                       min(max(level, 0), 255))
+    return (head + struct.pack("<B", len(device)) + device + struct.pack("<B", len(payload)) + payload +
+            struct.pack("<H", len(extra)) + extra)
+
+
+def decode(data):
+    """
+    Unpacks a record, the inverse of encode().
+
+    :param data: Record bytes.
+    :return: Dictionary - version, time, type, payload, label, confidence, device, fields.
+    :raise ValueError: If the data is not a record of a known version.
+    """
+    if len(data) < HEAD_SIZE or data[0] != MAGIC:
+        raise ValueError("not a metadata record")
+    magic, version, timestamp, kind, label, level = struct.unpack(HEAD, data[:HEAD_SIZE])
+    if version != VERSION:
+        raise ValueError("unknown metadata record version %d" % version)
+    pos = HEAD_SIZE
+    strings = []
+    for size in ("<B", "<B", "<H"):
+        width = struct.calcsize(size)
+        if pos + width > len(data):
+            raise ValueError("metadata record is truncated")
+        n = struct.unpack(size, data[pos:pos + width])[0]
+        pos += width
+        if pos + n > len(data):
+            raise ValueError("metadata record is truncated")
+        strings.append(bytes(data[pos:pos + n]).decode("utf-8"))
+        pos += n
+    device, payload, extra = strings
+    return {"version": version, "time": timestamp,
+            "type": BARCODE_TYPES[kind] if kind < len(BARCODE_TYPES) else None, "payload": payload,
+            "label": LABELS[label] if label < len(LABELS) else None, "confidence": level / 255, "device": device,
+            "fields": extra.split(",") if extra else []}
@@ -0,0 +1,159 @@
+"""
+Duty cycling of the camera between parcels. The gap between parcels is tracked as a moving average, which sets how long
+the camera keeps scanning after a parcel and how deeply it sleeps once it stops. The scanning window only shrinks below
+the initial timeout while parcels arrive often, the first window after a deep sleep is never shorter: rare parcels are
+the ones waking the camera up.
+
+- nap: a light sleep, the sensor sleeps with its scanning configuration kept and the CPU idles between interrupts
+  with its clocks running, the MQTT session stays up. The next parcel is scanned after a few frames without
+  reconfiguring the sensor or reconnecting.
+- deep sleep: the sensor is reset and shut down, the MQTT session is closed and the CPU stops its clocks until the
+  motion sensor interrupt, waking pays the full sensor set up and a reconnection.
+
+The modem stays registered in eDRX/PSM either way. A nap is chosen while the energy saved by deep sleeping through the
+expected gap is less than the extra cost of waking from it. Wake costs and energy per parcel are estimated from the
+profiler stage timings and nominal power draws.
+
+Plain Python so the same policy runs on the OpenMV camera and on the host (see host/replay.py).
+"""
+
+
+class PowerManager:
+    """
+    Adapts the idle timeout and sleep depth to the parcel arrival rate.
+    """
+
+    # Nominal power draw in milliwatts of the camera plus modem during each profiler stage, and while napping or deep
+    # sleeping (sensor asleep or shut down, modem idle in eDRX/PSM)
+    POWER_MW = {"wake": 560, "nap": 560, "modem": 1000, "scan": 560, "switch": 560, "classify": 600, "compress": 560,
+                "publish": 1300}
+    NAP_MW = 40
+    SLEEP_MW = 10
+
+    # Stage durations in milliseconds assumed until the profiler has samples
+    DEFAULT_MS = {"wake": 2000, "nap": 100, "modem": 2000}
+
+    def __init__(self, profiler, timeout=30, min_timeout=5, max_timeout=60, factor=1.5, alpha=0.3, max_gap=3600,
+                 link_hold=50, power=None):
+        """
+        :param profiler: Stage profiler of the main loop (see main.Profiler).
+        :param timeout: Idle timeout in seconds until the parcel rate is known, while parcels come further apart than
+            max_timeout and for the first window after a deep sleep.
+        :param min_timeout: Shortest idle timeout.
+        :param max_timeout: Longest idle timeout.
+        :param factor: Idle timeout as a multiple of the expected gap between parcels.
+        :param alpha: Weight of the latest gap in the moving average.
+        :param max_gap: Longest gap in seconds counted, e.g. overnight gaps are capped.
+        :param link_hold: Longest expected gap in seconds the MQTT session is kept up across, below the keep alive.
+        :param power: Power draws per stage overriding POWER_MW.
+        """
+        self.profiler = profiler
+        self.default = timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.factor = factor
+        self.alpha = alpha
+        self.max_gap = max_gap
+        self.link_hold = link_hold
+        self.power = dict(self.POWER_MW)
+        if power:
+            self.power.update(power)
+        self.gap = None
+        self.last = None
+        self.woke = True
+        self.parcels = 0
+        self.naps = 0
+        self.sleeps = 0
+        self.asleep = {"nap": 0.0, "sleep": 0.0}
+
+    def parcel(self, now):
+        """
+        Records the arrival of a parcel.
+
+        :param now: Time in seconds.
+        """
+        if self.last is not None:
+            gap = min(now - self.last, self.max_gap)
+            self.gap = gap if self.gap is None else self.alpha * gap + (1 - self.alpha) * self.gap
+        self.last = now
+        self.woke = False
+        self.parcels += 1
+
+    def timeout(self):
+        """
+        :return: Seconds to keep scanning without a parcel, long enough to catch the next parcel of a burst.
+        """
+        if self.gap is None or self.gap > self.max_timeout:
+            return self.default
+        timeout = min(max(self.factor * self.gap, self.min_timeout), self.max_timeout)
+        return max(timeout, self.default) if self.woke else timeout
+
+    def stageMs(self, stage):
+        """
+        :param stage: Profiler stage.
+        :return: Median duration of the stage in milliseconds, DEFAULT_MS if it has no samples.
+        """
+        summary = self.profiler.summary(stage) if stage in self.profiler.stages else None
+        return summary[1] / 1000 if summary else self.DEFAULT_MS.get(stage, 0)
+
+    def wakeCost(self, nap):
+        """
+        :param nap: Flags whether to cost waking from a nap rather than from deep sleep.
+        :return: Energy in millijoules to wake up and get ready to upload.
+        """
+        if nap:
+            return self.stageMs("nap") * self.power["nap"] / 1000
+        return (self.stageMs("wake") * self.power["wake"] + self.stageMs("modem") * self.power["modem"]) / 1000
+
+    def nap(self):
+        """
+        :return: Whether to nap rather than deep sleep once the idle timeout is reached.
+        """
+        if self.gap is None:
+            return False
+        saved = self.gap * (self.NAP_MW - self.SLEEP_MW)
+        return saved < self.wakeCost(False) - self.wakeCost(True)
+
+    def keepLink(self):
+        """
+        :return: Whether to keep the MQTT session up after an upload, for the next parcel expected soon.
+        """
+        return self.gap is not None and self.gap <= self.link_hold
+
+    def slept(self, nap, seconds):
+        """
+        Records a nap or deep sleep.
+
+        :param nap: Flags whether it was a nap.
+        :param seconds: Time asleep.
+        """
+        if nap:
+            self.naps += 1
+        else:
+            self.sleeps += 1
+            self.woke = True
+        self.asleep["nap" if nap else "sleep"] += seconds
+
+    def energy(self):
+        """
+        Estimates the energy used per parcel, from the time spent in each profiler stage (scanning included) and asleep.
+
+        :return: Millijoules per parcel, None before the first parcel.
+        """
+        if not self.parcels:
+            return None
+        total = 0.0
+        for stage in self.profiler.stages:
+            total += self.profiler.total(stage) / 1000 * self.power.get(stage, 0) / 1000
+        total += self.asleep["nap"] * self.NAP_MW + self.asleep["sleep"] * self.SLEEP_MW
+        return total / self.parcels
+
+    def telemetry(self):
+        """
+        Compact power record, sent with the modem telemetry. Format: P=key:value;key:value...
+
+        :return: Power record string.
+        """
+        fields = {"timeout": self.timeout(), "gap": self.gap, "mj": self.energy(), "naps": self.naps,
+                  "sleeps": self.sleeps}
+        return "P=" + ";".join("%s:%d" % (key, fields[key]) for key in fields if fields[key] is not None)
@@ -0,0 +1,59 @@
+"""
+Cache of recently uploaded barcodes, so that a parcel lingering in front of the camera is not classified and uploaded
+again, and a parcel shown again can be reported with a small {Seen Again,...} message instead.
+
+Plain Python so the same cache runs on the OpenMV camera and on the host (see host/replay.py).
+"""
+
+import time
+
+
+class RecentCache:
+    """
+    Time-bounded cache of recently uploaded barcodes, keyed by (type, payload), so that a parcel lingering in front of
+    the camera is not classified and uploaded again. Every re-scan extends the entry, the parcel is only uploaded again
+    once it has been out of view for the TTL. When full, the least recently seen barcode is dropped.
+    """
+
+    def __init__(self, ttl=60, capacity=16):
+        """
+        :param ttl: Seconds a barcode stays in the cache after it was last read.
+        :param capacity: Maximum number of barcodes kept.
+        """
+        self.ttl = ttl
+        self.capacity = capacity
+        self.entries = {}  # (type, payload) -> time last read
+
+    def add(self, key, now=None):
+        """
+        Caches an uploaded barcode.
+
+        :param key: (type, payload)
+        :param now: Current time in seconds, time.time() if None.
+        """
+        now = time.time() if now is None else now
+        if key not in self.entries and len(self.entries) >= self.capacity:
+            for other in list(self.entries):
+                if now - self.entries[other] > self.ttl:
+                    del self.entries[other]
+            if len(self.entries) >= self.capacity:
+                del self.entries[min(self.entries, key=lambda other: self.entries[other])]
+        self.entries[key] = now
+
+    def seen(self, key, now=None):
+        """
+        Checks a scanned barcode against the cache, extending its entry if it was uploaded recently.
+
+        :param key: (type, payload)
+        :param now: Current time in seconds, time.time() if None.
+        :return: Seconds since the barcode was last read, None if it was not uploaded within the TTL.
+        """
+        now = time.time() if now is None else now
+        last = self.entries.get(key)
+        if last is None:
+            return None
+        if now - last > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries[key] = now
+        return now - last
@@ -0,0 +1,104 @@
+"""
+Barcode scan window auto-tuning. Barcodes are searched for in a narrow strip of the VGA frame, which keeps scanning
+fast, and the strip cycles through several heights so that a parcel does not have to be held across one fixed line.
+A low quality decode (few scanlines read the barcode, it is only partly in the strip) widens the window around the
+barcode for a few frames, and is accepted once a good read or a second read of the same payload confirms it.
+
+Plain Python so the same window runs on the OpenMV camera and on the host (see host/replay.py).
+"""
+
+
+class ScanWindow:
+    """
+    Chooses the barcode scanning window, in VGA frame coordinates, frame by frame.
+    """
+
+    def __init__(self, strips=(220, 160, 280), width=640, height=40, wide=120, frame=480, min_quality=3, hold=10):
+        """
+        :param strips: Top rows of the narrow strips cycled through, the first one is used after a reset.
+        :param width: Window width.
+        :param height: Narrow strip height.
+        :param wide: Window height while following up a low quality decode.
+        :param frame: Frame height.
+        :param min_quality: Lowest code.quality() accepted without confirmation.
+        :param hold: Frames the window stays wide without a confirming read.
+        """
+        self.strips = strips
+        self.width = width
+        self.height = height
+        self.wide = wide
+        self.frame = frame
+        self.min_quality = min_quality
+        self.hold = hold
+        self.reset()
+
+    def reset(self):
+        """
+        Goes back to the first narrow strip, call when the sensor is (re)configured for scanning.
+
+        :return: Window to configure the sensor with.
+        """
+        self.index = 0
+        self.focus = None
+        self.left = 0
+        self.pending = []
+        self.applied = self.window()
+        return self.applied
+
+    def window(self):
+        """
+        :return: Current window, (x, y, w, h).
+        """
+        if self.focus is None:
+            return 0, self.strips[self.index], self.width, self.height
+        y = min(max(self.focus - self.wide // 2, 0), self.frame - self.wide)
+        return 0, y, self.width, self.wide
+
+    def apply(self, setter):
+        """
+        Moves the sensor window if the window changed since it was last set.
+
+        :param setter: Function setting the sensor window, e.g. sensor.set_windowing.
+        :return: Current window.
+        """
+        window = self.window()
+        if window != self.applied:
+            setter(window)
+            self.applied = window
+        return window
+
+    def update(self, codes, window, offset=True):
+        """
+        Feeds the barcodes found in a frame and moves the window for the next one.
+
+        :param codes: Barcodes found in the window.
+        :param window: Window the barcodes were searched in.
+        :param offset: Flags whether barcode rectangles are relative to the window (sensor windowing) rather than to
+        the frame (find_barcodes roi).
+        :return: Accepted barcodes, good quality or confirmed reads.
+        """
+        accepted = [code for code in codes if code.quality() >= self.min_quality or code.payload() in self.pending]
+        if accepted:
+            self.index = 0
+            self.focus = None
+            self.left = 0
+            self.pending = []
+            return accepted
+        if codes:
+            # Low quality reads only: widen around the best one, accept its payload if read again
+            best = codes[0]
+            for code in codes:
+                if code.quality() > best.quality():
+                    best = code
+            rect = best.rect()
+            self.focus = rect[1] + rect[3] // 2 + (window[1] if offset else 0)
+            self.left = self.hold
+            self.pending = [code.payload() for code in codes]
+        elif self.left:
+            self.left -= 1
+            if not self.left:
+                self.focus = None
+                self.pending = []
+        else:
+            self.index = (self.index + 1) % len(self.strips)
+        return []
@@ -0,0 +1,131 @@
+"""
+Temporal aggregation of per-frame classifier scores. A decision is only made once enough frames back it, which allows
+for a lower per-frame threshold than a single frame decision while being less sensitive to one spurious frame.
+
+Plain Python so the same voters run on the OpenMV camera and on the host (see host/replay_votes.py).
+"""
+
+
+class Voter:
+    """
+    Single frame voter, deciding as soon as one frame is confident about a label, and base class of the temporal
+    voters. These override vote(), which gets the per-frame scores and returns the decided label or None, and reset()
+    for their voting state.
+    """
+
+    def __init__(self, labels, threshold, ignore=("background",)):
+        """
+        :param labels: Model labels, in model output order.
+        :param threshold: Confidence needed for a score to count towards a decision.
+        :param ignore: Labels that can never be decided on.
+        """
+        self.labels = labels
+        self.threshold = threshold
+        self.ignore = [labels.index(label) for label in ignore if label in labels]
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the voting state, call before each new parcel.
+        """
+        pass
+
+    def best(self, scores):
+        """
+        Gets the highest scoring label that is not ignored.
+
+        :param scores: Per-label scores.
+        :return: Label index, Score
+        """
+        idx = -1
+        for i in range(len(scores)):
+            if i not in self.ignore and (idx < 0 or scores[i] > scores[idx]):
+                idx = i
+        return idx, scores[idx]
+
+    def vote(self, scores):
+        """
+        Feeds the scores of one frame.
+
+        :param scores: Per-label scores of the frame.
+        :return: Decided label, None if undecided.
+        """
+        idx, score = self.best(scores)
+        return self.labels[idx] if score > self.threshold else None
+
+
+class StreakVoter(Voter):
+    """
+    Decides once a number of consecutive frames are confident about the same label. agree=1 is a single frame decision.
+    """
+
+    def __init__(self, labels, threshold=0.95, agree=1, ignore=("background",)):
+        self.agree = agree
+        Voter.__init__(self, labels, threshold, ignore)
+
+    def reset(self):
+        self.streak = 0
+        self.last = -1
+
+    def vote(self, scores):
+        idx, score = self.best(scores)
+        if score > self.threshold:
+            self.streak = self.streak + 1 if idx == self.last else 1
+            self.last = idx
+        else:
+            self.streak = 0
+            self.last = -1
+        return self.labels[idx] if self.streak >= self.agree else None
+
+
+class EMAVoter(Voter):
+    """
+    Decides once the exponential moving average of a label's score goes over the threshold, after at least min_frames
+    frames so that one confident frame cannot decide on its own.
+    """
+
+    def __init__(self, labels, threshold=0.8, alpha=0.5, min_frames=2, ignore=("background",)):
+        """
+        :param alpha: Weight of the newest frame.
+        :param min_frames: Frames needed before deciding, 1 with alpha 1.0 is a single frame decision.
+        """
+        self.alpha = alpha
+        self.min_frames = min_frames
+        Voter.__init__(self, labels, threshold, ignore)
+
+    def reset(self):
+        self.ema = None
+        self.frames = 0
+
+    def vote(self, scores):
+        if self.ema is None:
+            self.ema = list(scores)
+        else:
+            for i in range(len(scores)):
+                self.ema[i] += self.alpha * (scores[i] - self.ema[i])
+        self.frames += 1
+        idx, score = self.best(self.ema)
+        return self.labels[idx] if score > self.threshold and self.frames >= self.min_frames else None
+
+
+class KofNVoter(Voter):
+    """
+    Decides once k of the last n frames are confident about the same label.
+    """
+
+    def __init__(self, labels, threshold=0.7, k=3, n=5, ignore=("background",)):
+        self.k = k
+        self.n = n
+        Voter.__init__(self, labels, threshold, ignore)
+
+    def reset(self):
+        self.window = [-1] * self.n
+        self.pos = 0
+
+    def vote(self, scores):
+        idx, score = self.best(scores)
+        self.window[self.pos] = idx if score > self.threshold else -1
+        self.pos = (self.pos + 1) % self.n
+        if idx >= 0 and self.window.count(idx) >= self.k:
+            return self.labels[idx]
+        return None
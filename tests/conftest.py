@@ -0,0 +1,12 @@
+"""
+Puts the camera scripts (OpenMV), the host tools and stand-in camera modules (OpenMV/host, OpenMV/host/openmv) and the
+cloud side (AWS) on the import path, the way the scripts themselves find each other. Modules needing packages that
+are not installed are skipped by the tests importing them.
+"""
+
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for folder in (("AWS",), ("OpenMV", "host", "openmv"), ("OpenMV", "host"), ("OpenMV",)):
+    sys.path.insert(0, os.path.join(ROOT, *folder))
@@ -0,0 +1,114 @@
+"""
+Message batches (OpenMV/batch.py, OpenMV/fixedzlib.py), as packed on the camera and unpacked by pullS3.
+"""
+
+import random
+import struct
+import types
+import zlib
+
+import pytest
+
+import batch
+import fixedzlib
+
+MESSAGES = [b"{Telemetry,A=SMPUB:12/0/1/3.5.2.1.1,Q=rssi:18;ber:99,P=timeout:30}",
+            b"{Seen Again,EAN13,5012345678900,D=cam-01}"] * 6
+
+
+def pack(messages, **kwargs):
+    batcher = batch.Batcher(**kwargs)
+    for i, message in enumerate(messages):
+        batcher.add(message, now=i)
+    return batcher
+
+
+def testRoundTrip():
+    batcher = pack(MESSAGES + ["café"])
+    data = batcher.pack()
+    assert data[2] & batch.COMPRESSED
+    assert batch.unpack(data) == MESSAGES + ["café".encode("utf-8")]
+    assert batcher.pack() is None
+
+
+def testUncompressedRoundTrip():
+    data = pack(MESSAGES, compression=False).pack()
+    assert not data[2] & batch.COMPRESSED
+    assert batch.unpack(data) == MESSAGES
+
+
+def testLimitSplitsBatches():
+    batcher = pack([bytes(random.Random(i).getrandbits(8) for _ in range(100)) for i in range(20)], limit=512)
+    unpacked = []
+    while batcher.messages:
+        data = batcher.pack()
+        assert len(data) <= 512
+        unpacked += batch.unpack(data)
+    assert len(unpacked) == 20
+    assert batcher.batches > 1
+
+
+def testEmptyBatch():
+    batcher = batch.Batcher()
+    assert batcher.pack() is None
+    assert not batcher.due(now=1000)
+    assert batch.unpack(struct.pack(batch.HEAD, batch.MAGIC, batch.VERSION, 0, 0)) == []
+
+
+def testDueWhenOld():
+    batcher = pack(MESSAGES[:1], max_age=300)
+    assert not batcher.due(now=299)
+    assert batcher.due(now=300)
+
+
+def testWrongMagic():
+    data = pack(MESSAGES).pack()
+    with pytest.raises(ValueError, match="not a message batch"):
+        batch.unpack(b"\xa5" + data[1:])
+    with pytest.raises(ValueError, match="not a message batch"):
+        batch.unpack(b"")
+
+
+def testUnknownVersion():
+    data = pack(MESSAGES).pack()
+    with pytest.raises(ValueError, match="version 2"):
+        batch.unpack(data[:1] + b"\x02" + data[2:])
+
+
+def testTruncated():
+    data = pack(MESSAGES, compression=False).pack()
+    for n in range(batch.HEAD_SIZE, len(data)):
+        with pytest.raises(ValueError, match="truncated"):
+            batch.unpack(data[:n])
+
+
+def testFixedZlibInflates():
+    rng = random.Random(1)
+    samples = [b"", b"a", b"abc" * 200, bytes(rng.getrandbits(8) for _ in range(5000)), b"".join(MESSAGES),
+               bytes(rng.choice(b"ab") for _ in range(10000))]
+    for data in samples:
+        assert zlib.decompress(fixedzlib.compress(data)) == data
+    assert fixedzlib.adler32(samples[3]) == zlib.adler32(samples[3])
+
+
+def testPlainPythonFallback(monkeypatch):
+    # Stock firmware: zlib can only decompress and there is no deflate module
+    monkeypatch.setattr(batch, "zlib", types.SimpleNamespace(decompress=zlib.decompress))
+    monkeypatch.setattr(batch, "deflate", None)
+    data = pack(MESSAGES).pack()
+    assert data[2] & batch.COMPRESSED
+    assert batch.unpack(data) == MESSAGES
+
+
+def testPullS3MatchesUnpack():
+    pullS3 = pytest.importorskip("pullS3")
+    data = pack(MESSAGES).pack()
+    assert data.startswith(pullS3.BATCH_MAGIC)
+    assert pullS3.parseBatch(data) == MESSAGES
+    assert pullS3.parseBatch(struct.pack(batch.HEAD, batch.MAGIC, batch.VERSION, 0, 0)) == []
+    with pytest.raises(ValueError, match="truncated"):
+        pullS3.parseBatch(data[:batch.HEAD_SIZE - 1])
+    with pytest.raises(ValueError, match="decompress"):
+        pullS3.parseBatch(data[:-4])
+    with pytest.raises(ValueError, match="version"):
+        pullS3.parseBatch(data[:1] + b"\x02" + data[2:])
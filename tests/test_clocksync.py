@@ -0,0 +1,48 @@
+"""
+Camera clock sync from the modem clock (OpenMV/clocksync.py).
+"""
+
+import calendar
+
+import clocksync
+
+# 2024-06-10 12:00:00 UTC
+NOON = calendar.timegm((2024, 6, 10, 12, 0, 0))
+
+
+def testCivilDays():
+    for date in ((1970, 1, 1), (2000, 2, 29), (2024, 3, 1), (2099, 12, 31)):
+        assert clocksync.civilDays(*date) * 86400 == calendar.timegm(date + (0, 0, 0))
+
+
+def testParseCclkUtc():
+    assert clocksync.parseCclk('\r\n+CCLK: "24/06/10,12:00:00+00"\r\n\r\nOK\r\n') == NOON
+
+
+def testParseCclkTimeZoneSign():
+    # +08 quarter hours is local time 2 hours ahead of UTC, -20 is 5 hours behind
+    assert clocksync.parseCclk('+CCLK: "24/06/10,14:00:00+08"') == NOON
+    assert clocksync.parseCclk('+CCLK: "24/06/10,07:00:00-20"') == NOON
+    assert clocksync.parseCclk('+CCLK: "24/06/11,02:30:00+58"') == NOON
+
+
+def testParseCclkUnsetClock():
+    assert clocksync.parseCclk('+CCLK: "00/01/01,00:00:11+00"') is None
+    assert clocksync.parseCclk('+CCLK: "04/01/01,00:00:00+00"') is None
+
+
+def testParseCclkMalformed():
+    assert clocksync.parseCclk("ERROR") is None
+    assert clocksync.parseCclk('+CCLK: "24/06/10"') is None
+    assert clocksync.parseCclk('+CCLK: "xx/06/10,12:00:00+00"') is None
+
+
+def testDeviceClock():
+    clock = clocksync.DeviceClock(resync=3600)
+    assert clock.due(now=5)
+    assert clock.unix(5) == 0
+    assert not clock.sync(None, now=5)
+    assert clock.sync(NOON, now=100)
+    assert clock.unix(160.5) == NOON + 60
+    assert not clock.due(now=3700)
+    assert clock.due(now=3701)
@@ -0,0 +1,21 @@
+"""
+Enumerations kept in places that cannot import each other: the camera (barcode_types, metarecord), the host tools
+(host/classifier) and the cloud side (pullS3). Records carry indexes into them, so a reorder or a missed addition in one
+copy would silently mislabel results.
+"""
+
+import pytest
+
+import barcode_types
+import classifier
+import metarecord
+
+
+def testLabelsMatch():
+    pullS3 = pytest.importorskip("pullS3")
+    assert classifier.LABELS == metarecord.LABELS == pullS3.LABELS
+
+
+def testBarcodeTypesMatch():
+    pullS3 = pytest.importorskip("pullS3")
+    assert metarecord.BARCODE_TYPES == barcode_types.BARCODE_TYPES == pullS3.BARCODE_TYPES
@@ -0,0 +1,58 @@
+"""
+Hex encoding of image chunks in OpenMV/main.py. main.py needs a replay attached to the camera stand-ins to import (see
+host/replay.py), so the encoding functions are compiled on their own from its source.
+"""
+
+import ast
+import binascii
+import os
+
+import pytest
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "OpenMV", "main.py")
+
+
+def loadFunctions(path, names):
+    """
+    :param path: Script file.
+    :param names: Top level function and constant names to compile.
+    :return: Dictionary of name to object.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    nodes = [node for node in tree.body
+             if isinstance(node, ast.FunctionDef) and node.name in names
+             or isinstance(node, ast.Assign) and any(getattr(t, "id", None) in names for t in node.targets)]
+    scope = {}
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), path, "exec"), scope)
+    return scope
+
+
+@pytest.fixture(scope="module")
+def main():
+    return loadFunctions(MAIN, ("HEX_DIGITS", "hexlifyInto", "hexChunks"))
+
+
+def testHexlifyIntoMatchesBinascii(main):
+    src = bytes(range(256))
+    dst = bytearray(2 * len(src) + 4)
+    assert main["hexlifyInto"](memoryview(src), dst) == 2 * len(src)
+    assert bytes(dst[:2 * len(src)]) == binascii.hexlify(src)
+
+
+def testHexlifyIntoEmpty(main):
+    assert main["hexlifyInto"](b"", bytearray()) == 0
+
+
+def testHexChunksRoundTrip(main):
+    data = bytes(range(256)) * 5 + b"\xff\xd9"
+    for size in (1, 7, 512, 4096):
+        # Chunks share one scratch buffer, so each is copied before the next is requested
+        chunks = [bytes(chunk) for chunk in main["hexChunks"](memoryview(data), size)]
+        assert len(chunks) == -(-len(data) // size)
+        assert all(len(chunk) <= 2 * size for chunk in chunks)
+        assert binascii.unhexlify(b"".join(chunks)) == data
+
+
+def testHexChunksEmpty(main):
+    assert list(main["hexChunks"](memoryview(b""), 512)) == []
@@ -0,0 +1,80 @@
+"""
+Binary image metadata records (OpenMV/metarecord.py), as encoded on the camera and decoded by pullS3.
+"""
+
+import struct
+
+import pytest
+
+import metarecord
+
+RECORD = metarecord.encode("EAN13", "5012345678900", "Damaged Parcel", "cam-01", confidence=0.9,
+                           timestamp=1718000000, fields=("S=tf:1/2/3/4",))
+
+
+def testRoundTrip():
+    assert metarecord.decode(RECORD) == {
+        "version": 1, "time": 1718000000, "type": "EAN13", "payload": "5012345678900", "label": "Damaged Parcel",
+        "confidence": 230 / 255, "device": "cam-01", "fields": ["S=tf:1/2/3/4"]}
+
+
+def testUnknownValues():
+    record = metarecord.decode(metarecord.encode("NOPE", "1,2}", "Box", "cam-01", confidence=1.5))
+    assert (record["type"], record["label"], record["confidence"]) == (None, None, 1.0)
+    assert record["payload"] == "1,2}"
+    assert record["fields"] == []
+
+
+def testWrongMagic():
+    with pytest.raises(ValueError, match="not a metadata record"):
+        metarecord.decode(b"{" + RECORD[1:])
+    with pytest.raises(ValueError, match="not a metadata record"):
+        metarecord.decode(b"")
+
+
+def testUnknownVersion():
+    with pytest.raises(ValueError, match="version 2"):
+        metarecord.decode(RECORD[:1] + b"\x02" + RECORD[2:])
+
+
+def testTruncated():
+    for n in range(1, len(RECORD)):
+        with pytest.raises(ValueError):
+            metarecord.decode(RECORD[:n])
+
+
+def testDeclaredLengthPastEnd():
+    # Device length claims more bytes than the record holds
+    record = RECORD[:metarecord.HEAD_SIZE] + struct.pack("<B", 200) + RECORD[metarecord.HEAD_SIZE + 1:]
+    with pytest.raises(ValueError, match="truncated"):
+        metarecord.decode(record)
+
+
+def testTextTruncatesOnCharacterBoundary():
+    for value in ("\u00e9" * 200, "a" + "\u20ac" * 100, "\U0001F600" * 70):
+        data = metarecord.text(value, 255)
+        assert len(data) <= 255
+        assert value.startswith(data.decode("utf-8"))
+    assert metarecord.text("x" * 300, 255) == b"x" * 255
+
+
+def testLongPayloadDecodes():
+    record = metarecord.encode("EAN13", "\u00e9" * 200, "Parcel", "cam-01")
+    assert metarecord.decode(record)["payload"] == "\u00e9" * 127
+
+
+def testPullS3DecodesLongPayload():
+    pullS3 = pytest.importorskip("pullS3")
+    record = metarecord.encode("EAN13", "\u00e9" * 200, "Parcel", "cam-01")
+    assert pullS3.parseHeader(record)[:3] == ["EAN13", "\u00e9" * 127, "Parcel"]
+
+
+def testPullS3MatchesDecode():
+    pullS3 = pytest.importorskip("pullS3")
+    assert pullS3.parseHeader(RECORD) == ["EAN13", "5012345678900", "Damaged Parcel", "S=tf:1/2/3/4", "D=cam-01",
+                                          "C=0.902", "T=1718000000"]
+    for n in (1, metarecord.HEAD_SIZE, len(RECORD) - 1):
+        with pytest.raises(ValueError, match="truncated"):
+            pullS3.parseRecord(RECORD[:n])
+    with pytest.raises(ValueError, match="version"):
+        pullS3.parseRecord(RECORD[:1] + b"\x02" + RECORD[2:])
@@ -0,0 +1,40 @@
+"""
+Recently uploaded barcode cache (OpenMV/recentcache.py).
+"""
+
+import recentcache
+
+KEY = ("EAN13", "5012345678900")
+
+
+def testSeenExtendsEntry():
+    cache = recentcache.RecentCache(ttl=60)
+    cache.add(KEY, now=0)
+    assert cache.seen(KEY, now=50) == 50
+    # The re-scan at 50 s keeps the parcel in the cache past the TTL from its upload
+    assert cache.seen(KEY, now=100) == 50
+    assert cache.seen(KEY, now=161) is None
+
+
+def testUnknownBarcode():
+    assert recentcache.RecentCache().seen(KEY, now=0) is None
+
+
+def testFullCacheDropsLeastRecentlySeen():
+    cache = recentcache.RecentCache(ttl=60, capacity=2)
+    cache.add(("EAN13", "1"), now=0)
+    cache.add(("EAN13", "2"), now=1)
+    cache.seen(("EAN13", "1"), now=2)
+    cache.add(("EAN13", "3"), now=3)
+    assert cache.seen(("EAN13", "2"), now=4) is None
+    assert cache.seen(("EAN13", "1"), now=4) == 2
+    assert cache.seen(("EAN13", "3"), now=4) == 1
+
+
+def testFullCacheDropsExpiredFirst():
+    cache = recentcache.RecentCache(ttl=10, capacity=2)
+    cache.add(("EAN13", "1"), now=0)
+    cache.add(("EAN13", "2"), now=20)
+    cache.add(("EAN13", "3"), now=21)
+    assert cache.seen(("EAN13", "2"), now=22) == 2
+    assert cache.seen(("EAN13", "3"), now=22) == 1
@@ -0,0 +1,55 @@
+"""
+Hour, day and week detection rollups (AWS/pullS3.py Rollups).
+"""
+
+import datetime
+
+import pytest
+
+pullS3 = pytest.importorskip("pullS3")
+
+# A Wednesday
+START = datetime.datetime(2024, 5, 15, 10, 30)
+
+
+def testBucketStarts():
+    assert pullS3.Rollups.bucket(START, "hour") == datetime.datetime(2024, 5, 15, 10)
+    assert pullS3.Rollups.bucket(START, "day") == datetime.datetime(2024, 5, 15)
+    assert pullS3.Rollups.bucket(START, "week") == datetime.datetime(2024, 5, 13)
+
+
+def testQueryFillsEmptyBuckets():
+    rollups = pullS3.Rollups()
+    for hours in (0, 0, 3):
+        rollups.add(START + datetime.timedelta(hours=hours))
+    resolution, keys, counts = rollups.query()
+    assert resolution == "hour"
+    assert keys == [datetime.datetime(2024, 5, 15, 10 + h) for h in range(4)]
+    assert counts == [2, 0, 0, 1]
+
+
+def testEmptyQuery():
+    assert pullS3.Rollups().query() == ("hour", [], [])
+
+
+def testLongWindowUsesCoarserResolution():
+    rollups = pullS3.Rollups()
+    for days in range(0, 60, 7):
+        rollups.add(START + datetime.timedelta(days=days))
+    end = START + datetime.timedelta(days=60)
+    resolution, keys, counts = rollups.query(START, end)
+    assert resolution == "day"
+    assert sum(counts) == 9
+    resolution, keys, counts = rollups.query(START, end, resolution="week")
+    assert keys[0] == datetime.datetime(2024, 5, 13)
+    assert counts == [1] * 9
+
+
+def testChangedSinceVersion():
+    rollups = pullS3.Rollups()
+    rollups.add(START, version=1)
+    rollups.add(START + datetime.timedelta(hours=2), version=2)
+    end = START + datetime.timedelta(hours=3)
+    assert rollups.changed("hour", 1, START, end) == [(datetime.datetime(2024, 5, 15, 12), 1)]
+    assert rollups.changed("day", 1, START, end) == [(datetime.datetime(2024, 5, 15), 2)]
+    assert rollups.changed("hour", 2, START, end) == []
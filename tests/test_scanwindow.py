@@ -0,0 +1,80 @@
+"""
+Barcode scan window auto-tuning (OpenMV/scanwindow.py).
+"""
+
+import scanwindow
+
+
+class Code:
+    """
+    Barcode found by find_barcodes().
+    """
+
+    def __init__(self, payload, quality, rect=(100, 10, 200, 20)):
+        self._payload = payload
+        self._quality = quality
+        self._rect = rect
+
+    def payload(self):
+        return self._payload
+
+    def quality(self):
+        return self._quality
+
+    def rect(self):
+        return self._rect
+
+
+def testCyclesStripsWithoutReads():
+    window = scanwindow.ScanWindow(strips=(220, 160, 280))
+    rows = []
+    for _ in range(4):
+        rows.append(window.window()[1])
+        window.update([], window.window())
+    assert rows == [220, 160, 280, 220]
+
+
+def testGoodReadIsAccepted():
+    window = scanwindow.ScanWindow()
+    code = Code("5012345678900", quality=5)
+    assert window.update([code], window.window()) == [code]
+    assert window.window() == (0, 220, 640, 40)
+
+
+def testLowQualityReadWidensAndConfirms():
+    window = scanwindow.ScanWindow(strips=(220,), wide=120, min_quality=3)
+    assert window.update([Code("123", quality=1)], window.window()) == []
+    # Centred on the barcode, 220 + 10 + 20 // 2 in the frame
+    assert window.window() == (0, 180, 640, 120)
+    again = Code("123", quality=1, rect=(100, 50, 200, 20))
+    assert window.update([again], window.window()) == [again]
+    assert window.window() == (0, 220, 640, 40)
+
+
+def testWideWindowStaysInFrame():
+    window = scanwindow.ScanWindow(strips=(440,), wide=120, frame=480)
+    window.update([Code("123", quality=1, rect=(0, 30, 10, 10))], window.window())
+    assert window.window() == (0, 360, 640, 120)
+    window.update([Code("456", quality=1, rect=(0, 0, 10, 10))], (0, 0, 640, 40), offset=False)
+    assert window.window() == (0, 0, 640, 120)
+
+
+def testWideWindowTimesOut():
+    window = scanwindow.ScanWindow(strips=(220, 160), hold=2)
+    window.update([Code("123", quality=1)], window.window())
+    window.update([], window.window())
+    assert window.window()[3] == 120
+    window.update([], window.window())
+    assert window.window() == (0, 220, 640, 40)
+    # The unconfirmed payload is forgotten
+    assert window.update([Code("123", quality=1)], window.window()) == []
+
+
+def testApplyOnlySetsChangedWindow():
+    window = scanwindow.ScanWindow()
+    calls = []
+    window.apply(calls.append)
+    window.update([], window.window())
+    window.apply(calls.append)
+    window.apply(calls.append)
+    assert calls == [(0, 160, 640, 40)]
@@ -0,0 +1,58 @@
+"""
+Temporal voters over per-frame classifier scores (OpenMV/voting.py).
+"""
+
+import voting
+
+LABELS = ("background", "Damaged Parcel", "Parcel")
+PARCEL = [0.1, 0.0, 0.9]
+DAMAGED = [0.1, 0.9, 0.0]
+UNSURE = [0.4, 0.3, 0.3]
+
+
+def testVoterIgnoresBackground():
+    voter = voting.Voter(LABELS, threshold=0.5)
+    assert voter.vote([0.99, 0.0, 0.01]) is None
+    assert voter.vote(PARCEL) == "Parcel"
+
+
+def testStreakVoterNeedsConsecutiveFrames():
+    voter = voting.StreakVoter(LABELS, threshold=0.8, agree=2)
+    assert voter.vote(PARCEL) is None
+    assert voter.vote(DAMAGED) is None
+    assert voter.vote(DAMAGED) == "Damaged Parcel"
+    voter.reset()
+    assert voter.vote(PARCEL) is None
+    assert voter.vote(UNSURE) is None
+    assert voter.vote(PARCEL) is None
+
+
+def testEmaVoterThresholdIsExclusive():
+    # Scores exactly at the threshold do not decide, just above it do
+    voter = voting.EMAVoter(LABELS, threshold=0.5, alpha=1.0, min_frames=1)
+    assert voter.vote([0.0, 0.0, 0.5]) is None
+    assert voter.vote([0.0, 0.0, 0.5 + 1e-6]) == "Parcel"
+
+
+def testEmaVoterNeedsMinFrames():
+    voter = voting.EMAVoter(LABELS, threshold=0.8, alpha=0.5, min_frames=2)
+    assert voter.vote([0.0, 0.0, 1.0]) is None
+    assert voter.vote([0.0, 0.0, 1.0]) == "Parcel"
+    voter.reset()
+    # One confident frame after an unsure one leaves the average at 0.65
+    assert voter.vote(UNSURE) is None
+    assert voter.vote([0.0, 0.0, 1.0]) is None
+    assert voter.vote([0.0, 0.0, 1.0]) == "Parcel"
+
+
+def testKofNVoterCountsWindow():
+    voter = voting.KofNVoter(LABELS, threshold=0.7, k=2, n=3)
+    assert voter.vote(PARCEL) is None
+    assert voter.vote(UNSURE) is None
+    assert voter.vote(PARCEL) == "Parcel"
+    voter.reset()
+    assert voter.vote(PARCEL) is None
+    assert voter.vote(UNSURE) is None
+    assert voter.vote(UNSURE) is None
+    # The first confident frame has left the window
+    assert voter.vote(PARCEL) is None